@@ -1,87 +1,291 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import Response
 from typing import List, Optional
-from app.schemas.analysis import SoilAnalysisResult, CropSuitabilityResult, ErosionRiskResult
+from datetime import datetime, timezone
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+from app.core.responses import FastJSONResponse
+from app.models.soil_sample import SOIL_PROPERTIES
+from app.schemas.analysis import (
+    SoilAnalysisResult,
+    CropSuitabilityResult,
+    CropSuitabilityBatchRequest,
+    CropSuitabilityLocation,
+    ErosionRiskResult,
+    ZonalStatisticsField,
+)
+from app.schemas.geojson import FeatureCollection
+from app.services.crop_suitability import (
+    crop_indices,
+    crop_suitability_results,
+    suitability_geotiff,
+    suitability_raster,
+)
+from app.services.dem import resolve_raster_path
+from app.services.erosion import ErosionModel, analyze_erosion, soil_loss_map
+from app.services.soil_grids import soil_grid_builder
+from app.services.soil_index import soil_sample_index
+from app.services.soil_samples import parse_bbox
+from app.services.soil_quality import fertility_level, soil_quality_index, soil_quality_recommendations
+from app.services.zonal_stats import (
+    SOIL_LOSS_LAYER,
+    field_polygons,
+    soil_grid_statistics,
+    soil_loss_statistics,
+    validate_percentiles,
+    zonal_layers,
+    zonal_statistics_results,
+)
 
 router = APIRouter()
 
+def crop_indices_or_400(crop_types):
+    try:
+        return crop_indices(crop_types)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def organic_matter_at(longitudes, latitudes):
+    # Erosion still runs without soil grids, with K at its reference organic matter
+    try:
+        return soil_grid_builder.values_at(longitudes, latitudes)[:, SOIL_PROPERTIES.index("organic_matter")]
+    except LookupError:
+        return np.full(len(longitudes), np.nan)
+
+def erosion_model_or_404(dem):
+    model = ErosionModel() if dem is None else ErosionModel(dem=dem)
+    try:
+        resolve_raster_path(model.dem)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"dem must be a file under the raster directory: {model.dem}")
+    except FileNotFoundError:
+        if dem is None:
+            detail = f"No DEM configured for erosion analysis; add {model.dem} to RASTER_DIR, set EROSION_DEM or pass dem="
+        else:
+            detail = f"DEM not found for erosion analysis: {dem}"
+        raise HTTPException(status_code=404, detail=detail)
+
+    # Factor rasters come from the configuration rather than the request, so any unusable path is "not found"
+    for factor, name in (("R", model.r_raster), ("C", model.c_raster), ("P", model.p_raster)):
+        if not name:
+            continue
+        try:
+            resolve_raster_path(name)
+        except (FileNotFoundError, ValueError):
+            raise HTTPException(
+                status_code=404,
+                detail=f"{factor} factor raster for erosion analysis not found under RASTER_DIR: {name}; "
+                       f"fix EROSION_{factor}_RASTER or unset it to use the constant factor",
+            )
+    return model
+
+def soil_values_or_503(longitudes, latitudes):
+    try:
+        return soil_grid_builder.values_at(longitudes, latitudes)
+    except LookupError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+def nearest_sample_distance(longitude, latitude):
+    # Distance (m) to the closest measured sample, None while the sample index is being built
+    try:
+        _, distances = soil_sample_index.nearest([longitude], [latitude])
+    except LookupError:
+        return None
+    distance = float(distances[0, 0])
+    return round(distance, 1) if np.isfinite(distance) else None
+
 @router.get("/soil-quality", response_model=SoilAnalysisResult)
 async def analyze_soil_quality(
-    latitude: float = Query(..., description="Latitude of the location"),
-    longitude: float = Query(..., description="Longitude of the location"),
+    latitude: float = Query(..., ge=-90, le=90, description="Latitude of the location"),
+    longitude: float = Query(..., ge=-180, le=180, description="Longitude of the location"),
     depth: Optional[float] = Query(30.0, description="Soil depth in cm"),
 ):
     """
     Analyze soil quality for a specific location.
+
+    Soil properties are read from grids interpolated (IDW) from the soil samples, so the
+    lookup costs the same however many samples there are; nearest_sample_distance tells how
+    far the closest measured sample is. The samples carry no depth, so the result describes
+    the sampled layer whatever the depth.
     """
-    # This would be replaced with actual analysis logic
+    try:
+        values = soil_grid_builder.values(longitude, latitude)
+    except LookupError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if values is None:
+        raise HTTPException(status_code=404, detail="No soil samples near this location")
+
+    quality_index = round(float(soil_quality_index(values)), 1)
     return {
         "location": {"type": "Point", "coordinates": [longitude, latitude]},
-        "quality_index": 78.5,
-        "fertility_level": "Good",
-        "recommendations": [
-            "Add organic matter to improve soil structure",
-            "Consider adding lime to adjust pH"
-        ],
-        "analysis_date": "2025-07-07T00:00:00"
+        "quality_index": quality_index,
+        "fertility_level": fertility_level(quality_index),
+        "recommendations": soil_quality_recommendations(values),
+        "analysis_date": datetime.now(timezone.utc),
+        "soil_properties": values,
+        "nearest_sample_distance": nearest_sample_distance(longitude, latitude),
     }
 
 @router.get("/crop-suitability", response_model=List[CropSuitabilityResult])
 async def analyze_crop_suitability(
-    latitude: float = Query(..., description="Latitude of the location"),
-    longitude: float = Query(..., description="Longitude of the location"),
+    latitude: float = Query(..., ge=-90, le=90, description="Latitude of the location"),
+    longitude: float = Query(..., ge=-180, le=180, description="Longitude of the location"),
     crop_type: Optional[str] = Query(None, description="Specific crop type to analyze"),
 ):
     """
-    Analyze crop suitability for a specific location.
+    Analyze crop suitability for a specific location, best suited crop first.
+    """
+    crops = crop_indices_or_400([crop_type] if crop_type else None)
+    values = soil_values_or_503([longitude], [latitude])
+    results = crop_suitability_results(values, crops)[0]
+    if results is None:
+        raise HTTPException(status_code=404, detail="No soil samples near this location")
+    return results
+
+@router.post("/crop-suitability/batch", response_model=List[CropSuitabilityLocation])
+def analyze_crop_suitability_batch(request: CropSuitabilityBatchRequest):
+    """
+    Analyze crop suitability for many locations at once.
+
+    All locations are scored against all requested crops in vectorized blocks. Results are
+    returned in the order of the coordinates; results is null where there is no soil data.
+    """
+    crops = crop_indices_or_400(request.crop_types)
+    coordinates = np.array(request.coordinates, dtype=np.float64).reshape(-1, 2)
+    if not (np.all(np.abs(coordinates[:, 0]) <= 180) and np.all(np.abs(coordinates[:, 1]) <= 90)):
+        raise HTTPException(status_code=400, detail="coordinates must be [longitude, latitude] within -180..180 and -90..90")
+
+    values = soil_values_or_503(coordinates[:, 0], coordinates[:, 1])
+    results = crop_suitability_results(values, crops)
+    return FastJSONResponse([
+        {"location": {"type": "Point", "coordinates": point}, "results": result}
+        for point, result in zip(coordinates.tolist(), results)
+    ])
+
+@router.get("/crop-suitability/raster.tif")
+def get_crop_suitability_raster(
+    bbox: str = Query(..., description="min_lon,min_lat,max_lon,max_lat"),
+    crop_type: Optional[List[str]] = Query(None, description="Crops to include, one band each (all when omitted)"),
+    width: int = Query(512, ge=1, le=4096),
+    height: int = Query(512, ge=1, le=4096),
+):
+    """
+    Download crop suitability scores over a bounding box as a GeoTIFF.
+
+    One uint8 band per crop holds the 0-100 score (255 where there is no soil data).
     """
-    # This would be replaced with actual analysis logic
-    return [
-        {
-            "crop_name": "Wheat",
-            "suitability_score": 85,
-            "suitability_level": "High",
-            "limiting_factors": ["Soil pH slightly low"],
-            "recommended_varieties": ["Winter Wheat", "Spring Wheat"]
-        },
-        {
-            "crop_name": "Corn",
-            "suitability_score": 72,
-            "suitability_level": "Medium",
-            "limiting_factors": ["Soil moisture", "Nitrogen level"],
-            "recommended_varieties": ["Drought-resistant varieties"]
-        },
-        {
-            "crop_name": "Soybeans",
-            "suitability_score": 90,
-            "suitability_level": "Very High",
-            "limiting_factors": [],
-            "recommended_varieties": ["All varieties suitable"]
-        }
-    ]
+    crops = crop_indices_or_400(crop_type)
+    try:
+        bounds = parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if bounds[0] == bounds[2] or bounds[1] == bounds[3]:
+        raise HTTPException(status_code=400, detail="bbox must not be empty")
+
+    raster = suitability_raster(soil_values_or_503, bounds, width, height, crops)
+    return Response(
+        suitability_geotiff(raster, bounds, crops),
+        media_type="image/tiff",
+        headers={"Content-Disposition": 'attachment; filename="crop_suitability.tif"'},
+    )
 
 @router.get("/erosion-risk", response_model=ErosionRiskResult)
 async def analyze_erosion_risk(
-    latitude: float = Query(..., description="Latitude of the location"),
-    longitude: float = Query(..., description="Longitude of the location"),
-    area_size: Optional[float] = Query(None, description="Area size in hectares"),
+    latitude: float = Query(..., ge=-90, le=90, description="Latitude of the location"),
+    longitude: float = Query(..., ge=-180, le=180, description="Longitude of the location"),
+    area_size: Optional[float] = Query(None, gt=0, le=100000, description="Area size in hectares"),
+    dem: Optional[str] = Query(None, description="DEM file under the raster directory (configured DEM when omitted)"),
 ):
     """
-    Analyze soil erosion risk for a specific location.
+    Analyze soil erosion risk for a specific location with the RUSLE model.
+
+    annual_soil_loss (t/ha/a) is the value at the location, or the mean over a square of
+    area_size hectares centred on it. LS comes from the DEM, K from the interpolated organic
+    matter and R, C, P from the configured factor rasters; factor tiles are cached, so repeated
+    queries only read them.
     """
-    # This would be replaced with actual analysis logic
-    return {
-        "location": {"type": "Point", "coordinates": [longitude, latitude]},
-        "risk_level": "Medium",
-        "risk_score": 45.2,
-        "annual_soil_loss": 3.5,  # tons per hectare per year
-        "contributing_factors": [
-            "Slope gradient",
-            "Rainfall intensity",
-            "Vegetation cover"
-        ],
-        "mitigation_strategies": [
-            "Implement contour farming",
-            "Plant cover crops during off-season",
-            "Establish buffer strips along water bodies"
-        ]
-    }
\ No newline at end of file
+    model = erosion_model_or_404(dem)
+    try:
+        result = await analyze_erosion(model, longitude, latitude, area_size, organic_matter_at)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Location is outside the DEM or has no elevation data")
+
+    return {"location": {"type": "Point", "coordinates": [longitude, latitude]}, **result}
+
+@router.get("/erosion-risk/raster.tif")
+async def get_erosion_risk_raster(
+    bbox: Optional[str] = Query(None, description="min_lon,min_lat,max_lon,max_lat (whole DEM when omitted)"),
+    dem: Optional[str] = Query(None, description="DEM file under the raster directory (configured DEM when omitted)"),
+):
+    """
+    Download the RUSLE annual soil loss (t/ha/a) map as a GeoTIFF on the DEM grid.
+
+    Factor tiles are computed in parallel in the process pool and cached for later requests.
+    """
+    model = erosion_model_or_404(dem)
+    try:
+        content = await soil_loss_map(model, parse_bbox(bbox), organic_matter_at)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if content is None:
+        raise HTTPException(status_code=404, detail="bbox does not overlap the DEM")
+
+    return Response(
+        content,
+        media_type="image/tiff",
+        headers={"Content-Disposition": 'attachment; filename="soil_loss.tif"'},
+    )
+
+@router.post("/zonal-statistics", response_model=List[ZonalStatisticsField])
+async def get_zonal_statistics(
+    fields: FeatureCollection,
+    layer: Optional[List[str]] = Query(None, description="Soil properties and/or soil_loss (all when omitted)"),
+    percentile: Optional[List[float]] = Query(None, description="Percentiles to report (10, 25, 50, 75, 90 when omitted)"),
+    histogram_bins: int = Query(10, ge=1, le=100),
+    dem: Optional[str] = Query(None, description="DEM file under the raster directory for soil_loss (configured DEM when omitted)"),
+):
+    """
+    Mean, spread, percentiles and histogram of soil properties and soil loss per field polygon.
+
+    All fields are rasterized together into label masks, block by block on the soil property
+    grids and tile by tile on the DEM, and each block is reduced for every field at once with
+    grouped (bincount) reductions, so thousands of fields cost about as much as their combined
+    area. A field that contains no pixel centre is represented by the pixel under a point on
+    its surface; statistics are null where a field has no data. Results are returned in the
+    order of the features.
+    """
+    try:
+        layers = zonal_layers(layer)
+        percentiles = validate_percentiles(percentile)
+        polygons = field_polygons(fields.features)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    statistics = {}
+    soil_layers = [name for name in layers if name != SOIL_LOSS_LAYER]
+    if soil_layers:
+        try:
+            grid = soil_grid_builder.current()
+        except LookupError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        statistics.update(await run_in_threadpool(
+            soil_grid_statistics, grid, polygons, soil_layers, percentiles, histogram_bins,
+        ))
+    if SOIL_LOSS_LAYER in layers:
+        model = erosion_model_or_404(dem)
+        try:
+            statistics[SOIL_LOSS_LAYER] = await soil_loss_statistics(
+                model, polygons, organic_matter_at, percentiles, histogram_bins,
+            )
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return FastJSONResponse(zonal_statistics_results(fields.features, {name: statistics[name] for name in layers}))
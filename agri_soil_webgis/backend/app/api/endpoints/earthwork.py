@@ -1,14 +1,69 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List, Dict, Any, Optional, Tuple
-from pydantic import BaseModel
+import asyncio
+from fastapi import APIRouter, HTTPException, File, Form, Query, Request, UploadFile
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import List, Dict, Optional
+from pydantic import BaseModel, Field, ValidationError
 import numpy as np
-from shapely.geometry import Polygon, Point
+import shapely
+from shapely.geometry import Polygon
 import json
 from scipy.spatial import Delaunay
-import math
+from app.core.responses import FastJSONResponse
+from app.services.earthwork import (
+    GRID_INTERPOLATION_METHODS,
+    clip_triangles,
+    integrate_grid_scenarios,
+    integrate_grid_volumes,
+    integrate_tin_scenarios,
+    integrate_tin_volumes,
+    iter_lattice_points,
+    TINGeometry,
+)
+from app.services.balance import CutFillCurve, grid_design_elements, haul_balance, plane_offsets, tin_design_elements
+from app.services.columnar import read_sample_columns
+from app.services.cache import LRUCache, content_hash
+from app.services.difference_raster import (
+    EMPTY_TILE_PNG,
+    encode_png,
+    rasterize_grid_differences,
+    rasterize_tin_differences,
+    render_tile,
+    to_geotiff,
+)
+from app.services.dem import integrate_dem_volumes, raster_fingerprint, resolve_raster_path
+from app.services.jobs import job_store, run_in_process
+from app.services.parcels import (
+    crop_triangulation,
+    geographic_areas,
+    integrate_parcel_grid_volumes,
+    integrate_parcel_tin_volumes,
+    parcel_polygons,
+    split_parcel_chunks,
+    triangulate_points,
+)
+from app.services.tin_session import TINSession, tin_session_store
+from app.schemas.geojson import FeatureCollection
+from app.core.config import (
+    COMPUTE_WORKERS,
+    DIFFERENCE_RASTER_CACHE_MAX_BYTES,
+    GEOMETRY_CACHE_MAX_BYTES,
+    INLINE_MAX_POINTS,
+    RESULT_CACHE_MAX_BYTES,
+    TILE_CACHE_MAX_BYTES,
+)
+from app.services.projection import PROJECTION_MODES, LocalFrame, lonlat_arrays, lonlat_to_local
 
 router = APIRouter()
 
+# 内容寻址缓存: 投影坐标与裁剪后的三角网 (按边界和采样点平面位置)，以及完整的计算结果
+geometry_cache = LRUCache(GEOMETRY_CACHE_MAX_BYTES)
+result_cache = LRUCache(RESULT_CACHE_MAX_BYTES)
+
+# 高程差栅格 (按请求内容寻址) 及其 PNG 瓦片
+difference_raster_cache = LRUCache(DIFFERENCE_RASTER_CACHE_MAX_BYTES)
+tile_cache = LRUCache(TILE_CACHE_MAX_BYTES)
+
 # 定义请求模型
 class EarthworkCalculationRequest(BaseModel):
     polygon_coordinates: List[Dict[str, float]]  # 格式: [{"longitude": x, "latitude": y, "height": z}, ...]
@@ -23,11 +78,81 @@ class EarthworkCalculationResponse(BaseModel):
     net_volume: float
     unit: str = "m³"
 
-# 定义三角网计算请求模型
-class TINEarthworkCalculationRequest(BaseModel):
+# 定义DEM栅格计算请求模型
+class DEMEarthworkCalculationRequest(BaseModel):
     polygon_coordinates: List[Dict[str, float]]  # 外部边界多边形
-    sample_points: List[Dict[str, float]]  # 采样点 [{"longitude": x, "latitude": y, "original_height": z1, "target_height": z2}, ...]
+    dem_name: str  # 原始地面DEM文件名 (相对于栅格数据目录)
+    target_height: Optional[float] = None  # 目标平面高程
+    target_dem_name: Optional[str] = None  # 目标设计面DEM文件名，与target_height二选一
+
+# 定义DEM栅格计算响应模型
+class DEMEarthworkCalculationResponse(BaseModel):
+    area: float
+    cut_volume: float
+    fill_volume: float
+    net_volume: float
+    pixel_count: int
+    unit: str = "m³"
+    method: str = "dem"
+
+# 定义后台任务状态模型
+class EarthworkJobStatus(BaseModel):
+    job_id: str
+    operation: str
+    status: str  # "pending"、"running"、"completed" 或 "failed"
+    error: Optional[str] = None
+    created_at: float
+    finished_at: Optional[float] = None
+
+# 定义三角网编辑会话模型
+class TINSessionCreateRequest(BaseModel):
+    polygon_coordinates: List[Dict[str, float]]  # 外部边界多边形
+    sample_points: List[Dict[str, float]]  # 采样点，点ID为其在列表中的序号
+    projection: str = "local"  # 本地坐标投影方式: "local"、"tmerc" 或 "utm"
+
+class TINSessionPointUpdate(BaseModel):
+    id: int  # 点ID
+    longitude: Optional[float] = None
+    latitude: Optional[float] = None
+    original_height: Optional[float] = None
+    target_height: Optional[float] = None
+
+class TINSessionEditRequest(BaseModel):
+    insert: List[Dict[str, float]] = []  # 新增采样点
+    update: List[TINSessionPointUpdate] = []  # 修改采样点 (位置或高程)
+    delete: List[int] = []  # 删除的点ID
+
+class TINSessionResponse(BaseModel):
+    session_id: str
+    area: float
+    cut_volume: float
+    fill_volume: float
+    net_volume: float
+    point_count: int
+    triangle_count: int
+    triangles: List[List[int]] = []  # 全部三角形 (点ID)，创建和查询会话时返回
+    inserted_ids: List[int] = []  # 本次新增点的ID
+    added_triangles: List[List[int]] = []  # 本次新增的三角形 (点ID)
+    removed_triangles: List[List[int]] = []  # 本次移除的三角形 (点ID)
+    unit: str = "m³"
+
+# 定义计算方法参数模型
+class EarthworkMethodOptions(BaseModel):
     calculation_method: str = "tin"  # 计算方法: "tin" 或 "grid"
+    grid_size: float = Field(5.0, gt=0)  # 网格法的网格大小（米）
+    interpolation: str = "nearest"  # 网格法插值方式: "nearest"、"idw" 或 "linear"
+    idw_neighbors: int = Field(8, ge=1)  # 反距离加权使用的邻近采样点数
+    idw_power: float = Field(2.0, gt=0)  # 反距离加权的幂次
+    projection: str = "local"  # 本地坐标投影方式: "local"、"tmerc" 或 "utm"
+
+# 定义三角网计算参数模型
+class TINEarthworkOptions(EarthworkMethodOptions):
+    polygon_coordinates: List[Dict[str, float]]  # 外部边界多边形
+    include_triangles: bool = True  # 是否返回三角形索引 (使用 /difference-raster 瓦片显示时可关闭)
+
+# 定义三角网计算请求模型
+class TINEarthworkCalculationRequest(TINEarthworkOptions):
+    sample_points: List[Dict[str, float]]  # 采样点 [{"longitude": x, "latitude": y, "original_height": z1, "target_height": z2}, ...]
 
 # 定义三角网计算响应模型
 class TINEarthworkCalculationResponse(BaseModel):
@@ -39,6 +164,114 @@ class TINEarthworkCalculationResponse(BaseModel):
     unit: str = "m³"
     method: str = "tin"
 
+# 定义多地块批量计算请求模型
+class ParcelEarthworkBatchRequest(EarthworkMethodOptions):
+    parcels: FeatureCollection  # 地块边界，Polygon 要素集合
+    sample_points: List[Dict[str, float]]  # 所有地块共用的采样点，格式同 /calculate-tin
+
+# 定义单个地块的计算结果模型
+class ParcelEarthworkResult(BaseModel):
+    index: int  # 地块在要素集合中的序号
+    id: Optional[str | int] = None  # 要素ID
+    area: float
+    cut_volume: float
+    fill_volume: float
+    net_volume: float
+    element_count: int  # 参与计算的三角形数 (三角网法) 或网格数 (网格法)
+
+# 定义多地块批量计算响应模型
+class ParcelEarthworkBatchResponse(BaseModel):
+    parcels: List[ParcelEarthworkResult]
+    parcel_count: int
+    total_area: float
+    total_cut_volume: float
+    total_fill_volume: float
+    total_net_volume: float
+    unit: str = "m³"
+    method: str = "tin"
+
+# 定义土方平衡设计参数模型
+class BalancedDesignOptions(TINEarthworkOptions):
+    slope_x: float = 0.0  # 设计面东向坡度 (m/m)，正值表示向东升高
+    slope_y: float = 0.0  # 设计面北向坡度 (m/m)，正值表示向北升高
+    reference_point: Optional[Dict[str, float]] = None  # 设计高程参考点 {"longitude": x, "latitude": y}，默认为边界质心
+    elevation_min: Optional[float] = None  # 挖填曲线的最低设计高程，默认为全部挖方的高程
+    elevation_max: Optional[float] = None  # 挖填曲线的最高设计高程，默认为全部填方的高程
+    curve_points: int = Field(51, ge=2, le=10001)  # 挖填曲线的采样数
+    include_haul: bool = False  # 是否返回土方调配概况
+
+# 定义土方平衡设计请求模型
+class BalancedDesignRequest(BalancedDesignOptions):
+    sample_points: List[Dict[str, float]]  # 采样点，只使用 original_height
+
+# 定义挖填曲线点模型
+class CutFillCurvePoint(BaseModel):
+    elevation: float
+    cut_volume: float
+    fill_volume: float
+    net_volume: float
+
+# 定义土方调配概况模型
+class HaulBalanceResult(BaseModel):
+    cut_centroid: Optional[Dict[str, float]] = None  # 挖方区体积加权质心 {"longitude": x, "latitude": y}
+    fill_centroid: Optional[Dict[str, float]] = None  # 填方区体积加权质心
+    distance: float  # 平均运距 (m)
+    moment: float  # 调配量 × 平均运距 (m³·m)
+
+# 定义土方平衡设计响应模型
+class BalancedDesignResponse(BaseModel):
+    balanced_elevation: float  # 挖填平衡时参考点的设计高程
+    reference_point: Dict[str, float]
+    slope_x: float
+    slope_y: float
+    area: float
+    cut_volume: float  # 平衡状态下的挖方量 (等于填方量)
+    fill_volume: float
+    curve: List[CutFillCurvePoint]
+    haul: Optional[HaulBalanceResult] = None
+    unit: str = "m³"
+    method: str = "tin"
+
+# 定义多方案计算请求模型
+class ScenarioEarthworkRequest(TINEarthworkOptions):
+    sample_points: List[Dict[str, float]]  # 采样点，只使用经纬度和 original_height
+    target_heights: List[List[float]]  # 目标高程矩阵，每行对应一个采样点，每列对应一个设计方案
+    scenario_names: Optional[List[str]] = None  # 方案名称，与目标高程矩阵的列一一对应
+
+# 定义单个方案的计算结果模型
+class ScenarioEarthworkResult(BaseModel):
+    index: int  # 方案在目标高程矩阵中的列号
+    name: Optional[str] = None
+    cut_volume: float
+    fill_volume: float
+    net_volume: float
+
+# 定义多方案计算响应模型
+class ScenarioEarthworkResponse(BaseModel):
+    area: float
+    scenario_count: int
+    scenarios: List[ScenarioEarthworkResult]
+    unit: str = "m³"
+    method: str = "tin"
+
+# 定义高程差栅格请求模型
+class DifferenceRasterRequest(TINEarthworkCalculationRequest):
+    resolution: Optional[float] = Field(None, gt=0)  # 像元大小（米），默认等于 grid_size
+
+# 定义高程差栅格响应模型
+class DifferenceRasterResponse(BaseModel):
+    raster_id: str
+    width: int
+    height: int
+    resolution: float
+    bounds: List[float]  # 经纬度范围 [min_lon, min_lat, max_lon, max_lat]
+    cell_count: int  # 有数据的像元数
+    min_difference: Optional[float] = None  # 最小高程差 (负值为挖方)
+    max_difference: Optional[float] = None  # 最大高程差 (正值为填方)
+    geotiff_url: str
+    tile_url: str  # XYZ 瓦片地址模板
+    method: str = "tin"
+
 @router.post("/calculate", response_model=EarthworkCalculationResponse)
 async def calculate_earthwork(request: EarthworkCalculationRequest):
     """
@@ -112,28 +345,14 @@ def calculate_geographic_area(coordinates):
     - 面积 (平方米)
     """
     # 这是一个简化的计算方法，对于小区域足够精确
-    # 对于大区域或跨越多个经纬度的区域，应使用更精确的地理计算库
-    
-    # 将多边形转换为UTM坐标系统进行面积计算
-    # 这里使用简化的方法，假设地球是球形，使用平均纬度作为参考
+    # 对于大区域或跨越多个经纬度的区域，可使用 LocalFrame 的 tmerc/utm 投影
     
-    # 地球半径 (米)
-    R = 6371000
-    
-    # 计算多边形的平均纬度
-    avg_lat = sum(lat for _, lat in coordinates) / len(coordinates)
-    
-    # 在平均纬度下，1度经度对应的距离 (米)
-    lon_scale = np.cos(np.radians(avg_lat)) * R * np.pi / 180
-    
-    # 1度纬度对应的距离 (米)
-    lat_scale = R * np.pi / 180
-    
-    # 转换坐标为米
-    scaled_coords = [(lon * lon_scale, lat * lat_scale) for lon, lat in coordinates]
+    # 使用平均纬度作为参考，假设地球是球形，一次性转换为本地坐标 (米)
+    coords = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    frame = LocalFrame.from_lonlat(coords[:, 0], coords[:, 1])
     
     # 使用Shapely计算面积
-    polygon = Polygon(scaled_coords)
+    polygon = Polygon(frame.to_local(coords[:, 0], coords[:, 1]))
     return polygon.area
 
 def convert_to_local_coordinates(points, avg_lat=None):
@@ -147,31 +366,9 @@ def convert_to_local_coordinates(points, avg_lat=None):
     返回:
     - 本地坐标列表 [(x, y), ...]
     """
-    # 地球半径 (米)
-    R = 6371000
-    
-    # 计算平均纬度
-    if avg_lat is None:
-        avg_lat = sum(p["latitude"] for p in points) / len(points)
-    
-    # 在平均纬度下，1度经度对应的距离 (米)
-    lon_scale = np.cos(np.radians(avg_lat)) * R * np.pi / 180
-    
-    # 1度纬度对应的距离 (米)
-    lat_scale = R * np.pi / 180
-    
-    # 找到最小经纬度作为原点
-    min_lon = min(p["longitude"] for p in points)
-    min_lat = min(p["latitude"] for p in points)
-    
-    # 转换坐标为米，相对于原点
-    local_coords = []
-    for p in points:
-        x = (p["longitude"] - min_lon) * lon_scale
-        y = (p["latitude"] - min_lat) * lat_scale
-        local_coords.append((x, y))
-    
-    return local_coords
+    # 一次性提取为数组，以最小经纬度为原点转换为米
+    longitudes, latitudes = lonlat_arrays(points)
+    return [tuple(xy) for xy in lonlat_to_local(longitudes, latitudes, avg_lat).tolist()]
 
 def calculate_triangle_area(p1, p2, p3):
     """
@@ -211,21 +408,6 @@ def calculate_triangular_prism_volume(triangle_points, original_heights, target_
     
     return volume
 
-def is_point_in_polygon(point, polygon_points):
-    """
-    检查点是否在多边形内
-    
-    参数:
-    - point: 点坐标 (x, y)
-    - polygon_points: 多边形顶点坐标列表 [(x1, y1), (x2, y2), ...]
-    
-    返回:
-    - 布尔值，表示点是否在多边形内
-    """
-    polygon = Polygon(polygon_points)
-    point_obj = Point(point)
-    return polygon.contains(point_obj)
-
 def generate_tin(points, boundary_polygon=None):
     """
     生成三角不规则网络 (TIN)
@@ -243,36 +425,286 @@ def generate_tin(points, boundary_polygon=None):
     # 使用Delaunay三角剖分
     tri = Delaunay(points_array)
     
-    # 获取三角形列表
-    triangles = tri.simplices.tolist()
-    
-    # 如果提供了边界多边形，过滤掉边界外的三角形
+    # 如果提供了边界多边形，过滤掉边界外及跨越边界的三角形
     if boundary_polygon:
-        filtered_triangles = []
-        for t in triangles:
-            # 计算三角形的中心点
-            p1, p2, p3 = points[t[0]], points[t[1]], points[t[2]]
-            center_x = (p1[0] + p2[0] + p3[0]) / 3
-            center_y = (p1[1] + p2[1] + p3[1]) / 3
-            center = (center_x, center_y)
-            
-            # 检查中心点是否在边界内
-            if is_point_in_polygon(center, boundary_polygon):
-                filtered_triangles.append(t)
+        return clip_triangles(points_array, tri.simplices, boundary_polygon).tolist()
+    
+    return tri.simplices.tolist()
+
+def prepare_tin_geometry(options, longitudes, latitudes):
+    """
+    投影边界和采样点并生成裁剪后的三角网，结果只与边界和采样点平面位置有关
+    
+    参数:
+    - options: TINEarthworkOptions，包含边界多边形和计算方法参数
+    - longitudes / latitudes: 采样点经纬度数组
+    
+    返回:
+    - TINGeometry (网格法不生成三角网)
+    """
+    # 检查多边形是否有效
+    if len(options.polygon_coordinates) < 3:
+        raise ValueError("多边形至少需要3个顶点")
+    
+    # 检查采样点是否足够
+    if len(longitudes) < 3:
+        raise ValueError("至少需要3个采样点才能形成三角网")
+    
+    if options.calculation_method not in ("tin", "grid"):
+        raise ValueError(f"不支持的计算方法: {options.calculation_method}")
+    
+    # 提取边界多边形坐标，以边界建立本地坐标系 (平均纬度 + 最小经纬度原点)
+    boundary_lons, boundary_lats = lonlat_arrays(options.polygon_coordinates)
+    frame = LocalFrame.from_lonlat(boundary_lons, boundary_lats, mode=options.projection)
+    
+    # 边界多边形与采样点使用同一坐标系转换为本地坐标
+    boundary_local = frame.to_local(boundary_lons, boundary_lats)
+    sample_local = frame.to_local(longitudes, latitudes)
+    
+    # 计算区域面积 (local 模式与 calculate_geographic_area 相同)
+    area = float(Polygon(boundary_local).area)
+    
+    triangles = None
+    if options.calculation_method == "tin":
+        # 生成三角网
+        triangles = np.array(generate_tin(sample_local, boundary_local.tolist()), dtype=np.int32).reshape(-1, 3)
+    
+    return TINGeometry(
+        boundary_local=boundary_local, sample_local=sample_local, area=area, triangles=triangles, frame=frame
+    )
+
+def integrate_tin_geometry(options, geometry, original_heights, target_heights):
+    """
+    在已准备好的三角网几何数据上计算填挖方量
+    
+    参数:
+    - options: TINEarthworkOptions
+    - geometry: prepare_tin_geometry 的结果
+    - original_heights / target_heights: 采样点原始高程和目标高程数组
+    
+    返回:
+    - 与 TINEarthworkCalculationResponse 对应的字典
+    """
+    if options.calculation_method == "tin":
+        # 批量计算所有三角形的填挖方量
+        result = integrate_tin_volumes(geometry.sample_local, geometry.triangles, original_heights, target_heights)
+        # 保持为NumPy数组，由 FastJSONResponse 直接编码，避免逐个转换为Python列表
+        triangles = geometry.triangles if options.include_triangles else np.empty((0, 3), dtype=np.int32)
+        
+    else:
+        # 网格法计算: 边界内网格中心一次性判断，基于KD树批量插值
+        if options.interpolation not in GRID_INTERPOLATION_METHODS:
+            raise ValueError(f"不支持的插值方式: {options.interpolation}")
         
-        return filtered_triangles
+        triangles = np.empty((0, 3), dtype=np.int32)  # 网格法不返回三角形
+        result = integrate_grid_volumes(
+            geometry.sample_local,
+            original_heights,
+            target_heights,
+            geometry.boundary_local,
+            grid_size=options.grid_size,
+            interpolation=options.interpolation,
+            idw_neighbors=options.idw_neighbors,
+            idw_power=options.idw_power,
+        )
     
-    return triangles
+    # 返回结果
+    return {
+        "area": round(geometry.area, 2),
+        "cut_volume": round(result.cut_volume, 2),
+        "fill_volume": round(result.fill_volume, 2),
+        "net_volume": round(result.net_volume, 2),
+        "triangles": triangles,
+        "unit": "m³",
+        "method": options.calculation_method
+    }
+
+def compute_tin_earthwork(options, longitudes, latitudes, original_heights, target_heights, geometry=None):
+    """
+    基于采样点数组计算填挖方量，供JSON接口、二进制上传接口和后台任务共用
+    
+    在进程池中执行，输入无效时抛出 ValueError (由 to_http_exception 转换为400错误)。
+    
+    参数:
+    - options: TINEarthworkOptions，包含边界多边形和计算方法参数
+    - longitudes / latitudes: 采样点经纬度数组
+    - original_heights / target_heights: 采样点原始高程和目标高程数组
+    - geometry: 已缓存的 TINGeometry，提供时跳过投影、三角剖分和裁剪
+    
+    返回:
+    - 与 TINEarthworkCalculationResponse 对应的字典
+    """
+    if geometry is None:
+        geometry = prepare_tin_geometry(options, longitudes, latitudes)
+    return integrate_tin_geometry(options, geometry, original_heights, target_heights)
+
+def compute_tin_earthwork_with_geometry(options, longitudes, latitudes, original_heights, target_heights):
+    """
+    同 compute_tin_earthwork，同时返回生成的 TINGeometry 以便主进程缓存
+    
+    返回:
+    - (结果字典, TINGeometry)
+    """
+    geometry = prepare_tin_geometry(options, longitudes, latitudes)
+    return integrate_tin_geometry(options, geometry, original_heights, target_heights), geometry
+
+def tin_geometry_key(options, longitudes, latitudes):
+    """
+    三角网几何缓存键: 边界多边形 + 采样点平面位置 + 计算方法 + 投影方式
+    """
+    return content_hash(
+        "tin-geometry", options.calculation_method, options.projection, options.polygon_coordinates, longitudes, latitudes
+    )
+
+def estimate_response_size(response):
+    """
+    估算结果字典占用的内存 (字节)，主要由三角形索引数组决定
+    """
+    triangles = response.get("triangles")
+    return 1024 + (0 if triangles is None else triangles.nbytes)
+
+async def calculate_tin_cached(options, samples):
+    """
+    带缓存的填挖方计算
+    
+    - 完全相同的请求 (参数、采样点位置和高程均相同) 直接返回缓存的结果
+    - 仅高程变化的请求复用缓存的投影坐标和裁剪后的三角网，直接进入体积积分
+    - 其他请求完整计算，并缓存几何数据与结果
+    """
+    longitudes, latitudes, original_heights, target_heights = samples
+    
+    response_key = content_hash("calculate-tin", options, *samples)
+    response = result_cache.get(response_key)
+    if response is not None:
+        return response
+    
+    inline = len(longitudes) <= INLINE_MAX_POINTS
+    geometry_key = tin_geometry_key(options, longitudes, latitudes)
+    geometry = geometry_cache.get(geometry_key)
+    
+    if geometry is None:
+        response, geometry = await run_earthwork(compute_tin_earthwork_with_geometry, options, *samples, inline=inline)
+        geometry_cache.put(geometry_key, geometry, geometry.nbytes)
+    else:
+        # 三角网法只剩批量积分，直接计算；网格法仍需插值，大规模时在进程池中执行
+        inline = inline or options.calculation_method == "tin"
+        response = await run_earthwork(
+            integrate_tin_geometry, options, geometry, original_heights, target_heights, inline=inline
+        )
+    
+    result_cache.put(response_key, response, estimate_response_size(response))
+    return response
+
+def compute_dem_earthwork(request):
+    """
+    基于本地DEM栅格计算填挖方量，供同步接口和后台任务共用
+    
+    在进程池中执行，文件不存在时抛出 FileNotFoundError，输入无效时抛出 ValueError。
+    
+    参数:
+    - request: DEMEarthworkCalculationRequest
+    
+    返回:
+    - 与 DEMEarthworkCalculationResponse 对应的字典
+    """
+    # 检查多边形是否有效
+    if len(request.polygon_coordinates) < 3:
+        raise ValueError("多边形至少需要3个顶点")
+    
+    if (request.target_height is None) == (request.target_dem_name is None):
+        raise ValueError("target_height 与 target_dem_name 必须且只能提供一个")
+    
+    dem_path = resolve_raster_path(request.dem_name)
+    target_dem_path = None
+    if request.target_dem_name is not None:
+        target_dem_path = resolve_raster_path(request.target_dem_name)
+    
+    # 提取多边形坐标
+    polygon_points = [(point["longitude"], point["latitude"]) for point in request.polygon_coordinates]
+    
+    result = integrate_dem_volumes(
+        dem_path,
+        polygon_points,
+        target_height=request.target_height,
+        target_dem_path=target_dem_path,
+    )
+    
+    # 返回结果
+    return {
+        "area": round(result.area, 2),
+        "cut_volume": round(result.cut_volume, 2),
+        "fill_volume": round(result.fill_volume, 2),
+        "net_volume": round(result.net_volume, 2),
+        "pixel_count": result.pixel_count,
+        "unit": "m³",
+        "method": "dem"
+    }
+
+def to_http_exception(error):
+    """
+    将计算函数抛出的异常转换为HTTP错误
+    
+    - FileNotFoundError: 404
+    - ValueError: 400 (输入无效)
+    - 其他异常: 500
+    """
+    if isinstance(error, HTTPException):
+        return error
+    if isinstance(error, FileNotFoundError):
+        return HTTPException(status_code=404, detail=str(error))
+    if isinstance(error, ValueError):
+        return HTTPException(status_code=400, detail=str(error))
+    return HTTPException(status_code=500, detail=f"计算填挖方量时出错: {str(error)}")
+
+async def run_earthwork(func, *args, inline=False):
+    """
+    执行填挖方计算函数
+    
+    - inline=True: 直接在请求内计算 (用于小规模请求，避免进程间传输的开销)
+    - inline=False: 在进程池中计算，不阻塞事件循环
+    """
+    try:
+        if inline:
+            return func(*args)
+        return await run_in_process(func, *args)
+    except Exception as e:
+        raise to_http_exception(e)
+
+def extract_sample_arrays(sample_points):
+    """
+    将采样点字典列表转换为经纬度和高程数组
+    
+    返回:
+    - (longitudes, latitudes, original_heights, target_heights)
+    """
+    # 只遍历一次字典列表，再拆分为连续的列数组
+    values = np.array(
+        [(p["longitude"], p["latitude"], p.get("original_height", 0), p.get("target_height", 0)) for p in sample_points],
+        dtype=np.float64,
+    ).reshape(-1, 4)
+    return tuple(np.ascontiguousarray(values[:, i]) for i in range(4))
+
+def tin_options(request):
+    """
+    从 TINEarthworkCalculationRequest 中取出不含采样点的计算参数，避免重复传输采样点字典
+    """
+    return TINEarthworkOptions(**request.model_dump(exclude={"sample_points"}))
 
 @router.post("/calculate-tin", response_model=TINEarthworkCalculationResponse)
 async def calculate_tin_earthwork(request: TINEarthworkCalculationRequest):
     """
     使用三角网(TIN)方法计算填挖方量
     
+    采样点较多的请求在进程池中计算，不会阻塞其他请求；耗时较长的计算建议使用 /jobs/calculate-tin。
+    
     参数:
     - polygon_coordinates: 外部边界多边形
     - sample_points: 采样点列表，包含原始高程和目标高程
     - calculation_method: 计算方法，"tin"或"grid"
+    - grid_size: 网格法的网格大小（米），默认5米
+    - interpolation: 网格法插值方式，"nearest"(最近邻)、"idw"(反距离加权) 或 "linear"(三角网线性)
+    - idw_neighbors / idw_power: 反距离加权的邻近点数与幂次
+    - projection: 本地坐标投影方式，"local"(平均纬度近似，默认)、"tmerc"(以场地为中心的横轴墨卡托) 或 "utm"(标准UTM分带)，大范围场地建议使用 tmerc
     
     返回:
     - area: 区域面积 (m²)
@@ -282,150 +714,809 @@ async def calculate_tin_earthwork(request: TINEarthworkCalculationRequest):
     - triangles: 三角形索引列表，用于前端可视化
     """
     try:
-        # 检查多边形是否有效
-        if len(request.polygon_coordinates) < 3:
-            raise HTTPException(status_code=400, detail="多边形至少需要3个顶点")
-        
-        # 检查采样点是否足够
-        if len(request.sample_points) < 3:
-            raise HTTPException(status_code=400, detail="至少需要3个采样点才能形成三角网")
-        
-        # 提取边界多边形坐标
-        boundary_points = request.polygon_coordinates
-        
-        # 计算平均纬度
-        avg_lat = sum(p["latitude"] for p in boundary_points) / len(boundary_points)
-        
-        # 将边界多边形转换为本地坐标
-        boundary_local = convert_to_local_coordinates(boundary_points, avg_lat)
-        
-        # 将采样点转换为本地坐标
-        sample_local = convert_to_local_coordinates(request.sample_points, avg_lat)
-        
-        # 提取原始高程和目标高程
-        original_heights = [p.get("original_height", 0) for p in request.sample_points]
-        target_heights = [p.get("target_height", 0) for p in request.sample_points]
-        
-        # 计算区域面积
-        boundary_coords = [(p["longitude"], p["latitude"]) for p in boundary_points]
-        area = calculate_geographic_area(boundary_coords)
-        
-        # 根据计算方法选择不同的处理方式
-        if request.calculation_method == "tin":
-            # 生成三角网
-            triangles = generate_tin(sample_local, boundary_local)
-            
-            # 计算每个三角形的填挖方量
-            cut_volume = 0
-            fill_volume = 0
-            
-            for t in triangles:
-                # 获取三角形的三个顶点
-                triangle_points = [sample_local[i] for i in t]
-                
-                # 获取三个顶点的原始高程和目标高程
-                triangle_original_heights = [original_heights[i] for i in t]
-                triangle_target_heights = [target_heights[i] for i in t]
-                
-                # 计算三角柱体积
-                volume = calculate_triangular_prism_volume(
-                    triangle_points, 
-                    triangle_original_heights, 
-                    triangle_target_heights
-                )
-                
-                # 根据体积正负确定是填方还是挖方
-                if volume > 0:
-                    fill_volume += volume
-                else:
-                    cut_volume -= volume  # 转为正值
-            
-            # 计算净体积
-            net_volume = fill_volume - cut_volume
-            
-            # 返回结果
-            return {
-                "area": round(area, 2),
-                "cut_volume": round(cut_volume, 2),
-                "fill_volume": round(fill_volume, 2),
-                "net_volume": round(net_volume, 2),
-                "triangles": triangles,
-                "unit": "m³",
-                "method": "tin"
-            }
-        
-        elif request.calculation_method == "grid":
-            # 网格法计算（简化版，实际应用中可能需要更复杂的实现）
-            # 这里仅作为示例，实际应用中可能需要更精确的网格划分
-            
-            # 创建一个简单的网格
-            grid_size = 5  # 5米网格
-            
-            # 找到边界范围
-            min_x = min(p[0] for p in boundary_local)
-            min_y = min(p[1] for p in boundary_local)
-            max_x = max(p[0] for p in boundary_local)
-            max_y = max(p[1] for p in boundary_local)
-            
-            # 计算网格数量
-            grid_count_x = math.ceil((max_x - min_x) / grid_size)
-            grid_count_y = math.ceil((max_y - min_y) / grid_size)
-            
-            # 初始化体积
-            cut_volume = 0
-            fill_volume = 0
-            
-            # 遍历网格
-            for i in range(grid_count_x):
-                for j in range(grid_count_y):
-                    # 计算网格中心点
-                    center_x = min_x + (i + 0.5) * grid_size
-                    center_y = min_y + (j + 0.5) * grid_size
-                    center = (center_x, center_y)
-                    
-                    # 检查中心点是否在边界内
-                    if is_point_in_polygon(center, boundary_local):
-                        # 找到最近的采样点，计算高程差
-                        # 这里使用简单的最近邻插值，实际应用中可能需要更复杂的插值方法
-                        nearest_idx = min(range(len(sample_local)), 
-                                         key=lambda i: (sample_local[i][0] - center_x)**2 + 
-                                                      (sample_local[i][1] - center_y)**2)
-                        
-                        # 获取原始高程和目标高程
-                        original_height = original_heights[nearest_idx]
-                        target_height = target_heights[nearest_idx]
-                        
-                        # 计算高程差
-                        height_diff = target_height - original_height
-                        
-                        # 计算网格体积
-                        volume = grid_size * grid_size * height_diff
-                        
-                        # 根据体积正负确定是填方还是挖方
-                        if volume > 0:
-                            fill_volume += volume
-                        else:
-                            cut_volume -= volume  # 转为正值
-            
-            # 计算净体积
-            net_volume = fill_volume - cut_volume
-            
-            # 返回结果
-            return {
-                "area": round(area, 2),
-                "cut_volume": round(cut_volume, 2),
-                "fill_volume": round(fill_volume, 2),
-                "net_volume": round(net_volume, 2),
-                "triangles": [],  # 网格法不返回三角形
-                "unit": "m³",
-                "method": "grid"
-            }
-        
+        samples = extract_sample_arrays(request.sample_points)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"采样点格式错误: {str(e)}")
+    
+    return FastJSONResponse(await calculate_tin_cached(tin_options(request), samples))
+
+async def read_upload_options_and_samples(options, sample_file):
+    """
+    解析二进制上传接口的参数字段和采样点文件
+    """
+    try:
+        options = TINEarthworkOptions.model_validate_json(options)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    
+    try:
+        samples = read_sample_columns(await sample_file.read())
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"无法读取采样点文件: {str(e)}")
+    
+    return options, (
+        samples["longitude"],
+        samples["latitude"],
+        samples["original_height"],
+        samples["target_height"],
+    )
+
+@router.post("/calculate-tin/upload", response_model=TINEarthworkCalculationResponse)
+async def calculate_tin_earthwork_upload(
+    options: str = Form(..., description="TINEarthworkOptions 的JSON字符串"),
+    sample_file: UploadFile = File(..., description="采样点列式二进制文件 (.npz / .npy / Arrow IPC)"),
+):
+    """
+    上传列式二进制采样点数据，使用三角网(TIN)或网格法计算填挖方量
+    
+    采样点数组直接进入NumPy计算流程，不会逐点转换为Python对象，适用于数十万点的测量数据。
+    
+    参数 (multipart/form-data):
+    - options: JSON字符串，包含 polygon_coordinates、calculation_method、grid_size 等参数 (同 /calculate-tin，不含 sample_points)
+    - sample_file: 采样点文件，包含 longitude、latitude、original_height、target_height 四列
+      - .npz: 每列一个数组
+      - .npy: 结构化数组，或按上述列顺序排列的 (n, 2~4) 二维数组
+      - Arrow IPC 文件或流 (需要安装 pyarrow)
+    
+    返回:
+    - 同 /calculate-tin
+    """
+    options, samples = await read_upload_options_and_samples(options, sample_file)
+    
+    return FastJSONResponse(await calculate_tin_cached(options, samples))
+
+def compute_parcel_chunk(options, boundaries, points, original_heights, target_heights, triangles=None):
+    """
+    计算一组地块的填挖方量，供多地块批量接口在进程池中并行执行
+    
+    参数:
+    - options: EarthworkMethodOptions
+    - boundaries: 本地坐标的地块多边形数组
+    - points: 采样点本地坐标数组 (三角网法只包含该组地块外包矩形内的采样点)
+    - original_heights / target_heights: 采样点原始高程和目标高程数组
+    - triangles: 三角网法使用的三角形顶点索引数组 (对应 points)
+    
+    返回:
+    - ParcelVolumeResult
+    """
+    if options.calculation_method == "tin":
+        return integrate_parcel_tin_volumes(points, triangles, original_heights, target_heights, boundaries)
+    
+    return integrate_parcel_grid_volumes(
+        points,
+        original_heights,
+        target_heights,
+        boundaries,
+        grid_size=options.grid_size,
+        interpolation=options.interpolation,
+        idw_neighbors=options.idw_neighbors,
+        idw_power=options.idw_power,
+    )
+
+@router.post("/calculate-parcels", response_model=ParcelEarthworkBatchResponse)
+async def calculate_parcel_earthwork(request: ParcelEarthworkBatchRequest):
+    """
+    使用同一组采样点批量计算多个地块的填挖方量
+    
+    适用于土地整理等包含大量地块的项目: 所有地块的面积一次性向量化计算，
+    采样点只投影一次 (三角网法只做一次三角剖分)，各地块的裁剪与体积积分按空间分组在进程池中并行执行。
+    
+    参数:
+    - parcels: GeoJSON FeatureCollection，每个要素为一个地块 (Polygon，可带内环)
+    - sample_points: 采样点列表，包含原始高程和目标高程 (同 /calculate-tin)
+    - calculation_method / grid_size / interpolation / idw_neighbors / idw_power / projection: 同 /calculate-tin
+    
+    返回:
+    - parcels: 每个地块的面积、挖方量、填方量、净体积，顺序与输入要素一致
+    - total_area / total_cut_volume / total_fill_volume / total_net_volume: 所有地块的合计
+    """
+    if request.calculation_method not in ("tin", "grid"):
+        raise HTTPException(status_code=400, detail=f"不支持的计算方法: {request.calculation_method}")
+    
+    if request.calculation_method == "grid" and request.interpolation not in GRID_INTERPOLATION_METHODS:
+        raise HTTPException(status_code=400, detail=f"不支持的插值方式: {request.interpolation}")
+    
+    try:
+        longitudes, latitudes, original_heights, target_heights = extract_sample_arrays(request.sample_points)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"采样点格式错误: {str(e)}")
+    
+    if len(longitudes) < 3:
+        raise HTTPException(status_code=400, detail="至少需要3个采样点才能形成三角网")
+    
+    try:
+        polygons = parcel_polygons(request.parcels.features)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if request.projection not in PROJECTION_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的投影方式: {request.projection}")
+    
+    # 采样点与所有地块使用同一本地坐标系，地块坐标可直接与三角网比较
+    parcel_coords = shapely.get_coordinates(polygons)
+    frame = LocalFrame.from_lonlat(parcel_coords[:, 0], parcel_coords[:, 1], mode=request.projection)
+    sample_local = frame.to_local(longitudes, latitudes)
+    boundaries = frame.transform_geometry(polygons)
+    
+    # local 模式下面积按每个地块自身的平均纬度计算 (同 /calculate)，投影模式下直接取投影面积
+    if request.projection == "local":
+        areas = geographic_areas(polygons)
+    else:
+        areas = shapely.area(boundaries)
+    
+    options = EarthworkMethodOptions(**request.model_dump(exclude={"parcels", "sample_points"}))
+    inline = len(longitudes) <= INLINE_MAX_POINTS
+    
+    triangles = None
+    if options.calculation_method == "tin":
+        triangles = await run_earthwork(triangulate_points, sample_local, inline=inline)
+    
+    # 按空间分组并行计算；三角网法只向子进程传输该组地块外包矩形内的采样点和三角形
+    chunks = [np.arange(len(boundaries))] if inline else split_parcel_chunks(boundaries, COMPUTE_WORKERS)
+    tasks = []
+    for chunk in chunks:
+        if triangles is not None:
+            vertex_ids, chunk_triangles = crop_triangulation(sample_local, triangles, shapely.total_bounds(boundaries[chunk]))
+            args = (
+                boundaries[chunk],
+                sample_local[vertex_ids],
+                original_heights[vertex_ids],
+                target_heights[vertex_ids],
+                chunk_triangles,
+            )
         else:
-            raise HTTPException(status_code=400, detail=f"不支持的计算方法: {request.calculation_method}")
+            args = (boundaries[chunk], sample_local, original_heights, target_heights)
+        tasks.append(run_earthwork(compute_parcel_chunk, options, *args, inline=inline))
+    chunk_results = await asyncio.gather(*tasks)
+    
+    counts = np.zeros(len(boundaries), dtype=np.int64)
+    cut_volumes = np.zeros(len(boundaries), dtype=np.float64)
+    fill_volumes = np.zeros(len(boundaries), dtype=np.float64)
+    for chunk, result in zip(chunks, chunk_results):
+        counts[chunk] = result.counts
+        cut_volumes[chunk] = result.cut_volumes
+        fill_volumes[chunk] = result.fill_volumes
+    
+    parcels = [
+        {
+            "index": i,
+            "id": feature.id,
+            "area": round(float(areas[i]), 2),
+            "cut_volume": round(float(cut_volumes[i]), 2),
+            "fill_volume": round(float(fill_volumes[i]), 2),
+            "net_volume": round(float(fill_volumes[i] - cut_volumes[i]), 2),
+            "element_count": int(counts[i]),
+        }
+        for i, feature in enumerate(request.parcels.features)
+    ]
+    
+    # 返回结果
+    return FastJSONResponse({
+        "parcels": parcels,
+        "parcel_count": len(parcels),
+        "total_area": round(float(areas.sum()), 2),
+        "total_cut_volume": round(float(cut_volumes.sum()), 2),
+        "total_fill_volume": round(float(fill_volumes.sum()), 2),
+        "total_net_volume": round(float(fill_volumes.sum() - cut_volumes.sum()), 2),
+        "unit": "m³",
+        "method": options.calculation_method
+    })
+
+def compute_balanced_design(options, geometry, original_heights):
+    """
+    在已准备好的三角网几何数据上求解挖填平衡的设计高程
+    
+    设计面为过参考点的平面 (slope_x = slope_y = 0 时为水平面)，整体升降时各计算单元的体积
+    与设计高程呈分段线性关系，全部候选高程的挖填方量通过一次排序和累积和向量化计算。
+    
+    参数:
+    - options: BalancedDesignOptions
+    - geometry: prepare_tin_geometry 的结果
+    - original_heights: 采样点原始高程数组
+    
+    返回:
+    - 与 BalancedDesignResponse 对应的字典
+    """
+    if options.calculation_method == "tin":
+        elements = tin_design_elements(geometry.sample_local, geometry.triangles, original_heights)
+    else:
+        elements = grid_design_elements(
+            geometry.sample_local,
+            original_heights,
+            geometry.boundary_local,
+            grid_size=options.grid_size,
+            interpolation=options.interpolation,
+            idw_neighbors=options.idw_neighbors,
+            idw_power=options.idw_power,
+        )
+    
+    frame = geometry.frame
+    if options.reference_point is None:
+        reference = np.array(Polygon(geometry.boundary_local).centroid.coords[0])
+    else:
+        reference = frame.to_local([options.reference_point["longitude"]], [options.reference_point["latitude"]])[0]
+    
+    # 每个单元恰好不挖不填时的参考点设计高程
+    levels = elements.ground - plane_offsets(elements.centroids, options.slope_x, options.slope_y, reference)
+    curve = CutFillCurve(elements.areas, levels)
+    balanced_elevation = curve.balanced_level
+    
+    low = curve.levels[0] if options.elevation_min is None else options.elevation_min
+    high = curve.levels[-1] if options.elevation_max is None else options.elevation_max
+    if low > high:
+        raise ValueError("elevation_min 不能大于 elevation_max")
+    
+    elevations = np.linspace(low, high, options.curve_points)
+    cut_volumes, fill_volumes = curve(elevations)
+    balanced_cut, balanced_fill = curve([balanced_elevation])
+    
+    def to_lonlat(point):
+        longitudes, latitudes = frame.to_lonlat(point)
+        return {"longitude": float(longitudes[0]), "latitude": float(latitudes[0])}
+    
+    haul = None
+    if options.include_haul:
+        balance = haul_balance(elements, levels, balanced_elevation)
+        haul = {
+            "cut_centroid": None if balance.cut_centroid is None else to_lonlat(balance.cut_centroid),
+            "fill_centroid": None if balance.fill_centroid is None else to_lonlat(balance.fill_centroid),
+            "distance": round(balance.distance, 2),
+            "moment": round(balance.moment, 2),
+        }
     
+    # 返回结果
+    return {
+        "balanced_elevation": round(float(balanced_elevation), 3),
+        "reference_point": to_lonlat(reference),
+        "slope_x": options.slope_x,
+        "slope_y": options.slope_y,
+        "area": round(geometry.area, 2),
+        "cut_volume": round(float(balanced_cut[0]), 2),
+        "fill_volume": round(float(balanced_fill[0]), 2),
+        "curve": [
+            {
+                "elevation": round(elevation, 3),
+                "cut_volume": round(cut, 2),
+                "fill_volume": round(fill, 2),
+                "net_volume": round(fill - cut, 2),
+            }
+            for elevation, cut, fill in zip(elevations.tolist(), cut_volumes.tolist(), fill_volumes.tolist())
+        ],
+        "haul": haul,
+        "unit": "m³",
+        "method": options.calculation_method
+    }
+
+async def get_tin_geometry(options, longitudes, latitudes):
+    """
+    获取 (必要时生成并缓存) 三角网几何数据，与 /calculate-tin 共用几何缓存
+    """
+    geometry_key = tin_geometry_key(options, longitudes, latitudes)
+    geometry = geometry_cache.get(geometry_key)
+    if geometry is None:
+        inline = len(longitudes) <= INLINE_MAX_POINTS
+        geometry = await run_earthwork(prepare_tin_geometry, options, longitudes, latitudes, inline=inline)
+        geometry_cache.put(geometry_key, geometry, geometry.nbytes)
+    return geometry
+
+@router.post("/balance-design", response_model=BalancedDesignResponse)
+async def calculate_balanced_design(request: BalancedDesignRequest):
+    """
+    求解挖填平衡 (净体积为零) 的设计高程
+    
+    只做一次三角剖分 (与 /calculate-tin 共用几何缓存)，对整组候选设计高程向量化计算挖填方量，
+    一次请求即可得到平衡高程和完整的挖填曲线，无需客户端反复调用 /calculate-tin 二分查找。
+    
+    参数:
+    - polygon_coordinates / sample_points / calculation_method / grid_size / interpolation / projection: 同 /calculate-tin (只使用采样点的 original_height)
+    - slope_x / slope_y: 设计面东向、北向坡度 (m/m)，均为0时为水平面
+    - reference_point: 设计高程参考点，默认为边界质心
+    - elevation_min / elevation_max / curve_points: 挖填曲线的高程范围与采样数
+    - include_haul: 是否返回平衡状态下挖方区、填方区质心与平均运距
+    
+    返回:
+    - balanced_elevation: 挖填平衡时参考点的设计高程
+    - cut_volume / fill_volume: 平衡状态下的挖方量与填方量 (m³)
+    - curve: 各候选设计高程下的挖方量、填方量和净体积
+    - haul: 土方调配概况 (include_haul 为 true 时)
+    """
+    try:
+        longitudes, latitudes, original_heights, _ = extract_sample_arrays(request.sample_points)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"计算填挖方量时出错: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"采样点格式错误: {str(e)}")
+    
+    options = BalancedDesignOptions(**request.model_dump(exclude={"sample_points"}))
+    geometry = await get_tin_geometry(options, longitudes, latitudes)
+    
+    inline = len(longitudes) <= INLINE_MAX_POINTS
+    return FastJSONResponse(
+        await run_earthwork(compute_balanced_design, options, geometry, original_heights, inline=inline)
+    )
+
+def compute_scenario_earthwork(options, geometry, original_heights, target_heights, scenario_names=None):
+    """
+    在已准备好的三角网几何数据上一次性计算多个设计方案的填挖方量
+    
+    参数:
+    - options: TINEarthworkOptions
+    - geometry: prepare_tin_geometry 的结果
+    - original_heights: 采样点原始高程数组，形状 (n,)
+    - target_heights: 目标高程矩阵，形状 (n, k)
+    - scenario_names: 方案名称列表
+    
+    返回:
+    - 与 ScenarioEarthworkResponse 对应的字典
+    """
+    if options.calculation_method == "tin":
+        result = integrate_tin_scenarios(geometry.sample_local, geometry.triangles, original_heights, target_heights)
+    else:
+        result = integrate_grid_scenarios(
+            geometry.sample_local,
+            original_heights,
+            target_heights,
+            geometry.boundary_local,
+            grid_size=options.grid_size,
+            interpolation=options.interpolation,
+            idw_neighbors=options.idw_neighbors,
+            idw_power=options.idw_power,
+        )
+    
+    scenarios = [
+        {
+            "index": i,
+            "name": scenario_names[i] if scenario_names else None,
+            "cut_volume": round(cut, 2),
+            "fill_volume": round(fill, 2),
+            "net_volume": round(net, 2),
+        }
+        for i, (cut, fill, net) in enumerate(zip(
+            result.cut_volumes.tolist(), result.fill_volumes.tolist(), result.net_volumes.tolist()
+        ))
+    ]
+    
+    # 返回结果
+    return {
+        "area": round(geometry.area, 2),
+        "scenario_count": len(scenarios),
+        "scenarios": scenarios,
+        "unit": "m³",
+        "method": options.calculation_method
+    }
+
+@router.post("/calculate-scenarios", response_model=ScenarioEarthworkResponse)
+async def calculate_scenario_earthwork(request: ScenarioEarthworkRequest):
+    """
+    一次请求比较多个设计方案的填挖方量
+    
+    同一组测量采样点只传输、投影和三角剖分一次 (与 /calculate-tin 共用几何缓存)，
+    所有方案的挖方、填方和净体积作为 (三角形 × 方案) 矩阵批量计算。
+    
+    参数:
+    - polygon_coordinates / sample_points / calculation_method / grid_size / interpolation / projection: 同 /calculate-tin (采样点的 target_height 不使用)
+    - target_heights: 目标高程矩阵，每行对应一个采样点，每列对应一个设计方案
+    - scenario_names: 方案名称 (可选)
+    
+    返回:
+    - area: 区域面积 (m²)
+    - scenarios: 每个方案的挖方量、填方量、净体积，顺序与目标高程矩阵的列一致
+    """
+    try:
+        longitudes, latitudes, original_heights, _ = extract_sample_arrays(request.sample_points)
+        target_heights = np.array(request.target_heights, dtype=np.float64)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"采样点格式错误: {str(e)}")
+    
+    if target_heights.ndim != 2 or target_heights.shape[0] != len(longitudes) or target_heights.shape[1] == 0:
+        raise HTTPException(status_code=400, detail="target_heights 必须为 (采样点数 × 方案数) 的矩阵")
+    
+    if request.scenario_names is not None and len(request.scenario_names) != target_heights.shape[1]:
+        raise HTTPException(status_code=400, detail="scenario_names 的数量必须与方案数一致")
+    
+    options = TINEarthworkOptions(**request.model_dump(exclude={"sample_points", "target_heights", "scenario_names"}))
+    geometry = await get_tin_geometry(options, longitudes, latitudes)
+    
+    inline = target_heights.size <= INLINE_MAX_POINTS
+    return FastJSONResponse(await run_earthwork(
+        compute_scenario_earthwork, options, geometry, original_heights, target_heights, request.scenario_names,
+        inline=inline,
+    ))
+
+def compute_difference_raster(options, geometry, original_heights, target_heights, resolution):
+    """
+    将三角网或网格法的高程差 (目标 - 原始) 栅格化
+    
+    - 三角网法: 在裁剪后的三角网上线性插值，三角网外为无数据
+    - 网格法: 按所选插值方式计算边界内每个像元中心的高程差
+    
+    返回:
+    - DifferenceRaster
+    """
+    height_diffs = np.asarray(target_heights, dtype=np.float64) - np.asarray(original_heights, dtype=np.float64)
+    if options.calculation_method == "tin":
+        return rasterize_tin_differences(
+            geometry.sample_local, geometry.triangles, height_diffs, geometry.boundary_local, resolution, geometry.frame
+        )
+    
+    return rasterize_grid_differences(
+        geometry.sample_local,
+        height_diffs,
+        geometry.boundary_local,
+        resolution,
+        geometry.frame,
+        interpolation=options.interpolation,
+        idw_neighbors=options.idw_neighbors,
+        idw_power=options.idw_power,
+    )
+
+def get_difference_raster_or_404(raster_id):
+    raster = difference_raster_cache.get(raster_id)
+    if raster is None:
+        raise HTTPException(status_code=404, detail="栅格不存在或已过期，请重新生成")
+    return raster
+
+@router.post("/difference-raster", response_model=DifferenceRasterResponse)
+async def create_difference_raster(request: DifferenceRasterRequest, http_request: Request):
+    """
+    生成填挖方高程差栅格，供GeoTIFF下载和地图瓦片显示
+    
+    代替在JSON中返回完整的三角形列表: 高程差在服务端栅格化为单波段数组，
+    前端通过XYZ瓦片只加载可见范围，或下载压缩的GeoTIFF。相同请求返回相同的 raster_id。
+    
+    参数:
+    - 同 /calculate-tin
+    - resolution: 像元大小（米），默认等于 grid_size
+    
+    返回:
+    - raster_id: 栅格ID
+    - geotiff_url: GeoTIFF 下载地址 (DEFLATE 压缩的 float32，无数据为 NaN)
+    - tile_url: XYZ PNG 瓦片地址模板 (挖方红色、填方蓝色)
+    - bounds / width / height / min_difference / max_difference: 栅格范围与统计
+    """
+    try:
+        samples = extract_sample_arrays(request.sample_points)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"采样点格式错误: {str(e)}")
+    
+    options = TINEarthworkOptions(**request.model_dump(exclude={"sample_points", "resolution"}))
+    resolution = request.resolution or options.grid_size
+    raster_id = content_hash("difference-raster", options, resolution, *samples)[:32]
+    
+    raster = difference_raster_cache.get(raster_id)
+    if raster is None:
+        geometry = await get_tin_geometry(options, samples[0], samples[1])
+        inline = len(samples[0]) <= INLINE_MAX_POINTS
+        raster = await run_earthwork(
+            compute_difference_raster, options, geometry, samples[2], samples[3], resolution, inline=inline
+        )
+        difference_raster_cache.put(raster_id, raster, raster.nbytes)
+    
+    base_path = http_request.url.path.rsplit("/", 1)[0]
+    rows, cols = raster.values.shape
+    return {
+        "raster_id": raster_id,
+        "width": cols,
+        "height": rows,
+        "resolution": resolution,
+        "bounds": list(raster.lonlat_bounds),
+        **raster.statistics(),
+        "geotiff_url": f"{base_path}/difference-raster/{raster_id}.tif",
+        "tile_url": f"{base_path}/difference-raster/{raster_id}/tiles/{{z}}/{{x}}/{{y}}.png",
+        "method": options.calculation_method
+    }
+
+@router.get("/difference-raster/{raster_id}.tif")
+async def download_difference_raster(raster_id: str):
+    """
+    下载高程差栅格 (GeoTIFF)
+    """
+    raster = get_difference_raster_or_404(raster_id)
+    content = await run_in_threadpool(to_geotiff, raster)
+    return Response(
+        content,
+        media_type="image/tiff",
+        headers={"Content-Disposition": f'attachment; filename="cut_fill_{raster_id}.tif"'},
+    )
+
+@router.get("/difference-raster/{raster_id}/tiles/{z}/{x}/{y}.png")
+async def get_difference_raster_tile(
+    raster_id: str,
+    z: int,
+    x: int,
+    y: int,
+    max_abs: Optional[float] = Query(None, gt=0, description="颜色满量程对应的 |高程差| (米)，默认为栅格最大值"),
+):
+    """
+    获取高程差栅格的 XYZ (Web Mercator) PNG 瓦片
+    
+    挖方为红色、填方为蓝色，颜色深浅与 |高程差| 成正比，无数据处透明。瓦片渲染后缓存。
+    """
+    if not 0 <= z <= 24 or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise HTTPException(status_code=400, detail="瓦片编号无效")
+    
+    tile_key = (raster_id, z, x, y, max_abs)
+    content = tile_cache.get(tile_key)
+    if content is None:
+        raster = get_difference_raster_or_404(raster_id)
+        rgba = await run_in_threadpool(render_tile, raster, z, x, y, max_abs)
+        content = EMPTY_TILE_PNG if rgba is None else await run_in_threadpool(encode_png, rgba)
+        tile_cache.put(tile_key, content, len(content))
+    
+    return Response(content, media_type="image/png", headers={"Cache-Control": "public, max-age=86400"})
+
+@router.post("/calculate-dem", response_model=DEMEarthworkCalculationResponse)
+async def calculate_dem_earthwork(request: DEMEarthworkCalculationRequest):
+    """
+    基于本地DEM栅格(GeoTIFF)计算填挖方量
+    
+    只按块读取覆盖多边形外包矩形的栅格窗口，不会整体加载DEM；计算在进程池中执行。
+    
+    参数:
+    - polygon_coordinates: 外部边界多边形
+    - dem_name: 原始地面DEM文件名 (相对于栅格数据目录 RASTER_DIR)
+    - target_height: 目标平面高程
+    - target_dem_name: 目标设计面DEM文件名，与target_height二选一
+    
+    返回:
+    - area: 参与计算的像元总面积 (m²)
+    - cut_volume: 挖方量 (m³)
+    - fill_volume: 填方量 (m³)
+    - net_volume: 净体积 (填方 - 挖方) (m³)
+    - pixel_count: 参与计算的像元数量
+    """
+    # DEM文件的修改时间和大小参与缓存键，文件更新后缓存自动失效
+    try:
+        fingerprints = [raster_fingerprint(request.dem_name)]
+        if request.target_dem_name is not None:
+            fingerprints.append(raster_fingerprint(request.target_dem_name))
+    except Exception as e:
+        raise to_http_exception(e)
+    
+    response_key = content_hash("calculate-dem", request, fingerprints)
+    response = result_cache.get(response_key)
+    if response is None:
+        response = await run_earthwork(compute_dem_earthwork, request)
+        result_cache.put(response_key, response, estimate_response_size(response))
+    return FastJSONResponse(response)
+
+@router.post("/jobs/calculate-tin", response_model=EarthworkJobStatus, status_code=202)
+async def submit_tin_earthwork_job(request: TINEarthworkCalculationRequest):
+    """
+    提交后台三角网(TIN)/网格法填挖方计算任务
+    
+    参数同 /calculate-tin。立即返回任务ID，通过 GET /jobs/{job_id} 查询状态，
+    通过 GET /jobs/{job_id}/result 获取计算结果。
+    """
+    try:
+        samples = extract_sample_arrays(request.sample_points)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"采样点格式错误: {str(e)}")
+    
+    options = tin_options(request)
+    geometry = geometry_cache.get(tin_geometry_key(options, samples[0], samples[1]))
+    job = job_store.submit("calculate-tin", compute_tin_earthwork, options, *samples, geometry=geometry)
+    return job.to_dict()
+
+@router.post("/jobs/calculate-tin/upload", response_model=EarthworkJobStatus, status_code=202)
+async def submit_tin_earthwork_upload_job(
+    options: str = Form(..., description="TINEarthworkOptions 的JSON字符串"),
+    sample_file: UploadFile = File(..., description="采样点列式二进制文件 (.npz / .npy / Arrow IPC)"),
+):
+    """
+    提交后台填挖方计算任务，采样点以列式二进制文件上传
+    
+    参数同 /calculate-tin/upload，返回值同 /jobs/calculate-tin。
+    """
+    options, samples = await read_upload_options_and_samples(options, sample_file)
+    
+    geometry = geometry_cache.get(tin_geometry_key(options, samples[0], samples[1]))
+    job = job_store.submit("calculate-tin", compute_tin_earthwork, options, *samples, geometry=geometry)
+    return job.to_dict()
+
+@router.post("/jobs/calculate-dem", response_model=EarthworkJobStatus, status_code=202)
+async def submit_dem_earthwork_job(request: DEMEarthworkCalculationRequest):
+    """
+    提交后台DEM栅格填挖方计算任务
+    
+    参数同 /calculate-dem，返回值同 /jobs/calculate-tin。
+    """
+    job = job_store.submit("calculate-dem", compute_dem_earthwork, request)
+    return job.to_dict()
+
+@router.get("/jobs/{job_id}", response_model=EarthworkJobStatus)
+async def get_earthwork_job(job_id: str):
+    """
+    查询后台计算任务状态
+    
+    返回:
+    - status: "pending"(排队中)、"running"(计算中)、"completed"(已完成) 或 "failed"(失败)
+    - error: 失败原因
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    
+    return job.to_dict()
+
+@router.get("/jobs/{job_id}/result")
+async def get_earthwork_job_result(job_id: str):
+    """
+    获取后台计算任务的结果
+    
+    - 任务未完成时返回409
+    - 任务失败时返回与同步接口相同的错误 (400/404/500)
+    - 任务完成时返回与对应同步接口相同的结果
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    
+    if not job.future.done():
+        raise HTTPException(status_code=409, detail=f"任务尚未完成，当前状态: {job.status}")
+    
+    if job.future.cancelled():
+        raise HTTPException(status_code=500, detail=job.error)
+    
+    error = job.future.exception()
+    if error is not None:
+        raise to_http_exception(error)
+    
+    return FastJSONResponse(job.future.result())
+
+def tin_session_response(session, **fields):
+    """
+    组装完整的 TINSessionResponse 字典
+    
+    结果由 FastJSONResponse 直接返回，不再经过 response_model 补全默认值，因此未返回的字段在这里显式置空。
+    """
+    response = dict(session.summary(), triangles=[], inserted_ids=[], added_triangles=[], removed_triangles=[])
+    response.update(fields)
+    return response
+
+def create_tin_session(request):
+    """
+    建立三角网编辑会话 (在线程池中执行)
+    """
+    longitudes, latitudes, original_heights, target_heights = extract_sample_arrays(request.sample_points)
+    boundary = [(p["longitude"], p["latitude"]) for p in request.polygon_coordinates]
+    session = TINSession(
+        boundary, longitudes, latitudes, original_heights, target_heights, projection=request.projection
+    )
+    tin_session_store.add(session)
+    return tin_session_response(session, triangles=session.kept_triangle_ids())
+
+def edit_tin_session(session, request):
+    """
+    对会话应用一批点位编辑 (在线程池中执行，同一会话的编辑串行执行)
+    """
+    with session.lock:
+        changes = session.apply_edits(
+            inserts=request.insert,
+            updates=[update.model_dump(exclude_none=True) for update in request.update],
+            deletes=request.delete,
+        )
+        return tin_session_response(session, **changes)
+
+def read_tin_session(session):
+    """
+    读取会话的当前结果和全部三角形 (在线程池中执行，等待进行中的编辑时不阻塞事件循环)
+    """
+    with session.lock:
+        return tin_session_response(session, triangles=session.kept_triangle_ids())
+
+def get_tin_session_or_404(session_id):
+    session = tin_session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="会话不存在或已过期")
+    return session
+
+@router.post("/tin-sessions", response_model=TINSessionResponse)
+async def create_tin_earthwork_session(request: TINSessionCreateRequest):
+    """
+    创建三角网编辑会话
+    
+    三角网保存在服务端，之后通过 /tin-sessions/{session_id}/edits 提交点位的增删改，
+    每次编辑只处理受影响的三角形，无需重新提交全部采样点。
+    
+    参数:
+    - polygon_coordinates: 外部边界多边形
+    - sample_points: 采样点列表，点ID为其在列表中的序号
+    
+    返回:
+    - session_id: 会话ID
+    - area / cut_volume / fill_volume / net_volume: 当前填挖方结果
+    - triangles: 全部三角形 (以点ID表示)
+    """
+    try:
+        return FastJSONResponse(await run_in_threadpool(create_tin_session, request))
+    except Exception as e:
+        raise to_http_exception(e)
+
+@router.post("/tin-sessions/{session_id}/edits", response_model=TINSessionResponse)
+async def edit_tin_earthwork_session(session_id: str, request: TINSessionEditRequest):
+    """
+    对三角网编辑会话提交一批点位编辑
+    
+    参数:
+    - insert: 新增采样点 [{"longitude", "latitude", "original_height", "target_height"}, ...]
+    - update: 修改采样点 [{"id", 可选 "longitude"/"latitude"/"original_height"/"target_height"}, ...]
+    - delete: 删除的点ID列表
+    
+    返回:
+    - 更新后的填挖方结果
+    - inserted_ids: 新增点的ID
+    - added_triangles / removed_triangles: 本次新增和移除的三角形 (以点ID表示)，用于前端局部更新
+    """
+    session = get_tin_session_or_404(session_id)
+    try:
+        return FastJSONResponse(await run_in_threadpool(edit_tin_session, session, request))
+    except Exception as e:
+        raise to_http_exception(e)
+
+@router.get("/tin-sessions/{session_id}", response_model=TINSessionResponse)
+async def get_tin_earthwork_session(session_id: str):
+    """
+    查询三角网编辑会话的当前结果，包含全部三角形
+    """
+    session = get_tin_session_or_404(session_id)
+    return FastJSONResponse(await run_in_threadpool(read_tin_session, session))
+
+@router.delete("/tin-sessions/{session_id}")
+async def delete_tin_earthwork_session(session_id: str):
+    """
+    删除三角网编辑会话
+    """
+    if not tin_session_store.remove(session_id):
+        raise HTTPException(status_code=404, detail="会话不存在或已过期")
+    
+    return {"message": "会话已删除"}
+
+def iter_sample_point_batches(frame, boundary_local, grid_size):
+    """
+    按行分批生成多边形内的采样点经纬度
+    
+    参数:
+    - frame: 多边形的本地坐标系 (LocalFrame)
+    - boundary_local: 多边形顶点本地坐标数组，形状 (b, 2)
+    - grid_size: 网格大小（米）
+    
+    返回:
+    - 迭代器，每次产出 (经度数组, 纬度数组)
+    """
+    # 按行批量生成格网节点并转换回经纬度坐标
+    for nodes in iter_lattice_points(boundary_local, grid_size, cell_centers=False):
+        yield frame.to_lonlat(nodes)
+
+def iter_sample_point_ndjson(batches, original_height, target_height):
+    """
+    将采样点批次编码为NDJSON文本块，每批一块，每行一个采样点
+    """
+    heights = f'"original_height":{json.dumps(original_height)},"target_height":{json.dumps(target_height)}'
+    for lons, lats in batches:
+        yield "".join(
+            f'{{"longitude":{lon!r},"latitude":{lat!r},{heights}}}\n'
+            for lon, lat in zip(lons.tolist(), lats.tolist())
+        )
+
+def sample_points_response(batches, original_height, target_height):
+    """
+    将采样点批次汇总并编码为JSON响应（CPU密集，在线程池中调用，不阻塞事件循环）
+    """
+    sample_points = []
+    for lons, lats in batches:
+        sample_points.extend(
+            {
+                "longitude": lon,
+                "latitude": lat,
+                "original_height": original_height,
+                "target_height": target_height
+            }
+            for lon, lat in zip(lons.tolist(), lats.tolist())
+        )
+    
+    return FastJSONResponse({
+        "sample_points": sample_points,
+        "count": len(sample_points)
+    })
 
 @router.post("/generate-sample-points")
 async def generate_sample_points(request: dict):
@@ -437,6 +1528,7 @@ async def generate_sample_points(request: dict):
     - grid_size: 网格大小（米）
     - original_height: 默认原始高程
     - target_height: 默认目标高程
+    - format: 返回格式，"json"(默认) 或 "ndjson"；ndjson 按行分批流式返回，每行一个采样点，内存占用与区域大小无关
     
     返回:
     - sample_points: 采样点列表 [{"longitude": x, "latitude": y, "original_height": z1, "target_height": z2}, ...]
@@ -446,76 +1538,38 @@ async def generate_sample_points(request: dict):
         grid_size = request.get("grid_size", 10)  # 默认10米网格
         original_height = request.get("original_height", 0)
         target_height = request.get("target_height", 0)
+        response_format = request.get("format", "json")
         
         if len(coordinates) < 3:
             return {"error": "多边形至少需要3个顶点"}
         
-        # 提取多边形坐标
-        polygon_points = [(point["longitude"], point["latitude"]) for point in coordinates]
+        if grid_size <= 0:
+            return {"error": "网格大小必须大于0"}
+        
+        if response_format not in ("json", "ndjson"):
+            return {"error": f"不支持的返回格式: {response_format}"}
+        
+        # 提取多边形坐标，建立本地坐标系 (平均纬度 + 最小经纬度原点)
+        longitudes, latitudes = lonlat_arrays(coordinates)
+        frame = LocalFrame.from_lonlat(longitudes, latitudes)
+        boundary_local = frame.to_local(longitudes, latitudes)
         
         # 创建Shapely多边形
-        polygon = Polygon(polygon_points)
+        polygon = Polygon(boundary_local)
         
         if not polygon.is_valid:
             return {"error": "多边形无效，可能存在自相交"}
         
-        # 计算平均纬度
-        avg_lat = sum(point["latitude"] for point in coordinates) / len(coordinates)
-        
-        # 将多边形转换为本地坐标
-        local_coords = convert_to_local_coordinates(coordinates, avg_lat)
-        
-        # 找到边界范围
-        min_x = min(p[0] for p in local_coords)
-        min_y = min(p[1] for p in local_coords)
-        max_x = max(p[0] for p in local_coords)
-        max_y = max(p[1] for p in local_coords)
-        
-        # 计算网格数量
-        grid_count_x = math.ceil((max_x - min_x) / grid_size)
-        grid_count_y = math.ceil((max_y - min_y) / grid_size)
-        
-        # 生成网格点
-        sample_points = []
+        batches = iter_sample_point_batches(frame, boundary_local, grid_size)
         
-        # 地球半径 (米)
-        R = 6371000
+        if response_format == "ndjson":
+            return StreamingResponse(
+                iter_sample_point_ndjson(batches, original_height, target_height),
+                media_type="application/x-ndjson",
+            )
         
-        # 在平均纬度下，1米对应的经度变化
-        lon_scale = 1 / (np.cos(np.radians(avg_lat)) * R * np.pi / 180)
-        
-        # 1米对应的纬度变化
-        lat_scale = 1 / (R * np.pi / 180)
-        
-        # 找到最小经纬度作为原点
-        min_lon = min(p["longitude"] for p in coordinates)
-        min_lat = min(p["latitude"] for p in coordinates)
-        
-        # 遍历网格
-        for i in range(grid_count_x + 1):
-            for j in range(grid_count_y + 1):
-                # 计算本地坐标
-                x = min_x + i * grid_size
-                y = min_y + j * grid_size
-                
-                # 检查点是否在多边形内
-                if is_point_in_polygon((x, y), local_coords):
-                    # 转换回经纬度坐标
-                    lon = min_lon + x * lon_scale
-                    lat = min_lat + y * lat_scale
-                    
-                    # 添加采样点
-                    sample_points.append({
-                        "longitude": lon,
-                        "latitude": lat,
-                        "original_height": original_height,
-                        "target_height": target_height
-                    })
-        
-        return {
-            "sample_points": sample_points,
-            "count": len(sample_points)
-        }
+        # 生成网格点并编码，点数随区域和网格大小增长，放到线程池中执行
+        return await run_in_threadpool(sample_points_response, batches, original_height, target_height)
     
     except Exception as e:
         return {"error": f"生成采样点时出错: {str(e)}"}
@@ -1,144 +1,211 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+import hashlib
+from fastapi import APIRouter, HTTPException, Depends, File, Form, Query, Request, UploadFile
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.orm import Session
 from typing import List, Optional
-from app.schemas.soil_data import SoilData, SoilDataCreate, SoilDataUpdate
-from app.schemas.geojson import FeatureCollection
+from app.core.responses import FastJSONResponse
+from app.db.session import get_db
+from app.models.soil_sample import SoilSample
+from app.schemas.soil_data import (
+    SoilData,
+    SoilDataCreate,
+    SoilDataFeatureCollection,
+    SoilDataIngestResult,
+    SoilDataNearest,
+    SoilDataUpdate,
+)
+from app.services.soil_index import MAX_NEAREST
+from app.services.soil_ingest import INGEST_FORMATS, ingest_soil_samples
+from app.services.soil_samples import (
+    create_soil_sample,
+    delete_soil_sample,
+    nearest_soil_samples,
+    parse_bbox,
+    query_soil_samples,
+    soil_sample_filters,
+    soil_sample_record,
+    stream_soil_geojson,
+    update_soil_sample,
+)
+from app.services.soil_tiles import MAX_TILE_ZOOM, render_soil_tile, soil_tile_cache
 
 router = APIRouter()
 
+# Response header carrying the keyset cursor for the next page
+NEXT_PAGE_HEADER = "X-Next-After-Id"
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+def parse_bbox_or_400(bbox):
+    try:
+        return parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def page_headers(next_after_id):
+    return {} if next_after_id is None else {NEXT_PAGE_HEADER: str(next_after_id)}
+
 @router.get("/", response_model=List[SoilData])
-async def get_soil_data(
-    skip: int = 0, 
-    limit: int = 100,
+def get_soil_data(
+    after_id: Optional[int] = Query(None, description="Return samples with an id greater than this (keyset cursor)"),
+    limit: int = Query(100, ge=1, le=10000),
     soil_type: Optional[str] = None,
     min_ph: Optional[float] = None,
     max_ph: Optional[float] = None,
+    bbox: Optional[str] = Query(None, description="min_lon,min_lat,max_lon,max_lat"),
+    db: Session = Depends(get_db),
 ):
     """
-    Retrieve soil data with optional filtering.
-    """
-    # This would be replaced with actual database query
-    return [
-        {
-            "id": 1,
-            "location": {"type": "Point", "coordinates": [116.3, 39.9]},
-            "soil_type": "Clay",
-            "ph_value": 6.5,
-            "organic_matter": 2.3,
-            "moisture": 0.35,
-            "nitrogen": 0.15,
-            "phosphorus": 0.08,
-            "potassium": 0.12,
-            "created_at": "2025-07-01T00:00:00",
-            "updated_at": "2025-07-01T00:00:00"
-        }
-    ]
-
-@router.get("/geojson", response_model=FeatureCollection)
-async def get_soil_data_geojson(
+    Retrieve soil data with optional filtering, ordered by id.
+
+    Pagination is keyset based: pass the X-Next-After-Id header of a page as after_id
+    to fetch the next one. The header is absent on the last page.
+    """
+    rows, next_after_id = query_soil_samples(
+        db, after_id, limit, soil_type, min_ph, max_ph, parse_bbox_or_400(bbox)
+    )
+    return FastJSONResponse([soil_sample_record(row) for row in rows], headers=page_headers(next_after_id))
+
+@router.get("/geojson", response_model=SoilDataFeatureCollection)
+def get_soil_data_geojson(
     soil_type: Optional[str] = None,
     min_ph: Optional[float] = None,
     max_ph: Optional[float] = None,
+    bbox: Optional[str] = Query(None, description="min_lon,min_lat,max_lon,max_lat"),
+    zoom: Optional[int] = Query(None, ge=0, le=MAX_TILE_ZOOM, description="Map zoom level; below 16 samples are thinned for display"),
+    after_id: Optional[int] = Query(None, description="Return samples with an id greater than this (keyset cursor)"),
+    limit: int = Query(10000, ge=1, le=1000000, description="Most samples per page (default 10000); see next_after_id"),
 ):
     """
     Retrieve soil data in GeoJSON format for map visualization.
+
+    Uses the same filters and keyset pagination as the list endpoint. Pass the map viewport as
+    bbox and the map zoom as zoom: below zoom 16 only about one sample per 4 × 4 screen pixels
+    is returned, the same samples the vector tiles draw. The FeatureCollection is streamed as
+    the rows are read, so large pages start arriving at once and are never held in memory.
+
+    A page holds at most limit samples (10000 by default). When more match, the collection ends
+    with "next_after_id", the cursor to pass as after_id for the next page; it is null on the
+    last page. The cursor is taken from the streamed rows, so it is not sent as a header.
     """
-    # This would be replaced with actual database query and conversion to GeoJSON
-    return {
-        "type": "FeatureCollection",
-        "features": [
-            {
-                "type": "Feature",
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [116.3, 39.9]
-                },
-                "properties": {
-                    "id": 1,
-                    "soil_type": "Clay",
-                    "ph_value": 6.5,
-                    "organic_matter": 2.3,
-                    "moisture": 0.35,
-                    "nitrogen": 0.15,
-                    "phosphorus": 0.08,
-                    "potassium": 0.12
-                }
-            }
-        ]
-    }
+    conditions = soil_sample_filters(soil_type, min_ph, max_ph, parse_bbox_or_400(bbox), zoom)
+    return StreamingResponse(stream_soil_geojson(conditions, after_id, limit, zoom), media_type="application/json")
+
+@router.get("/nearest", response_model=List[SoilDataNearest])
+def get_nearest_soil_data(
+    latitude: float = Query(..., ge=-90, le=90, description="Latitude of the location"),
+    longitude: float = Query(..., ge=-180, le=180, description="Longitude of the location"),
+    k: int = Query(10, ge=1, le=MAX_NEAREST, description="Number of samples to return"),
+    radius: Optional[float] = Query(None, gt=0, description="Only return samples within this distance (m)"),
+    db: Session = Depends(get_db),
+):
+    """
+    Find the soil samples nearest to a location, nearest first.
+
+    With radius, only the samples within that great-circle distance are returned (at most k).
+    Queries are answered from an in-memory KD-tree over all samples that is rebuilt in the
+    background after writes, so a write shows up here a moment after it is committed.
+    """
+    try:
+        samples = nearest_soil_samples(db, longitude, latitude, k, radius)
+    except LookupError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return FastJSONResponse([dict(soil_sample_record(row), distance=distance) for row, distance in samples])
+
+@router.get("/tiles/{z}/{x}/{y}.mvt")
+def get_soil_data_tile(z: int, x: int, y: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Retrieve soil samples as a Mapbox Vector Tile (layer "soil_samples") for map display.
+
+    Below zoom 16 samples are thinned to about one per 4 × 4 screen pixels. Tiles are cached
+    in memory and on disk; writes to soil data invalidate only the tiles they affect, and
+    clients revalidate with the ETag.
+    """
+    if not (0 <= z <= MAX_TILE_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail="Invalid tile coordinates")
+
+    key = (z, x, y)
+    content = soil_tile_cache.get(key)
+    if content is None:
+        epoch = soil_tile_cache.current_epoch()
+        content = render_soil_tile(db, z, x, y)
+        soil_tile_cache.put(key, content, epoch)
+
+    etag = f'"{hashlib.sha1(content).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content, media_type=MVT_MEDIA_TYPE, headers=headers)
 
 @router.post("/", response_model=SoilData)
-async def create_soil_data(soil_data: SoilDataCreate):
+def create_soil_data(soil_data: SoilDataCreate, db: Session = Depends(get_db)):
     """
     Create new soil data entry.
     """
-    # This would be replaced with actual database insertion
-    return {
-        "id": 2,
-        "location": soil_data.location,
-        "soil_type": soil_data.soil_type,
-        "ph_value": soil_data.ph_value,
-        "organic_matter": soil_data.organic_matter,
-        "moisture": soil_data.moisture,
-        "nitrogen": soil_data.nitrogen,
-        "phosphorus": soil_data.phosphorus,
-        "potassium": soil_data.potassium,
-        "created_at": "2025-07-07T00:00:00",
-        "updated_at": "2025-07-07T00:00:00"
-    }
+    try:
+        sample = create_soil_sample(db, soil_data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return soil_sample_record(sample)
+
+@router.post("/bulk", response_model=SoilDataIngestResult)
+def bulk_create_soil_data(
+    file: UploadFile = File(...),
+    format: Optional[str] = Form(None, description=f"One of {', '.join(INGEST_FORMATS)}; detected from the file when omitted"),
+    layer: Optional[str] = Form(None, description="GeoPackage layer name"),
+    batch_size: int = Form(10000, ge=100, le=100000),
+    db: Session = Depends(get_db),
+):
+    """
+    Bulk import soil samples from a CSV, GeoJSON or GeoPackage file.
+
+    CSV files need longitude, latitude, soil_type and the soil property columns; GeoJSON and
+    GeoPackage files need Point features with those properties. The file is parsed as a stream
+    and stored in batches of batch_size rows, each in its own transaction. Invalid rows are
+    skipped and reported with their row number; the response also reports throughput.
+    """
+    try:
+        result = ingest_soil_samples(db, file.file, file.filename, format, batch_size, layer)
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return FastJSONResponse(result)
+
+def get_soil_sample_or_404(db, soil_data_id):
+    sample = db.get(SoilSample, soil_data_id)
+    if sample is None:
+        raise HTTPException(status_code=404, detail="Soil data not found")
+    return sample
 
 @router.get("/{soil_data_id}", response_model=SoilData)
-async def get_soil_data_by_id(soil_data_id: int):
+def get_soil_data_by_id(soil_data_id: int, db: Session = Depends(get_db)):
     """
     Get specific soil data by ID.
     """
-    # This would be replaced with actual database query
-    if soil_data_id != 1:
-        raise HTTPException(status_code=404, detail="Soil data not found")
-    
-    return {
-        "id": 1,
-        "location": {"type": "Point", "coordinates": [116.3, 39.9]},
-        "soil_type": "Clay",
-        "ph_value": 6.5,
-        "organic_matter": 2.3,
-        "moisture": 0.35,
-        "nitrogen": 0.15,
-        "phosphorus": 0.08,
-        "potassium": 0.12,
-        "created_at": "2025-07-01T00:00:00",
-        "updated_at": "2025-07-01T00:00:00"
-    }
+    return soil_sample_record(get_soil_sample_or_404(db, soil_data_id))
 
 @router.put("/{soil_data_id}", response_model=SoilData)
-async def update_soil_data(soil_data_id: int, soil_data: SoilDataUpdate):
+def update_soil_data(soil_data_id: int, soil_data: SoilDataUpdate, db: Session = Depends(get_db)):
     """
-    Update soil data.
+    Update soil data. Only the fields present in the request body are changed.
     """
-    # This would be replaced with actual database update
-    if soil_data_id != 1:
-        raise HTTPException(status_code=404, detail="Soil data not found")
-    
-    return {
-        "id": soil_data_id,
-        "location": soil_data.location or {"type": "Point", "coordinates": [116.3, 39.9]},
-        "soil_type": soil_data.soil_type or "Clay",
-        "ph_value": soil_data.ph_value or 6.5,
-        "organic_matter": soil_data.organic_matter or 2.3,
-        "moisture": soil_data.moisture or 0.35,
-        "nitrogen": soil_data.nitrogen or 0.15,
-        "phosphorus": soil_data.phosphorus or 0.08,
-        "potassium": soil_data.potassium or 0.12,
-        "created_at": "2025-07-01T00:00:00",
-        "updated_at": "2025-07-07T00:00:00"
-    }
+    sample = get_soil_sample_or_404(db, soil_data_id)
+    try:
+        sample = update_soil_sample(db, sample, soil_data)
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return soil_sample_record(sample)
 
 @router.delete("/{soil_data_id}")
-async def delete_soil_data(soil_data_id: int):
+def delete_soil_data(soil_data_id: int, db: Session = Depends(get_db)):
     """
     Delete soil data.
     """
-    # This would be replaced with actual database deletion
-    if soil_data_id != 1:
-        raise HTTPException(status_code=404, detail="Soil data not found")
-    
-    return {"message": "Soil data deleted successfully"}
\ No newline at end of file
+    delete_soil_sample(db, get_soil_sample_or_404(db, soil_data_id))
+
+    return {"message": "Soil data deleted successfully"}
@@ -0,0 +1,169 @@
+import zlib
+import anyio.to_thread
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 不再压缩的内容类型 (本身已压缩)
+EXCLUDED_CONTENT_TYPES = ("image/", "audio/", "video/", "application/zip", "application/gzip", "text/event-stream")
+
+# 超过该大小的响应块在线程中压缩，避免阻塞事件循环
+THREAD_MINIMUM_SIZE = 256 * 1024
+
+
+class GzipCompressor:
+    content_encoding = "gzip"
+
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data, final):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class BrotliCompressor:
+    content_encoding = "br"
+
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data, final):
+        output = self.compressor.process(data)
+        return output + (self.compressor.finish() if final else self.compressor.flush())
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    根据 Accept-Encoding 选择压缩方式 (q 值最高者，相同时优先 br)
+
+    返回:
+    - "br"、"gzip" 或 None (不压缩)
+    """
+    supported = ("br", "gzip") if brotli is not None else ("gzip",)
+    best, best_q = None, 0.0
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        candidates = supported if name == "*" else (name,)
+        for candidate in candidates:
+            if candidate in supported and q > 0 and (
+                q > best_q or (q == best_q and supported.index(candidate) < supported.index(best))
+            ):
+                best, best_q = candidate, q
+    return best
+
+
+class CompressionMiddleware:
+    """
+    按客户端的 Accept-Encoding 对响应做 brotli 或 gzip 压缩的 ASGI 中间件
+
+    - 小于 minimum_size 的响应、已设置 Content-Encoding 的响应和图片等已压缩的内容不压缩
+    - 流式响应 (例如 NDJSON) 逐块压缩并刷新，客户端可以边接收边解析
+    - 未安装 brotli 时只提供 gzip
+    """
+
+    def __init__(self, app, minimum_size=1024, gzip_level=6, brotli_quality=4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+
+class CompressionResponder:
+    """
+    单个请求的压缩状态: 暂存响应头，收到第一个响应块后决定是否压缩
+    """
+
+    def __init__(self, middleware, encoding, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.downstream = send
+        self.start_message = None
+        self.compressor = None
+        self.passthrough = False
+
+    def create_compressor(self):
+        if self.encoding == "br":
+            return BrotliCompressor(self.middleware.brotli_quality)
+        return GzipCompressor(self.middleware.gzip_level)
+
+    async def compress(self, body, final):
+        if len(body) >= THREAD_MINIMUM_SIZE:
+            return await anyio.to_thread.run_sync(self.compressor.compress, body, final)
+        return self.compressor.compress(body, final)
+
+    async def send(self, message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "").lower()
+            self.passthrough = (
+                "content-encoding" in headers
+                or message["status"] in (204, 206, 304)
+                or content_type.startswith(EXCLUDED_CONTENT_TYPES)
+            )
+            if self.passthrough:
+                await self.downstream(message)
+            else:
+                self.start_message = message
+            return
+
+        if message_type != "http.response.body" or self.passthrough:
+            if self.start_message is not None:
+                await self.downstream(self.start_message)
+                self.start_message = None
+            await self.downstream(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start_message is not None:
+            start_message, self.start_message = self.start_message, None
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers.add_vary_header("Accept-Encoding")
+
+            if not more_body and len(body) < self.middleware.minimum_size:
+                self.passthrough = True
+                await self.downstream(start_message)
+                await self.downstream(message)
+                return
+
+            self.compressor = self.create_compressor()
+            body = await self.compress(body, final=not more_body)
+            headers["Content-Encoding"] = self.compressor.content_encoding
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(body))
+            await self.downstream(start_message)
+            await self.downstream({"type": "http.response.body", "body": body, "more_body": more_body})
+            return
+
+        body = await self.compress(body, final=not more_body)
+        await self.downstream({"type": "http.response.body", "body": body, "more_body": more_body})
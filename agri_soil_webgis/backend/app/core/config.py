@@ -0,0 +1,76 @@
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 项目根目录 (agri_soil_webgis/)
+PROJECT_DIR = Path(__file__).resolve().parents[3]
+
+# 数据目录，可通过环境变量或 .env 文件覆盖
+DATA_DIR = Path(os.getenv("DATA_DIR", PROJECT_DIR / "data"))
+
+# 土壤采样点数据库，默认为数据目录下的 SQLite 文件 (带 R-tree 空间索引)
+SOIL_DATABASE_URL = os.getenv("SOIL_DATABASE_URL", f"sqlite:///{DATA_DIR / 'soil.db'}")
+
+# 土壤采样点矢量瓦片 (MVT) 的磁盘缓存目录与内存、磁盘缓存容量 (字节)
+SOIL_TILE_CACHE_DIR = Path(os.getenv("SOIL_TILE_CACHE_DIR", DATA_DIR / "tiles" / "soil"))
+SOIL_TILE_MEMORY_CACHE_MAX_BYTES = int(os.getenv("SOIL_TILE_MEMORY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+SOIL_TILE_DISK_CACHE_MAX_BYTES = int(os.getenv("SOIL_TILE_DISK_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+
+# 土壤属性插值格网 (内存映射数组) 目录、格网分辨率 (度) 与最多像元数 (范围过大时自动降低分辨率)
+SOIL_GRID_DIR = Path(os.getenv("SOIL_GRID_DIR", DATA_DIR / "grids" / "soil"))
+SOIL_GRID_RESOLUTION = float(os.getenv("SOIL_GRID_RESOLUTION", 0.001))
+SOIL_GRID_MAX_CELLS = int(os.getenv("SOIL_GRID_MAX_CELLS", 4096 * 4096))
+
+# 土壤属性反距离加权插值: 搜索半径 (米，半径内没有采样点的像元为空)、最多使用的近邻采样点数与距离幂次
+SOIL_GRID_SEARCH_RADIUS = float(os.getenv("SOIL_GRID_SEARCH_RADIUS", 5000))
+SOIL_GRID_NEIGHBORS = int(os.getenv("SOIL_GRID_NEIGHBORS", 12))
+SOIL_GRID_POWER = float(os.getenv("SOIL_GRID_POWER", 2.0))
+
+# 本地栅格数据 (DEM 等 GeoTIFF) 目录
+RASTER_DIR = Path(os.getenv("RASTER_DIR", DATA_DIR / "rasters"))
+
+# RUSLE 土壤侵蚀模型: DEM 与 R (降雨侵蚀力)、C (覆盖管理)、P (水土保持措施) 因子栅格的文件名 (相对于 RASTER_DIR)，
+# 因子栅格未配置或为 nodata 时使用对应的常数; K (土壤可蚀性) 以有机质含量 2% 时的值为基准，按插值格网的有机质修正
+EROSION_DEM = os.getenv("EROSION_DEM", "dem.tif")
+EROSION_R_RASTER = os.getenv("EROSION_R_RASTER") or None
+EROSION_C_RASTER = os.getenv("EROSION_C_RASTER") or None
+EROSION_P_RASTER = os.getenv("EROSION_P_RASTER") or None
+EROSION_R_FACTOR = float(os.getenv("EROSION_R_FACTOR", 500))  # MJ·mm/(ha·h·a)
+EROSION_K_FACTOR = float(os.getenv("EROSION_K_FACTOR", 0.03))  # t·ha·h/(ha·MJ·mm)
+EROSION_C_FACTOR = float(os.getenv("EROSION_C_FACTOR", 0.2))
+EROSION_P_FACTOR = float(os.getenv("EROSION_P_FACTOR", 1.0))
+
+# 侵蚀因子按 DEM 分块 (像元) 计算，坡长上限 (米) 同时决定分块外扩的重叠宽度；因子分块的磁盘缓存目录与内存缓存容量 (字节)
+EROSION_TILE_SIZE = int(os.getenv("EROSION_TILE_SIZE", 512))
+EROSION_MAX_SLOPE_LENGTH = float(os.getenv("EROSION_MAX_SLOPE_LENGTH", 300))
+EROSION_CACHE_DIR = Path(os.getenv("EROSION_CACHE_DIR", DATA_DIR / "cache" / "erosion"))
+EROSION_CACHE_MAX_BYTES = int(os.getenv("EROSION_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# 计算密集型任务 (三角网、栅格等) 进程池的进程数
+COMPUTE_WORKERS = int(os.getenv("COMPUTE_WORKERS", os.cpu_count() or 1))
+
+# 采样点数不超过该值的请求直接在请求内计算，避免进程间传输的开销
+INLINE_MAX_POINTS = int(os.getenv("INLINE_MAX_POINTS", 5000))
+
+# 后台任务结果保留时间 (秒) 与最多保留的任务数
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", 3600))
+JOB_MAX_STORED = int(os.getenv("JOB_MAX_STORED", 1000))
+
+# 填挖方缓存容量 (字节): 投影坐标与裁剪后三角网、完整计算结果
+GEOMETRY_CACHE_MAX_BYTES = int(os.getenv("GEOMETRY_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+
+# 填挖方差值栅格与其 PNG 瓦片的缓存容量 (字节)
+DIFFERENCE_RASTER_CACHE_MAX_BYTES = int(os.getenv("DIFFERENCE_RASTER_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+TILE_CACHE_MAX_BYTES = int(os.getenv("TILE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# 三角网编辑会话的保留时间 (秒，自最后一次访问起) 与最多同时保留的会话数
+TIN_SESSION_TTL = int(os.getenv("TIN_SESSION_TTL", 3600))
+TIN_SESSION_MAX = int(os.getenv("TIN_SESSION_MAX", 100))
+
+# 响应压缩: 小于该大小 (字节) 的响应不压缩；gzip 压缩级别与 brotli 压缩质量 (安装 brotli 后按 Accept-Encoding 优先使用)
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", 1024))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 4))
@@ -0,0 +1,44 @@
+import json
+from datetime import date, datetime
+from fastapi.responses import JSONResponse
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default_encoder(value):
+    """
+    标准库 json 无法直接编码的类型 (NumPy 数组与标量、日期时间)
+    """
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+def json_bytes(content):
+    """
+    编码为紧凑的 UTF-8 JSON 字节串 (优先使用 orjson)，FastJSONResponse 与流式响应共用
+    """
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=default_encoder
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    高吞吐量的 JSON 响应
+
+    - 使用 orjson 编码 (直接支持 NumPy 数组和标量)，未安装 orjson 时退回标准库 json
+    - 接口直接返回 FastJSONResponse 时，FastAPI 不再按 response_model 重新校验和转换数据，
+      只适用于由服务端自己构造、结构已确定的结果 (response_model 仍用于接口文档)
+    """
+
+    def render(self, content):
+        return json_bytes(content)
@@ -0,0 +1,82 @@
+from pathlib import Path
+from sqlalchemy import text
+from app.db.base import Base
+from app.db.session import database_url, engine, is_sqlite
+from app.models.soil_sample import SoilSample
+from app.services.soil_tiles import SQLITE_TILE_RTREE_DDL, THINNING_MAX_ZOOM, rebuild_thinning_levels
+
+# The R-trees store float32 boxes; the triggers keep them in sync with soil_samples on every write,
+# including bulk inserts, so they never have to be rebuilt by hand. New samples enter the tile R-tree
+# at THINNING_MAX_ZOOM; app.services.soil_tiles lowers the level of the samples drawn at lower zooms.
+SQLITE_SPATIAL_INDEX_DDL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS soil_samples_rtree
+    USING rtree(id, min_lon, max_lon, min_lat, max_lat)
+    """,
+    SQLITE_TILE_RTREE_DDL,
+    """
+    CREATE TRIGGER IF NOT EXISTS soil_samples_rtree_insert AFTER INSERT ON soil_samples
+    BEGIN
+        INSERT INTO soil_samples_rtree VALUES (new.id, new.longitude, new.longitude, new.latitude, new.latitude);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS soil_samples_rtree_update AFTER UPDATE OF longitude, latitude ON soil_samples
+    BEGIN
+        UPDATE soil_samples_rtree
+        SET min_lon = new.longitude, max_lon = new.longitude, min_lat = new.latitude, max_lat = new.latitude
+        WHERE id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS soil_samples_rtree_delete AFTER DELETE ON soil_samples
+    BEGIN
+        DELETE FROM soil_samples_rtree WHERE id = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS soil_samples_tile_rtree_insert AFTER INSERT ON soil_samples
+    BEGIN
+        INSERT INTO soil_samples_tile_rtree VALUES (
+            new.id, new.longitude, new.longitude, new.latitude, new.latitude, {THINNING_MAX_ZOOM}, {THINNING_MAX_ZOOM}
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS soil_samples_tile_rtree_update AFTER UPDATE OF longitude, latitude ON soil_samples
+    BEGIN
+        UPDATE soil_samples_tile_rtree
+        SET min_lon = new.longitude, max_lon = new.longitude, min_lat = new.latitude, max_lat = new.latitude
+        WHERE id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS soil_samples_tile_rtree_delete AFTER DELETE ON soil_samples
+    BEGIN
+        DELETE FROM soil_samples_tile_rtree WHERE id = old.id;
+    END
+    """,
+)
+
+
+def init_db():
+    """
+    Create the soil sample tables and, on SQLite, the R-tree spatial indexes and their triggers.
+
+    Safe to call on every startup; existing tables and data are left untouched.
+    """
+    if is_sqlite and database_url.database not in (None, "", ":memory:"):
+        Path(database_url.database).parent.mkdir(parents=True, exist_ok=True)
+
+    Base.metadata.create_all(engine, tables=[SoilSample.__table__])
+
+    if is_sqlite:
+        with engine.begin() as connection:
+            has_tile_index = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'soil_samples_tile_rtree'")
+            ).first() is not None
+            for statement in SQLITE_SPATIAL_INDEX_DDL:
+                connection.execute(text(statement))
+            if not has_tile_index:
+                # Database created before the vector tiles: fill the tile R-tree from the samples
+                rebuild_thinning_levels(connection)
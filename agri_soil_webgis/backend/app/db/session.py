@@ -0,0 +1,44 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from app.core.config import SOIL_DATABASE_URL
+
+database_url = make_url(SOIL_DATABASE_URL)
+is_sqlite = database_url.get_backend_name() == "sqlite"
+
+engine = create_engine(
+    database_url,
+    # Request handlers run in FastAPI's thread pool, so SQLite connections move between threads
+    connect_args={"check_same_thread": False} if is_sqlite else {},
+)
+
+SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+
+if is_sqlite:
+    @event.listens_for(engine, "connect")
+    def configure_sqlite_connection(dbapi_connection, connection_record):
+        """
+        Tune every new SQLite connection for a large, read-mostly sample table.
+
+        WAL lets readers run while a writer commits, NORMAL sync is safe under WAL,
+        and the larger page cache and memory map keep hot index pages in memory.
+        """
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+
+def get_db():
+    """
+    FastAPI dependency that yields a database session and closes it after the request.
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
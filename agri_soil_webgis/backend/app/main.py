@@ -1,11 +1,36 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.api import api_router
+from app.core.compression import CompressionMiddleware
+from app.core.config import BROTLI_QUALITY, COMPRESSION_MINIMUM_SIZE, GZIP_LEVEL
+from app.core.responses import FastJSONResponse
+from app.db.init_db import init_db
+from app.services.jobs import shutdown_process_pool
+from app.services.soil_grids import soil_grid_builder
+from app.services.soil_index import soil_sample_index
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create the soil sample tables and spatial index if they do not exist yet
+    init_db()
+    # Open the interpolated soil property grids and keep them up to date in the background
+    soil_grid_builder.start()
+    # Build the in-memory nearest-sample index, rebuilt in the background after writes
+    soil_sample_index.start()
+    yield
+    soil_sample_index.stop()
+    soil_grid_builder.stop()
+    # Stop the worker processes used for CPU-bound computations
+    shutdown_process_pool()
 
 app = FastAPI(
     title="Agricultural Soil WebGIS API",
     description="API for Agricultural Soil WebGIS Application",
     version="0.1.0",
+    lifespan=lifespan,
+    # Encode JSON with orjson; large endpoints return FastJSONResponse directly to skip re-validation
+    default_response_class=FastJSONResponse,
 )
 
 # Configure CORS
@@ -15,6 +40,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["X-Next-After-Id"],  # Keyset pagination cursor of /soil-data
+)
+
+# Compress responses with brotli or gzip, negotiated from Accept-Encoding
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=COMPRESSION_MINIMUM_SIZE,
+    gzip_level=GZIP_LEVEL,
+    brotli_quality=BROTLI_QUALITY,
 )
 
 # Include API router
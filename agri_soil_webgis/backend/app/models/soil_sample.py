@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+from sqlalchemy import Column, DateTime, Float, Index, Integer, MetaData, String, Table
+from sqlalchemy.orm import Mapped, mapped_column
+from app.db.base import Base
+
+
+def utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class SoilSample(Base):
+    """
+    A single soil sample point.
+
+    The location is stored as plain longitude/latitude columns; on SQLite an R-tree
+    virtual table (see soil_sample_rtree) mirrors them for bounding-box queries.
+    """
+    __tablename__ = "soil_samples"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    longitude: Mapped[float] = mapped_column(Float, nullable=False)
+    latitude: Mapped[float] = mapped_column(Float, nullable=False)
+    soil_type: Mapped[str] = mapped_column(String(64), nullable=False)
+    ph_value: Mapped[float] = mapped_column(Float, nullable=False)
+    organic_matter: Mapped[float] = mapped_column(Float, nullable=False)
+    moisture: Mapped[float] = mapped_column(Float, nullable=False)
+    nitrogen: Mapped[float] = mapped_column(Float, nullable=False)
+    phosphorus: Mapped[float] = mapped_column(Float, nullable=False)
+    potassium: Mapped[float] = mapped_column(Float, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utc_now)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utc_now, onupdate=utc_now)
+
+    __table_args__ = (
+        # Keyset pages filtered by soil type walk this index in id order
+        Index("ix_soil_samples_soil_type_id", "soil_type", "id"),
+        Index("ix_soil_samples_ph_value", "ph_value"),
+        # Bounding-box fallback for databases without the R-tree table
+        Index("ix_soil_samples_lon_lat", "longitude", "latitude"),
+    )
+
+
+# Measured properties returned with every sample, in response order
+SOIL_PROPERTIES = ("ph_value", "organic_matter", "moisture", "nitrogen", "phosphorus", "potassium")
+
+# Columns selected when samples are serialized (lists, GeoJSON and vector tiles)
+SOIL_SAMPLE_COLUMNS = (
+    SoilSample.id,
+    SoilSample.longitude,
+    SoilSample.latitude,
+    SoilSample.soil_type,
+    *(getattr(SoilSample, name) for name in SOIL_PROPERTIES),
+    SoilSample.created_at,
+    SoilSample.updated_at,
+)
+
+
+# SQLite R-tree virtual table holding one degenerate box per sample (id = soil_samples.id).
+# It lives outside Base.metadata because create_all cannot create virtual tables; see app.db.init_db.
+soil_sample_rtree = Table(
+    "soil_samples_rtree",
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("min_lon", Float),
+    Column("max_lon", Float),
+    Column("min_lat", Float),
+    Column("max_lat", Float),
+)
+
+
+# SQLite R-tree used by the vector tiles: the third dimension holds the lowest zoom level at which
+# the sample is drawn after thinning (min_zoom = max_zoom), so low-zoom tiles only visit the samples
+# they show. Maintained by triggers and app.services.soil_tiles.
+soil_sample_tile_rtree = Table(
+    "soil_samples_tile_rtree",
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("min_lon", Float),
+    Column("max_lon", Float),
+    Column("min_lat", Float),
+    Column("max_lat", Float),
+    Column("min_zoom", Float),
+    Column("max_zoom", Float),
+)
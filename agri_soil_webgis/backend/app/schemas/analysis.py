@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from app.schemas.soil_data import GeoJSON
 
@@ -9,6 +9,8 @@ class SoilAnalysisResult(BaseModel):
     fertility_level: str
     recommendations: List[str]
     analysis_date: datetime
+    soil_properties: Optional[Dict[str, float]] = None  # interpolated from the soil samples
+    nearest_sample_distance: Optional[float] = None  # metres to the closest measured sample
 
 class CropSuitabilityResult(BaseModel):
     crop_name: str
@@ -17,10 +19,41 @@ class CropSuitabilityResult(BaseModel):
     limiting_factors: List[str]
     recommended_varieties: List[str]
 
+class CropSuitabilityBatchRequest(BaseModel):
+    coordinates: List[Tuple[float, float]] = Field(..., min_length=1, max_length=100000)  # [[longitude, latitude], ...]
+    crop_types: Optional[List[str]] = None  # all crops in the catalogue when omitted
+
+class CropSuitabilityLocation(BaseModel):
+    location: GeoJSON
+    results: Optional[List[CropSuitabilityResult]]  # None where no soil data is available
+
 class ErosionRiskResult(BaseModel):
     location: GeoJSON
     risk_level: str
     risk_score: float = Field(..., ge=0, le=100)
     annual_soil_loss: float  # tons per hectare per year
     contributing_factors: List[str]
-    mitigation_strategies: List[str]
\ No newline at end of file
+    mitigation_strategies: List[str]
+    factors: Optional[Dict[str, float]] = None  # mean RUSLE factors R, K, LS, C, P
+
+class ZonalHistogram(BaseModel):
+    edges: List[float]  # histogram_bins + 1 equal-width edges between min and max
+    counts: List[int]
+
+class ZonalLayerStatistics(BaseModel):
+    count: int  # pixels within the field with a value
+    mean: float
+    std: float
+    min: float
+    max: float
+    percentiles: Dict[str, float]  # "p50": value, interpolated within PERCENTILE_BINS histogram bins
+    histogram: ZonalHistogram
+
+class ZonalErosionRisk(BaseModel):
+    risk_level: str
+    risk_score: float = Field(..., ge=0, le=100)
+
+class ZonalStatisticsField(BaseModel):
+    id: Optional[str | int] = None  # feature id
+    statistics: Dict[str, Optional[ZonalLayerStatistics]]  # None where the field has no data for the layer
+    erosion_risk: Optional[ZonalErosionRisk] = None  # from the mean soil loss, when soil_loss was requested
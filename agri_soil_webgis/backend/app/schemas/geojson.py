@@ -3,7 +3,7 @@ from typing import List, Dict, Any, Optional
 
 class Geometry(BaseModel):
     type: str
-    coordinates: List[float] | List[List[float]] | List[List[List[float]]]
+    coordinates: List[float] | List[List[float]] | List[List[List[float]]] | List[List[List[List[float]]]]
 
 class Feature(BaseModel):
     type: str = "Feature"
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Any
 from datetime import datetime
+from app.schemas.geojson import FeatureCollection
 
 class GeoJSON(BaseModel):
     type: str
@@ -35,4 +36,25 @@ class SoilData(SoilDataBase):
     updated_at: datetime
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class SoilDataNearest(SoilData):
+    distance: float  # great-circle distance from the query location in metres
+
+class SoilDataFeatureCollection(FeatureCollection):
+    next_after_id: Optional[int] = None  # after_id of the next page, None on the last page
+
+class SoilDataIngestReject(BaseModel):
+    row: int  # 1-based data row (CSV, excluding the header) or feature number (GeoJSON / GeoPackage)
+    reason: str
+
+class SoilDataIngestResult(BaseModel):
+    format: str
+    total_rows: int
+    inserted: int
+    rejected: int
+    rejects: List[SoilDataIngestReject]
+    rejects_truncated: bool  # True when more rows were rejected than listed in rejects
+    batches: int
+    elapsed_seconds: float
+    rows_per_second: float
\ No newline at end of file
@@ -0,0 +1,171 @@
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+from app.services.earthwork import HeightDiffInterpolator, iter_lattice_points, triangle_areas
+
+
+@dataclass
+class DesignElements:
+    """
+    参与土方平衡计算的计算单元 (三角形或网格)
+
+    - areas: 每个单元的平面面积 (m²)
+    - centroids: 每个单元的质心本地坐标，形状 (m, 2)
+    - ground: 每个单元的平均原始地面高程 (三角形取三个顶点的平均值，网格取中心插值)
+    """
+    areas: np.ndarray
+    centroids: np.ndarray
+    ground: np.ndarray
+
+
+@dataclass
+class HaulBalance:
+    """
+    平衡状态下的土方调配概况
+
+    - cut_centroid / fill_centroid: 挖方区与填方区按体积加权的质心本地坐标
+    - distance: 两质心之间的平均运距 (m)
+    - moment: 调配量 × 平均运距 (m³·m)
+    """
+    cut_centroid: Optional[np.ndarray]
+    fill_centroid: Optional[np.ndarray]
+    distance: float
+    moment: float
+
+
+def tin_design_elements(points, triangles, original_heights):
+    """
+    由裁剪后的三角网生成计算单元
+
+    参数:
+    - points: 采样点本地坐标数组，形状 (n, 2)
+    - triangles: 三角形顶点索引数组，形状 (m, 3)
+    - original_heights: 采样点原始高程，形状 (n,)
+
+    返回:
+    - DesignElements
+    """
+    points = np.asarray(points, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=np.intp).reshape(-1, 3)
+    heights = np.asarray(original_heights, dtype=np.float64)
+    return DesignElements(
+        areas=triangle_areas(points, triangles),
+        centroids=points[triangles].mean(axis=1),
+        ground=heights[triangles].mean(axis=1),
+    )
+
+
+def grid_design_elements(points, original_heights, boundary_polygon, grid_size=5.0,
+                         interpolation="nearest", idw_neighbors=8, idw_power=2.0):
+    """
+    由边界内的规则网格生成计算单元，网格中心的原始高程由采样点插值
+
+    参数同 integrate_grid_volumes。
+
+    返回:
+    - DesignElements
+    """
+    interpolator = HeightDiffInterpolator(points, original_heights, interpolation, idw_neighbors, idw_power)
+    centers = [block for block in iter_lattice_points(boundary_polygon, grid_size)]
+    if centers:
+        centroids = np.concatenate(centers)
+    else:
+        centroids = np.empty((0, 2), dtype=np.float64)
+    return DesignElements(
+        areas=np.full(len(centroids), grid_size * grid_size, dtype=np.float64),
+        centroids=centroids,
+        ground=interpolator(centroids),
+    )
+
+
+def plane_offsets(centroids, slope_x=0.0, slope_y=0.0, reference=(0.0, 0.0)):
+    """
+    计算倾斜设计面在各单元质心处相对参考点的高程差
+
+    设计面 z(x, y) = z0 + slope_x × (x - x0) + slope_y × (y - y0)，其中 z0 为参考点处的设计高程。
+    设计面是平面，三角形三个顶点的平均设计高程等于质心处的设计高程。
+
+    返回:
+    - 高程差数组，形状 (m,)
+    """
+    centroids = np.asarray(centroids, dtype=np.float64).reshape(-1, 2)
+    return slope_x * (centroids[:, 0] - reference[0]) + slope_y * (centroids[:, 1] - reference[1])
+
+
+class CutFillCurve:
+    """
+    设计面整体升降时的挖方/填方曲线
+
+    单元 i 在参考点设计高程为 z 时的高程差为 z - c_i，其中 c_i = 平均地面高程 - 设计面偏移，
+    体积为 A_i × (z - c_i)，正值计入填方、负值计入挖方 (与 integrate_tin_volumes 一致)。
+    按 c_i 排序并预先计算面积与面积×c_i 的累积和后，任意一组候选高程都只需一次 searchsorted:
+
+        fill(z) = z × ΣA_i - ΣA_i·c_i    (对 c_i < z 的单元求和)
+        cut(z)  = ΣA_i·c_i - z × ΣA_i    (对 c_i > z 的单元求和)
+    """
+
+    def __init__(self, areas, levels):
+        areas = np.asarray(areas, dtype=np.float64)
+        levels = np.asarray(levels, dtype=np.float64)
+        if len(areas) == 0 or areas.sum() <= 0:
+            raise ValueError("边界内没有可用于计算的三角形或网格")
+
+        order = np.argsort(levels, kind="stable")
+        self.levels = levels[order]
+        self.areas = areas[order]
+        self.total_area = float(self.areas.sum())
+        self.cum_area = np.concatenate(([0.0], np.cumsum(self.areas)))
+        self.cum_moment = np.concatenate(([0.0], np.cumsum(self.areas * self.levels)))
+
+    @property
+    def balanced_level(self):
+        """
+        净体积为零的参考点设计高程 (面积加权的平均 c_i)
+        """
+        return self.cum_moment[-1] / self.total_area
+
+    def __call__(self, elevations):
+        """
+        计算一组候选高程下的挖方量和填方量
+
+        返回:
+        - (cut_volumes, fill_volumes)，形状均为 (k,)
+        """
+        elevations = np.asarray(elevations, dtype=np.float64)
+        below = np.searchsorted(self.levels, elevations, side="left")
+        fill = elevations * self.cum_area[below] - self.cum_moment[below]
+        cut = (self.cum_moment[-1] - self.cum_moment[below]) - elevations * (self.total_area - self.cum_area[below])
+        return np.maximum(cut, 0.0), np.maximum(fill, 0.0)
+
+
+def haul_balance(elements, levels, elevation):
+    """
+    计算指定设计高程下挖方区与填方区的体积加权质心、平均运距和调配量×运距
+
+    参数:
+    - elements: DesignElements
+    - levels: 每个单元的 c_i (见 CutFillCurve)
+    - elevation: 参考点设计高程
+
+    返回:
+    - HaulBalance
+    """
+    volumes = elements.areas * (elevation - np.asarray(levels, dtype=np.float64))
+    fill = np.clip(volumes, 0.0, None)
+    cut = np.clip(-volumes, 0.0, None)
+
+    cut_total = float(cut.sum())
+    fill_total = float(fill.sum())
+    cut_centroid = (cut @ elements.centroids) / cut_total if cut_total > 0 else None
+    fill_centroid = (fill @ elements.centroids) / fill_total if fill_total > 0 else None
+
+    distance = 0.0
+    if cut_centroid is not None and fill_centroid is not None:
+        distance = float(np.hypot(*(fill_centroid - cut_centroid)))
+
+    return HaulBalance(
+        cut_centroid=cut_centroid,
+        fill_centroid=fill_centroid,
+        distance=distance,
+        moment=min(cut_total, fill_total) * distance,
+    )
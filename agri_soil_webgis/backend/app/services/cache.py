@@ -0,0 +1,97 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class LRUCache:
+    """
+    按占用字节数限制容量的 LRU 缓存 (线程安全)
+
+    - put 时需要给出条目的估算大小 (字节)
+    - 总大小超过 max_bytes 时淘汰最久未使用的条目
+    - 单个条目超过 max_bytes 时不缓存
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[1]
+            self.entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries)
+
+    def pop(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.current_bytes -= entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def content_hash(*parts):
+    """
+    计算输入内容的规范化哈希 (SHA-256)
+
+    - NumPy 数组按 float64 连续内存参与哈希，同时包含形状
+    - 其他对象按排序键的 JSON 参与哈希 (Pydantic 模型先转换为字典)
+
+    返回:
+    - 十六进制哈希字符串
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            array = np.ascontiguousarray(part, dtype=np.float64)
+            digest.update(b"A")
+            digest.update(repr(array.shape).encode())
+            digest.update(array.tobytes())
+        else:
+            if hasattr(part, "model_dump"):
+                part = part.model_dump()
+            digest.update(b"J")
+            digest.update(json.dumps(part, sort_keys=True, separators=(",", ":"), default=str).encode())
+        digest.update(b"|")
+    return digest.hexdigest()
@@ -0,0 +1,93 @@
+import io
+import numpy as np
+
+# 采样点列名
+SAMPLE_COLUMNS = ("longitude", "latitude", "original_height", "target_height")
+
+# 必须提供的列，缺少的高程列按0处理 (与JSON接口的 p.get(..., 0) 一致)
+REQUIRED_SAMPLE_COLUMNS = ("longitude", "latitude")
+
+NPY_MAGIC = b"\x93NUMPY"
+NPZ_MAGIC = b"PK\x03\x04"
+ARROW_FILE_MAGIC = b"ARROW1"
+ARROW_STREAM_MAGIC = b"\xff\xff\xff\xff"
+
+
+def read_npz_columns(data):
+    with np.load(io.BytesIO(data), allow_pickle=False) as archive:
+        return {name: archive[name] for name in archive.files}
+
+
+def read_npy_columns(data):
+    array = np.load(io.BytesIO(data), allow_pickle=False)
+
+    # 结构化数组: 按字段名取列
+    if array.dtype.names:
+        return {name: array[name] for name in array.dtype.names}
+
+    # 普通二维数组: 按 SAMPLE_COLUMNS 的顺序解释各列
+    if array.ndim != 2 or not 2 <= array.shape[1] <= len(SAMPLE_COLUMNS):
+        raise ValueError("npy数组必须是结构化数组或形状为 (n, 2~4) 的二维数组")
+    return {name: array[:, i] for i, name in enumerate(SAMPLE_COLUMNS[:array.shape[1]])}
+
+
+def read_arrow_columns(data):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ValueError("读取Arrow IPC数据需要安装pyarrow")
+
+    buffer = pa.py_buffer(data)
+    if data.startswith(ARROW_FILE_MAGIC):
+        table = pa.ipc.open_file(buffer).read_all()
+    else:
+        table = pa.ipc.open_stream(buffer).read_all()
+
+    columns = {}
+    for name in table.column_names:
+        column = table.column(name)
+        if column.null_count:
+            raise ValueError(f"列 {name} 含有空值")
+        columns[name] = column.to_numpy()
+    return columns
+
+
+def read_sample_columns(data):
+    """
+    读取列式二进制格式的采样点数据
+
+    支持的格式 (按文件头自动识别):
+    - .npz: 包含 longitude/latitude/original_height/target_height 数组
+    - .npy: 结构化数组，或列顺序为 longitude, latitude, original_height, target_height 的二维数组
+    - Arrow IPC (文件或流格式): 需要安装 pyarrow
+
+    参数:
+    - data: 文件内容 (bytes)
+
+    返回:
+    - 字典 {列名: float64 数组}，缺少的高程列以0填充
+    """
+    if data.startswith(NPZ_MAGIC):
+        columns = read_npz_columns(data)
+    elif data.startswith(NPY_MAGIC):
+        columns = read_npy_columns(data)
+    elif data.startswith(ARROW_FILE_MAGIC) or data.startswith(ARROW_STREAM_MAGIC):
+        columns = read_arrow_columns(data)
+    else:
+        raise ValueError("无法识别的数据格式，仅支持 .npz、.npy 和 Arrow IPC")
+
+    for name in REQUIRED_SAMPLE_COLUMNS:
+        if name not in columns:
+            raise ValueError(f"缺少列: {name}")
+
+    count = len(columns["longitude"])
+    samples = {}
+    for name in SAMPLE_COLUMNS:
+        if name in columns:
+            column = np.asarray(columns[name], dtype=np.float64).reshape(-1)
+            if len(column) != count:
+                raise ValueError(f"列 {name} 的长度与 longitude 不一致")
+            samples[name] = column
+        else:
+            samples[name] = np.zeros(count, dtype=np.float64)
+    return samples
@@ -0,0 +1,282 @@
+from functools import lru_cache
+import numpy as np
+from rasterio.io import MemoryFile
+from rasterio.transform import from_origin
+from app.models.soil_sample import SOIL_PROPERTIES
+from app.services.soil_quality import range_score
+
+INF = np.inf
+
+# Crop catalogue: (name, recommended varieties, requirements). Requirements give per soil property
+# (zero below, optimal from, optimal to, zero above) in the stored units (pH, %, moisture as a
+# volume fraction); see soil_quality.range_score.
+CROP_CATALOGUE = (
+    ("Wheat", ["Winter Wheat", "Spring Wheat"], {
+        "ph_value": (5.0, 6.0, 7.5, 8.5),
+        "organic_matter": (0.5, 1.5, INF, INF),
+        "moisture": (0.08, 0.18, 0.35, 0.50),
+        "nitrogen": (0.03, 0.12, INF, INF),
+        "phosphorus": (0.01, 0.04, INF, INF),
+        "potassium": (0.03, 0.12, INF, INF),
+    }),
+    ("Corn", ["Dent Corn", "Drought-resistant hybrids"], {
+        "ph_value": (5.0, 5.8, 7.0, 8.0),
+        "organic_matter": (0.5, 2.0, INF, INF),
+        "moisture": (0.10, 0.22, 0.40, 0.55),
+        "nitrogen": (0.05, 0.15, INF, INF),
+        "phosphorus": (0.01, 0.05, INF, INF),
+        "potassium": (0.04, 0.15, INF, INF),
+    }),
+    ("Soybeans", ["Early-maturing varieties", "Mid-maturing varieties"], {
+        "ph_value": (5.0, 6.0, 7.0, 8.0),
+        "organic_matter": (0.5, 1.5, INF, INF),
+        "moisture": (0.10, 0.20, 0.40, 0.55),
+        "nitrogen": (0.02, 0.08, INF, INF),
+        "phosphorus": (0.01, 0.05, INF, INF),
+        "potassium": (0.04, 0.15, INF, INF),
+    }),
+    ("Rice", ["Indica", "Japonica"], {
+        "ph_value": (4.5, 5.5, 7.0, 8.0),
+        "organic_matter": (0.5, 2.0, INF, INF),
+        "moisture": (0.20, 0.40, 1.0, INF),
+        "nitrogen": (0.04, 0.12, INF, INF),
+        "phosphorus": (0.01, 0.04, INF, INF),
+        "potassium": (0.03, 0.10, INF, INF),
+    }),
+    ("Potato", ["Early varieties", "Late varieties"], {
+        "ph_value": (4.5, 5.0, 6.5, 7.5),
+        "organic_matter": (1.0, 2.5, INF, INF),
+        "moisture": (0.10, 0.20, 0.35, 0.50),
+        "nitrogen": (0.04, 0.12, INF, INF),
+        "phosphorus": (0.02, 0.06, INF, INF),
+        "potassium": (0.06, 0.20, INF, INF),
+    }),
+    ("Cotton", ["Upland Cotton"], {
+        "ph_value": (5.0, 5.8, 8.0, 8.8),
+        "organic_matter": (0.3, 1.0, INF, INF),
+        "moisture": (0.06, 0.15, 0.30, 0.45),
+        "nitrogen": (0.03, 0.10, INF, INF),
+        "phosphorus": (0.01, 0.04, INF, INF),
+        "potassium": (0.04, 0.12, INF, INF),
+    }),
+    ("Rapeseed", ["Winter Rapeseed", "Spring Rapeseed"], {
+        "ph_value": (5.0, 5.8, 7.5, 8.3),
+        "organic_matter": (0.5, 1.5, INF, INF),
+        "moisture": (0.10, 0.18, 0.35, 0.50),
+        "nitrogen": (0.04, 0.12, INF, INF),
+        "phosphorus": (0.01, 0.04, INF, INF),
+        "potassium": (0.03, 0.10, INF, INF),
+    }),
+    ("Alfalfa", ["Dormant varieties", "Non-dormant varieties"], {
+        "ph_value": (5.8, 6.5, 7.5, 8.5),
+        "organic_matter": (0.5, 1.5, INF, INF),
+        "moisture": (0.08, 0.15, 0.30, 0.45),
+        "nitrogen": (0.01, 0.05, INF, INF),
+        "phosphorus": (0.02, 0.05, INF, INF),
+        "potassium": (0.06, 0.18, INF, INF),
+    }),
+)
+
+CROP_NAMES = tuple(crop[0] for crop in CROP_CATALOGUE)
+CROP_VARIETIES = tuple(crop[1] for crop in CROP_CATALOGUE)
+
+# Requirement ranges as one array of shape (4, crops, properties): zero below, optimal from,
+# optimal to, zero above, in SOIL_PROPERTIES order
+CROP_REQUIREMENTS = np.moveaxis(
+    np.array([[crop[2][name] for name in SOIL_PROPERTIES] for crop in CROP_CATALOGUE], dtype=np.float64), 2, 0
+)
+
+# Properties scoring below this limit the crop
+LIMITING_SCORE = 70
+
+# Limiting factor descriptions for a property below / above the crop's optimal range
+LIMITING_FACTOR_LABELS = {
+    "ph_value": ("Soil pH too low", "Soil pH too high"),
+    "organic_matter": ("Organic matter too low", "Organic matter too high"),
+    "moisture": ("Soil moisture too low", "Soil moisture too high"),
+    "nitrogen": ("Nitrogen level too low", "Nitrogen level too high"),
+    "phosphorus": ("Phosphorus level too low", "Phosphorus level too high"),
+    "potassium": ("Potassium level too low", "Potassium level too high"),
+}
+
+# (minimum score, suitability level), ascending
+SUITABILITY_LEVELS = ((0, "Not Suitable"), (25, "Low"), (50, "Medium"), (70, "High"), (85, "Very High"))
+SUITABILITY_LEVEL_NAMES = tuple(level for _, level in SUITABILITY_LEVELS)
+
+# Locations scored per broadcast, bounds the (locations, crops, properties) intermediates
+SCORE_BLOCK_LOCATIONS = 100_000
+
+# Nodata value of the uint8 suitability rasters
+RASTER_NODATA = 255
+
+
+def crop_indices(crop_types=None):
+    """
+    Catalogue indices of the requested crops (case-insensitive), all crops when None.
+    """
+    if not crop_types:
+        return np.arange(len(CROP_NAMES))
+    lookup = {name.lower(): i for i, name in enumerate(CROP_NAMES)}
+    unknown = [crop for crop in crop_types if crop.lower() not in lookup]
+    if unknown:
+        raise ValueError(f"Unknown crop types: {unknown}, expected some of {list(CROP_NAMES)}")
+    return np.array(sorted({lookup[crop.lower()] for crop in crop_types}))
+
+
+def score_crops(values, crops=None):
+    """
+    Score locations against crops in one broadcast.
+
+    The suitability score is the geometric mean of the property scores, so a property far
+    outside a crop's range pulls the score down however good the others are.
+
+    Parameters:
+    - values: soil properties, shape (n, len(SOIL_PROPERTIES)), NaN rows for unknown locations
+    - crops: catalogue indices, all crops when None
+
+    Returns:
+    - (scores (n, c), limiting factor codes (n, c)); scores are NaN for unknown locations.
+      A code has bit p set when property p is too low and bit p + len(SOIL_PROPERTIES) when
+      it is too high, see limiting_factors
+    """
+    crops = np.arange(len(CROP_NAMES)) if crops is None else crops
+    zero_below, optimal_from, optimal_to, zero_above = CROP_REQUIREMENTS[:, crops]
+    values = np.asarray(values, dtype=np.float64)[:, None, :]
+
+    property_scores = range_score(values, zero_below, optimal_from, optimal_to, zero_above)
+    with np.errstate(divide="ignore"):
+        scores = np.exp(np.log(property_scores / 100).mean(axis=2)) * 100
+
+    limiting = property_scores < LIMITING_SCORE
+    bits = 1 << np.arange(len(SOIL_PROPERTIES))
+    too_low = (limiting & (values < optimal_from)) @ bits
+    too_high = (limiting & (values > optimal_to)) @ bits
+    return scores, too_low | (too_high << len(SOIL_PROPERTIES))
+
+
+@lru_cache(maxsize=None)
+def limiting_factors(code):
+    """
+    Limiting factor descriptions of a code returned by score_crops.
+    """
+    factors = []
+    for p, name in enumerate(SOIL_PROPERTIES):
+        too_low, too_high = LIMITING_FACTOR_LABELS[name]
+        if code >> p & 1:
+            factors.append(too_low)
+        if code >> (p + len(SOIL_PROPERTIES)) & 1:
+            factors.append(too_high)
+    return tuple(factors)
+
+
+def suitability_levels(scores):
+    """
+    Index into SUITABILITY_LEVEL_NAMES for each score.
+    """
+    thresholds = np.array([minimum for minimum, _ in SUITABILITY_LEVELS[1:]])
+    return np.searchsorted(thresholds, scores, side="right")
+
+
+def crop_suitability_results(values, crops=None):
+    """
+    CropSuitabilityResult rows for each location, best crop first.
+
+    Scoring is done in blocks of SCORE_BLOCK_LOCATIONS locations; only building the
+    response rows is per location.
+
+    Returns:
+    - list with, per location, a list of result dicts (None for unknown locations)
+    """
+    crops = np.arange(len(CROP_NAMES)) if crops is None else crops
+    values = np.asarray(values, dtype=np.float64).reshape(-1, len(SOIL_PROPERTIES))
+    results = []
+    for start in range(0, len(values), SCORE_BLOCK_LOCATIONS):
+        block = values[start:start + SCORE_BLOCK_LOCATIONS]
+        scores, codes = score_crops(block, crops)
+        scores = np.round(scores, 1)
+        order = np.argsort(-np.nan_to_num(scores, nan=-1), axis=1, kind="stable")
+        known = ~np.isnan(block).any(axis=1)
+
+        # Rows sorted by score, as Python lists so the loop below does no NumPy indexing
+        rows = np.arange(len(block))[:, None]
+        crop_order = crops[order].tolist()
+        score_rows = scores[rows, order].tolist()
+        level_rows = suitability_levels(scores)[rows, order].tolist()
+        code_rows = codes[rows, order].tolist()
+
+        for i, is_known in enumerate(known.tolist()):
+            if not is_known:
+                results.append(None)
+                continue
+            results.append([
+                {
+                    "crop_name": CROP_NAMES[crop],
+                    "suitability_score": score,
+                    "suitability_level": SUITABILITY_LEVEL_NAMES[level],
+                    "limiting_factors": limiting_factors(code),
+                    "recommended_varieties": CROP_VARIETIES[crop],
+                }
+                for crop, score, level, code in zip(crop_order[i], score_rows[i], level_rows[i], code_rows[i])
+            ])
+    return results
+
+
+def suitability_raster(values_at, bbox, width, height, crops=None):
+    """
+    Score a regular lon/lat grid over bbox against crops.
+
+    Parameters:
+    - values_at: function (longitudes, latitudes) -> soil properties (n, len(SOIL_PROPERTIES))
+    - bbox: (min_lon, min_lat, max_lon, max_lat)
+    - width / height: raster size in pixels
+
+    Returns:
+    - uint8 array (crops, height, width) of scores, RASTER_NODATA where the soil is unknown
+    """
+    crops = np.arange(len(CROP_NAMES)) if crops is None else crops
+    min_lon, min_lat, max_lon, max_lat = bbox
+    xs = min_lon + (np.arange(width) + 0.5) * (max_lon - min_lon) / width
+    raster = np.full((len(crops), height, width), RASTER_NODATA, dtype=np.uint8)
+
+    rows_per_block = max(1, SCORE_BLOCK_LOCATIONS // width)
+    for start in range(0, height, rows_per_block):
+        stop = min(start + rows_per_block, height)
+        ys = max_lat - (np.arange(start, stop) + 0.5) * (max_lat - min_lat) / height
+        values = values_at(np.tile(xs, stop - start), np.repeat(ys, width))
+        scores, _ = score_crops(values, crops)
+        known = ~np.isnan(scores)
+        block = np.full(scores.shape, RASTER_NODATA, dtype=np.uint8)
+        block[known] = np.rint(scores[known]).astype(np.uint8)
+        raster[:, start:stop] = block.T.reshape(len(crops), stop - start, width)
+    return raster
+
+
+def suitability_geotiff(raster, bbox, crops=None):
+    """
+    Write suitability scores as a DEFLATE compressed uint8 GeoTIFF (EPSG:4326), one band per crop.
+    """
+    crops = np.arange(len(CROP_NAMES)) if crops is None else crops
+    count, rows, cols = raster.shape
+    min_lon, min_lat, max_lon, max_lat = bbox
+    profile = {
+        "driver": "GTiff",
+        "width": cols,
+        "height": rows,
+        "count": count,
+        "dtype": "uint8",
+        "crs": "EPSG:4326",
+        "transform": from_origin(min_lon, max_lat, (max_lon - min_lon) / cols, (max_lat - min_lat) / rows),
+        "nodata": RASTER_NODATA,
+        "compress": "deflate",
+        "predictor": 2,
+    }
+    if rows >= 256 and cols >= 256:
+        profile.update(tiled=True, blockxsize=256, blockysize=256)
+
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dataset:
+            dataset.write(raster)
+            for band, crop in enumerate(crops.tolist(), start=1):
+                dataset.set_band_description(band, CROP_NAMES[crop])
+                dataset.update_tags(band, DESCRIPTION=f"{CROP_NAMES[crop]} suitability score (0-100)")
+        return memfile.read()
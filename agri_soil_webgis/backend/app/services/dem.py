@@ -0,0 +1,216 @@
+from dataclasses import dataclass
+import math
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.errors import WindowError
+from rasterio.features import geometry_mask
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_geom
+from rasterio.windows import Window, from_bounds
+from shapely.geometry import Polygon, mapping, shape
+from app.core.config import RASTER_DIR
+from app.services.projection import local_scales
+
+# 每次读取的最大像元数，用于限制内存占用
+DEM_BLOCK_PIXELS = 4_000_000
+
+
+@dataclass
+class DEMVolumeResult:
+    """
+    DEM 栅格填挖方计算结果
+
+    - pixel_count: 参与计算的像元数量 (边界内且非 nodata)
+    - area: 参与计算的像元总面积 (m²)
+    - cut_volume / fill_volume / net_volume: 汇总结果 (m³)
+    """
+    pixel_count: int
+    area: float
+    cut_volume: float
+    fill_volume: float
+    net_volume: float
+
+
+def resolve_raster_path(name):
+    """
+    将栅格文件名解析为 RASTER_DIR 下的路径，拒绝目录之外的路径
+
+    参数:
+    - name: 相对于 RASTER_DIR 的文件名，例如 "site_a/dem.tif"
+
+    返回:
+    - Path
+    """
+    root = RASTER_DIR.resolve()
+    path = (root / name).resolve()
+    if root != path and root not in path.parents:
+        raise ValueError(f"栅格路径超出数据目录: {name}")
+    if not path.is_file():
+        raise FileNotFoundError(f"栅格文件不存在: {name}")
+    return path
+
+
+def raster_fingerprint(name):
+    """
+    栅格文件的指纹 (文件名、修改时间、大小)，用于缓存失效判断
+    """
+    stat = resolve_raster_path(name).stat()
+    return [name, stat.st_mtime_ns, stat.st_size]
+
+
+def iter_block_windows(window, block_shape, max_pixels=DEM_BLOCK_PIXELS):
+    """
+    将读取窗口按栅格内部分块对齐拆分为若干子窗口
+
+    子窗口的行数为内部块高度的整数倍，每个子窗口不超过 max_pixels 个像元。
+    """
+    block_height, block_width = block_shape
+    col_off = int(window.col_off)
+    row_off = int(window.row_off)
+    width = int(window.width)
+    height = int(window.height)
+
+    # 宽度过大时按内部块宽度切列
+    cols_per_window = width
+    if cols_per_window * block_height > max_pixels:
+        cols_per_window = max(block_width, (max_pixels // block_height) // block_width * block_width)
+    rows_per_window = max(block_height, (max_pixels // cols_per_window) // block_height * block_height)
+
+    for row in range(row_off, row_off + height, rows_per_window):
+        for col in range(col_off, col_off + width, cols_per_window):
+            yield Window(
+                col,
+                row,
+                min(cols_per_window, col_off + width - col),
+                min(rows_per_window, row_off + height - row),
+            )
+
+
+def pixel_areas(dataset, window):
+    """
+    计算窗口内每一行的像元面积 (m²)
+
+    投影坐标系下各行面积相同；地理坐标系 (经纬度) 下按行中心纬度换算。
+
+    返回:
+    - 数组，形状 (rows, 1)，可与窗口数据直接广播
+    """
+    transform = dataset.window_transform(window)
+    rows = int(window.height)
+    if dataset.crs is not None and dataset.crs.is_geographic:
+        row_lats = transform.f + (np.arange(rows) + 0.5) * transform.e
+        lon_scale, lat_scale = local_scales(row_lats)
+        areas = np.abs(transform.a * lon_scale * transform.e * lat_scale)
+    else:
+        areas = np.full(rows, abs(transform.a * transform.e))
+    return areas.reshape(-1, 1)
+
+
+def read_masked(dataset, window):
+    """
+    读取窗口内第一波段数据，nodata 像元替换为 NaN
+    """
+    data = dataset.read(1, window=window, out_dtype="float64", masked=True)
+    return data.filled(np.nan)
+
+
+def integrate_dem_volumes(dem_path, boundary_coordinates, target_height=None, target_dem_path=None,
+                          max_pixels=DEM_BLOCK_PIXELS):
+    """
+    基于本地 DEM 栅格计算多边形区域内的填挖方量
+
+    只读取覆盖多边形外包矩形的窗口，并按栅格内部分块逐块读取，
+    因此大型 DEM (GB 级) 也无需整体加载到内存。
+    每个像元中心落在多边形内的像元参与计算:
+    体积 = 像元面积 × (目标高程 - DEM 高程)，正值计入填方，负值计入挖方。
+
+    参数:
+    - dem_path: 原始地面 DEM 路径
+    - boundary_coordinates: 边界经纬度坐标列表 [(lon1, lat1), (lon2, lat2), ...]
+    - target_height: 目标平面高程 (与 target_dem_path 二选一)
+    - target_dem_path: 目标设计面 DEM 路径，会按原始 DEM 的网格重采样对齐
+    - max_pixels: 每次读取的最大像元数
+
+    返回:
+    - DEMVolumeResult
+    """
+    if (target_height is None) == (target_dem_path is None):
+        raise ValueError("target_height 与 target_dem_path 必须且只能提供一个")
+
+    boundary = Polygon(boundary_coordinates)
+
+    with rasterio.open(dem_path) as dem:
+        # 将边界从经纬度转换到 DEM 坐标系
+        if dem.crs is not None and not dem.crs.is_geographic:
+            boundary = shape(transform_geom("EPSG:4326", dem.crs, mapping(boundary)))
+
+        # 只读取覆盖边界外包矩形的窗口
+        full = Window(0, 0, dem.width, dem.height)
+        try:
+            bounds_window = from_bounds(*boundary.bounds, transform=dem.transform)
+            col_off = math.floor(bounds_window.col_off)
+            row_off = math.floor(bounds_window.row_off)
+            window = Window(
+                col_off,
+                row_off,
+                math.ceil(bounds_window.col_off + bounds_window.width) - col_off,
+                math.ceil(bounds_window.row_off + bounds_window.height) - row_off,
+            ).intersection(full)
+        except WindowError:
+            return DEMVolumeResult(0, 0.0, 0.0, 0.0, 0.0)
+
+        target = None
+        if target_dem_path is not None:
+            target_source = rasterio.open(target_dem_path)
+            target = WarpedVRT(
+                target_source,
+                crs=dem.crs,
+                transform=dem.transform,
+                width=dem.width,
+                height=dem.height,
+                resampling=Resampling.bilinear,
+            )
+
+        pixel_count = 0
+        area = 0.0
+        cut_volume = 0.0
+        fill_volume = 0.0
+
+        try:
+            for block in iter_block_windows(window, dem.block_shapes[0], max_pixels):
+                inside = geometry_mask(
+                    [mapping(boundary)],
+                    out_shape=(int(block.height), int(block.width)),
+                    transform=dem.window_transform(block),
+                    invert=True,
+                )
+                if not inside.any():
+                    continue
+
+                original = read_masked(dem, block)
+                if target is None:
+                    height_diffs = target_height - original
+                else:
+                    height_diffs = read_masked(target, block) - original
+
+                valid = inside & ~np.isnan(height_diffs)
+                areas = np.broadcast_to(pixel_areas(dem, block), valid.shape)[valid]
+                volumes = height_diffs[valid] * areas
+
+                pixel_count += int(valid.sum())
+                area += float(areas.sum())
+                fill_volume += float(volumes[volumes > 0].sum())
+                cut_volume -= float(volumes[volumes < 0].sum())
+        finally:
+            if target is not None:
+                target.close()
+                target_source.close()
+
+    return DEMVolumeResult(
+        pixel_count=pixel_count,
+        area=area,
+        cut_volume=cut_volume,
+        fill_volume=fill_volume,
+        net_volume=fill_volume - cut_volume,
+    )
@@ -0,0 +1,337 @@
+from dataclasses import dataclass
+import math
+import struct
+import zlib
+import numpy as np
+from rasterio.io import MemoryFile
+from rasterio.transform import from_origin
+from app.services.earthwork import HeightDiffInterpolator, iter_lattice_points
+from app.services.projection import LocalFrame
+
+# 差值栅格的最大像元数，用于限制内存占用
+DIFFERENCE_RASTER_MAX_CELLS = 25_000_000
+
+# 三角网栅格化时每批处理的最大 (三角形, 像元) 候选对数
+RASTERIZE_BLOCK_PAIRS = 4_000_000
+
+# XYZ 瓦片大小 (像素)
+TILE_SIZE = 256
+
+# 挖方 (负值) 与填方 (正值) 的颜色，零值为白色
+CUT_COLOR = np.array([178, 24, 43], dtype=np.float64)
+FILL_COLOR = np.array([33, 102, 172], dtype=np.float64)
+
+
+@dataclass
+class DifferenceRaster:
+    """
+    高程差 (目标 - 原始) 栅格，单波段 float32，边界外或三角网外为 NaN
+
+    - values: 栅格数组，形状 (rows, cols)，第0行为最北侧
+    - left / top: 栅格左上角的本地坐标 (米)
+    - resolution: 像元大小 (米)
+    - frame: 本地坐标系，用于换算经纬度和写出 GeoTIFF 的坐标系
+    """
+    values: np.ndarray
+    left: float
+    top: float
+    resolution: float
+    frame: LocalFrame
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    @property
+    def lonlat_bounds(self):
+        """
+        栅格外包范围的经纬度 (min_lon, min_lat, max_lon, max_lat)
+        """
+        rows, cols = self.values.shape
+        right = self.left + cols * self.resolution
+        bottom = self.top - rows * self.resolution
+        corners = np.array([[self.left, bottom], [self.left, self.top], [right, bottom], [right, self.top]])
+        longitudes, latitudes = self.frame.to_lonlat(corners)
+        return float(longitudes.min()), float(latitudes.min()), float(longitudes.max()), float(latitudes.max())
+
+    def statistics(self):
+        valid = self.values[~np.isnan(self.values)]
+        if len(valid) == 0:
+            return {"cell_count": 0, "min_difference": None, "max_difference": None}
+        return {
+            "cell_count": int(len(valid)),
+            "min_difference": float(valid.min()),
+            "max_difference": float(valid.max()),
+        }
+
+
+def raster_grid(boundary_local, resolution):
+    """
+    计算覆盖边界的栅格范围，左下角与边界外包矩形的左下角对齐 (与网格法的网格一致)
+
+    返回:
+    - (left, top, rows, cols)
+    """
+    boundary_local = np.asarray(boundary_local, dtype=np.float64).reshape(-1, 2)
+    min_x, min_y = boundary_local.min(axis=0)
+    max_x, max_y = boundary_local.max(axis=0)
+    cols = max(1, math.ceil((max_x - min_x) / resolution))
+    rows = max(1, math.ceil((max_y - min_y) / resolution))
+    if rows * cols > DIFFERENCE_RASTER_MAX_CELLS:
+        raise ValueError(f"栅格像元数 {rows * cols} 超过上限 {DIFFERENCE_RASTER_MAX_CELLS}，请增大 resolution")
+    return float(min_x), float(min_y + rows * resolution), rows, cols
+
+
+def rasterize_tin_differences(points, triangles, height_diffs, boundary_local, resolution, frame):
+    """
+    将三角网上线性插值的高程差栅格化
+
+    像元中心落在某个三角形内时，取该三角形三个顶点高程差的重心坐标插值。
+    每个三角形只考察其外包矩形覆盖的像元中心，所有 (三角形, 像元) 候选对分批向量化计算。
+
+    参数:
+    - points: 顶点本地坐标数组，形状 (n, 2)
+    - triangles: 裁剪后的三角形顶点索引数组，形状 (m, 3)
+    - height_diffs: 顶点高程差 (目标 - 原始)，形状 (n,)
+    - boundary_local: 边界本地坐标，决定栅格范围
+    - resolution: 像元大小 (米)
+    - frame: 本地坐标系
+
+    返回:
+    - DifferenceRaster
+    """
+    left, top, rows, cols = raster_grid(boundary_local, resolution)
+    values = np.full((rows, cols), np.nan, dtype=np.float32)
+
+    points = np.asarray(points, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=np.intp).reshape(-1, 3)
+    height_diffs = np.asarray(height_diffs, dtype=np.float64)
+    if len(triangles) == 0:
+        return DifferenceRaster(values=values, left=left, top=top, resolution=resolution, frame=frame)
+
+    # 每个三角形外包矩形内的像元中心范围 (列 c 的中心 x = left + (c + 0.5) × resolution)
+    vertices = points[triangles]
+    min_xy = vertices.min(axis=1)
+    max_xy = vertices.max(axis=1)
+    col0 = np.clip(np.ceil((min_xy[:, 0] - left) / resolution - 0.5), 0, cols).astype(np.int64)
+    col1 = np.clip(np.floor((max_xy[:, 0] - left) / resolution - 0.5), -1, cols - 1).astype(np.int64)
+    row0 = np.clip(np.ceil((top - max_xy[:, 1]) / resolution - 0.5), 0, rows).astype(np.int64)
+    row1 = np.clip(np.floor((top - min_xy[:, 1]) / resolution - 0.5), -1, rows - 1).astype(np.int64)
+    widths = np.maximum(col1 - col0 + 1, 0)
+    counts = widths * np.maximum(row1 - row0 + 1, 0)
+
+    # 按候选对数量把三角形分批
+    cumulative = np.cumsum(counts)
+    start = 0
+    while start < len(triangles):
+        budget = (cumulative[start - 1] if start else 0) + RASTERIZE_BLOCK_PAIRS
+        end = max(start + 1, int(np.searchsorted(cumulative, budget, side="right")))
+        block = np.arange(start, end)
+        block_counts = counts[block]
+        start = end
+
+        total = int(block_counts.sum())
+        if total == 0:
+            continue
+        owner = np.repeat(block, block_counts)
+        offset = np.arange(total) - np.repeat(np.cumsum(block_counts) - block_counts, block_counts)
+        cell_cols = col0[owner] + offset % widths[owner]
+        cell_rows = row0[owner] + offset // widths[owner]
+        cx = left + (cell_cols + 0.5) * resolution
+        cy = top - (cell_rows + 0.5) * resolution
+
+        a = vertices[owner, 0]
+        b = vertices[owner, 1]
+        c = vertices[owner, 2]
+        det = (b[:, 1] - c[:, 1]) * (a[:, 0] - c[:, 0]) + (c[:, 0] - b[:, 0]) * (a[:, 1] - c[:, 1])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            l1 = ((b[:, 1] - c[:, 1]) * (cx - c[:, 0]) + (c[:, 0] - b[:, 0]) * (cy - c[:, 1])) / det
+            l2 = ((c[:, 1] - a[:, 1]) * (cx - c[:, 0]) + (a[:, 0] - c[:, 0]) * (cy - c[:, 1])) / det
+        l3 = 1.0 - l1 - l2
+        eps = -1e-9
+        inside = (det != 0) & (l1 >= eps) & (l2 >= eps) & (l3 >= eps)
+
+        corner = triangles[owner[inside]]
+        values[cell_rows[inside], cell_cols[inside]] = (
+            l1[inside] * height_diffs[corner[:, 0]]
+            + l2[inside] * height_diffs[corner[:, 1]]
+            + l3[inside] * height_diffs[corner[:, 2]]
+        )
+
+    return DifferenceRaster(values=values, left=left, top=top, resolution=resolution, frame=frame)
+
+
+def rasterize_grid_differences(points, height_diffs, boundary_local, resolution, frame,
+                               interpolation="nearest", idw_neighbors=8, idw_power=2.0):
+    """
+    按网格法的插值方式生成边界内的高程差栅格 (像元即网格法的网格)
+
+    参数:
+    - points: 采样点本地坐标数组，形状 (n, 2)
+    - height_diffs: 采样点高程差 (目标 - 原始)，形状 (n,)
+    - boundary_local: 边界本地坐标
+    - resolution: 像元大小 (米)
+    - frame: 本地坐标系
+    - interpolation / idw_neighbors / idw_power: 同 integrate_grid_volumes
+
+    返回:
+    - DifferenceRaster
+    """
+    left, top, rows, cols = raster_grid(boundary_local, resolution)
+    values = np.full((rows, cols), np.nan, dtype=np.float32)
+    interpolator = HeightDiffInterpolator(points, height_diffs, interpolation, idw_neighbors, idw_power)
+
+    # 格网与栅格左下角对齐，由网格中心坐标反算行列号
+    bottom = top - rows * resolution
+    for centers in iter_lattice_points(boundary_local, resolution):
+        cell_cols = np.floor((centers[:, 0] - left) / resolution).astype(np.int64)
+        cell_rows = rows - 1 - np.floor((centers[:, 1] - bottom) / resolution).astype(np.int64)
+        values[cell_rows, cell_cols] = interpolator(centers)
+
+    return DifferenceRaster(values=values, left=left, top=top, resolution=resolution, frame=frame)
+
+
+def to_geotiff(raster):
+    """
+    将差值栅格写出为 DEFLATE 压缩的单波段 float32 GeoTIFF
+
+    local 模式的本地坐标与经纬度是线性关系，写为 EPSG:4326 栅格；
+    tmerc/utm 模式写为对应的投影坐标系。
+
+    返回:
+    - GeoTIFF 文件内容 (bytes)
+    """
+    frame = raster.frame
+    rows, cols = raster.values.shape
+    if frame.crs is None:
+        crs = "EPSG:4326"
+        transform = from_origin(
+            frame.origin[0] + raster.left / frame.lon_scale,
+            frame.origin[1] + raster.top / frame.lat_scale,
+            raster.resolution / frame.lon_scale,
+            raster.resolution / frame.lat_scale,
+        )
+    else:
+        crs = frame.crs
+        transform = from_origin(
+            frame.offset[0] + raster.left, frame.offset[1] + raster.top, raster.resolution, raster.resolution
+        )
+
+    profile = {
+        "driver": "GTiff",
+        "width": cols,
+        "height": rows,
+        "count": 1,
+        "dtype": "float32",
+        "crs": crs,
+        "transform": transform,
+        "nodata": float("nan"),
+        "compress": "deflate",
+        "predictor": 3,
+    }
+    if rows >= 256 and cols >= 256:
+        profile.update(tiled=True, blockxsize=256, blockysize=256)
+
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dataset:
+            dataset.write(raster.values, 1)
+            dataset.update_tags(1, DESCRIPTION="target_height - original_height (m)")
+        return memfile.read()
+
+
+def tile_lonlat(z, x, y, size=TILE_SIZE):
+    """
+    XYZ (Web Mercator) 瓦片中各像素中心的经纬度
+
+    返回:
+    - (经度数组, 纬度数组)，形状均为 (size, size)
+    """
+    n = 2 ** z
+    longitudes = (x + (np.arange(size) + 0.5) / size) / n * 360.0 - 180.0
+    mercator_y = (y + (np.arange(size) + 0.5) / size) / n
+    latitudes = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * mercator_y))))
+    return np.meshgrid(longitudes, latitudes)
+
+
+def tile_bounds(z, x, y):
+    """
+    XYZ 瓦片的经纬度范围 (min_lon, min_lat, max_lon, max_lat)
+    """
+    n = 2 ** z
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+    return x / n * 360.0 - 180.0, latitude(y + 1), (x + 1) / n * 360.0 - 180.0, latitude(y)
+
+
+def render_tile(raster, z, x, y, max_abs=None):
+    """
+    将差值栅格重采样 (最近邻) 到 XYZ 瓦片并着色
+
+    挖方 (负值) 为红色、填方 (正值) 为蓝色，颜色深浅按 |差值| / max_abs 线性变化，无数据处透明。
+
+    参数:
+    - raster: DifferenceRaster
+    - z / x / y: 瓦片编号
+    - max_abs: 颜色满量程对应的 |差值| (米)，默认为栅格中的最大 |差值|
+
+    返回:
+    - RGBA 数组，形状 (TILE_SIZE, TILE_SIZE, 4)，uint8；瓦片与栅格不相交时返回 None
+    """
+    min_lon, min_lat, max_lon, max_lat = raster.lonlat_bounds
+    west, south, east, north = tile_bounds(z, x, y)
+    if east < min_lon or west > max_lon or north < min_lat or south > max_lat:
+        return None
+
+    longitudes, latitudes = tile_lonlat(z, x, y)
+    local = raster.frame.to_local(longitudes.ravel(), latitudes.ravel())
+    rows, cols = raster.values.shape
+    cell_cols = np.floor((local[:, 0] - raster.left) / raster.resolution).astype(np.int64)
+    cell_rows = np.floor((raster.top - local[:, 1]) / raster.resolution).astype(np.int64)
+    valid = (cell_cols >= 0) & (cell_cols < cols) & (cell_rows >= 0) & (cell_rows < rows)
+
+    values = np.full(len(local), np.nan, dtype=np.float64)
+    values[valid] = raster.values[cell_rows[valid], cell_cols[valid]]
+    valid &= ~np.isnan(values)
+    if not valid.any():
+        return None
+
+    if max_abs is None:
+        max_abs = float(np.nanmax(np.abs(raster.values)))
+    scale = np.clip(values[valid] / max_abs, -1.0, 1.0) if max_abs > 0 else np.zeros(int(valid.sum()))
+
+    color = np.where(scale[:, None] < 0, CUT_COLOR, FILL_COLOR)
+    rgb = 255.0 + (color - 255.0) * np.abs(scale)[:, None]
+
+    rgba = np.zeros((len(local), 4), dtype=np.uint8)
+    rgba[valid, :3] = np.round(rgb).astype(np.uint8)
+    rgba[valid, 3] = 255
+    return rgba.reshape(TILE_SIZE, TILE_SIZE, 4)
+
+
+def encode_png(rgba):
+    """
+    将 RGBA 数组编码为 PNG (无滤波，zlib 压缩)
+
+    参数:
+    - rgba: 形状 (h, w, 4) 的 uint8 数组
+
+    返回:
+    - PNG 文件内容 (bytes)
+    """
+    height, width, _ = rgba.shape
+    scanlines = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    scanlines[:, 1:] = rgba.reshape(height, -1)
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(scanlines.tobytes(), 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+# 与栅格不相交或全部无数据的瓦片
+EMPTY_TILE_PNG = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
@@ -0,0 +1,473 @@
+from dataclasses import dataclass
+from typing import Optional
+import math
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+from scipy.spatial import cKDTree, Delaunay
+from scipy.interpolate import LinearNDInterpolator
+from app.services.projection import LocalFrame
+
+# 网格法支持的插值方式
+GRID_INTERPOLATION_METHODS = ("nearest", "idw", "linear")
+
+# 网格法每批处理的最大网格数，用于限制内存占用
+GRID_BLOCK_CELLS = 1_000_000
+
+# 多方案计算每批处理的最大 (计算单元数 × 方案数)，用于限制内存占用
+SCENARIO_BLOCK_VALUES = 4_000_000
+
+
+@dataclass
+class TINVolumeResult:
+    """
+    三角网填挖方批量计算结果
+
+    - areas: 每个三角形的平面面积 (m²)
+    - mean_height_diffs: 每个三角形三个顶点的平均高程差 (目标 - 原始)
+    - volumes: 每个三角形的有符号体积 (正值为填方，负值为挖方)
+    - cut_volume / fill_volume / net_volume: 汇总结果 (m³)
+    """
+    areas: np.ndarray
+    mean_height_diffs: np.ndarray
+    volumes: np.ndarray
+    cut_volume: float
+    fill_volume: float
+    net_volume: float
+
+
+@dataclass
+class GridVolumeResult:
+    """
+    网格法填挖方计算结果
+
+    - cell_count: 边界内的网格数量
+    - cell_area: 单个网格面积 (m²)
+    - cut_volume / fill_volume / net_volume: 汇总结果 (m³)
+    """
+    cell_count: int
+    cell_area: float
+    cut_volume: float
+    fill_volume: float
+    net_volume: float
+
+
+@dataclass
+class ScenarioVolumeResult:
+    """
+    多方案填挖方计算结果，数组按方案顺序排列
+
+    - cut_volumes / fill_volumes / net_volumes: 每个方案的挖方量、填方量与净体积 (m³)
+    """
+    cut_volumes: np.ndarray
+    fill_volumes: np.ndarray
+    net_volumes: np.ndarray
+
+
+@dataclass
+class TINGeometry:
+    """
+    与高程无关的三角网几何数据，可在仅高程变化的请求之间复用
+
+    - boundary_local: 边界多边形本地坐标，形状 (b, 2)
+    - sample_local: 采样点本地坐标，形状 (n, 2)
+    - area: 边界多边形面积 (m²)
+    - triangles: 裁剪后的三角形顶点索引，形状 (m, 3)；网格法为 None
+    - frame: 边界与采样点共用的本地坐标系，用于把本地坐标换算回经纬度
+    """
+    boundary_local: np.ndarray
+    sample_local: np.ndarray
+    area: float
+    triangles: Optional[np.ndarray] = None
+    frame: Optional[LocalFrame] = None
+
+    @property
+    def nbytes(self):
+        size = self.boundary_local.nbytes + self.sample_local.nbytes
+        if self.triangles is not None:
+            size += self.triangles.nbytes
+        return size
+
+
+def triangle_areas(points, triangles):
+    """
+    批量计算三角形面积
+
+    参数:
+    - points: 顶点坐标数组，形状 (n, 2)
+    - triangles: 三角形顶点索引数组，形状 (m, 3)
+
+    返回:
+    - 面积数组，形状 (m,)
+    """
+    points = np.asarray(points, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=np.intp).reshape(-1, 3)
+
+    p1 = points[triangles[:, 0]]
+    p2 = points[triangles[:, 1]]
+    p3 = points[triangles[:, 2]]
+
+    # 叉积的一半即为三角形面积
+    cross = (p2[:, 0] - p1[:, 0]) * (p3[:, 1] - p1[:, 1]) - (p3[:, 0] - p1[:, 0]) * (p2[:, 1] - p1[:, 1])
+    return 0.5 * np.abs(cross)
+
+
+def integrate_tin_volumes(points, triangles, original_heights, target_heights):
+    """
+    一次性计算三角网中所有三棱柱的填挖方量
+
+    与逐个三角形调用 calculate_triangular_prism_volume 的结果一致：
+    每个三角形的体积 = 面积 × 三个顶点的平均高程差，正值计入填方，负值计入挖方。
+
+    参数:
+    - points: 顶点坐标数组，形状 (n, 2)
+    - triangles: 三角形顶点索引数组，形状 (m, 3)
+    - original_heights: 原始高程数组，形状 (n,)
+    - target_heights: 目标高程数组，形状 (n,)
+
+    返回:
+    - TINVolumeResult
+    """
+    triangles = np.asarray(triangles, dtype=np.intp).reshape(-1, 3)
+    height_diffs = np.asarray(target_heights, dtype=np.float64) - np.asarray(original_heights, dtype=np.float64)
+
+    areas = triangle_areas(points, triangles)
+    mean_height_diffs = height_diffs[triangles].mean(axis=1)
+    volumes = areas * mean_height_diffs
+
+    fill_volume = float(volumes[volumes > 0].sum())
+    cut_volume = 0.0 - float(volumes[volumes < 0].sum())
+
+    return TINVolumeResult(
+        areas=areas,
+        mean_height_diffs=mean_height_diffs,
+        volumes=volumes,
+        cut_volume=cut_volume,
+        fill_volume=fill_volume,
+        net_volume=fill_volume - cut_volume,
+    )
+
+
+def as_boundary_geometry(boundary_polygon):
+    """
+    将边界转换为已预处理 (prepared) 的 Shapely 多边形
+
+    参数:
+    - boundary_polygon: 顶点坐标列表 [(x1, y1), (x2, y2), ...] 或 Shapely 多边形
+
+    返回:
+    - Shapely 多边形 (已调用 shapely.prepare，可重复用于批量判断)
+    """
+    if isinstance(boundary_polygon, shapely.Geometry):
+        geometry = boundary_polygon
+    else:
+        geometry = Polygon(boundary_polygon)
+    shapely.prepare(geometry)
+    return geometry
+
+
+def boundary_segments(boundary):
+    """
+    将多边形的所有环 (外环及内环) 拆分为线段数组
+
+    返回:
+    - Shapely LineString 数组，每条线段对应边界的一条边
+    """
+    rings = shapely.get_rings(shapely.get_parts(boundary))
+    segments = []
+    for ring in rings:
+        coords = shapely.get_coordinates(ring)
+        segments.append(shapely.linestrings(np.stack([coords[:-1], coords[1:]], axis=1)))
+    if not segments:
+        return np.empty(0, dtype=object)
+    return np.concatenate(segments)
+
+
+def clip_triangles(points, triangles, boundary_polygon):
+    """
+    批量裁剪三角网，只保留完全位于边界多边形内的三角形
+
+    先对每个顶点做一次向量化的点在多边形内判断 (每个采样点只判断一次)，
+    三个顶点都在边界内的三角形作为候选；候选中与边界线相交的三角形
+    (例如跨越凹多边形缺口或内环) 再用预处理多边形做精确的 covers 判断。
+
+    参数:
+    - points: 顶点坐标数组，形状 (n, 2)
+    - triangles: 三角形顶点索引数组，形状 (m, 3)
+    - boundary_polygon: 边界顶点坐标列表或 Shapely 多边形
+
+    返回:
+    - 保留的三角形索引数组，形状 (k, 3)
+    """
+    points = np.asarray(points, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=np.intp).reshape(-1, 3)
+    boundary = as_boundary_geometry(boundary_polygon)
+
+    # 顶点判断: 落在边界上的顶点也视为在内
+    vertex_inside = shapely.intersects_xy(boundary, points[:, 0], points[:, 1])
+    candidates = triangles[vertex_inside[triangles].all(axis=1)]
+    return drop_crossing_triangles(points, candidates, boundary)
+
+
+def drop_crossing_triangles(points, candidates, boundary):
+    """
+    从顶点均在边界内的候选三角形中剔除越出边界的三角形
+
+    参数:
+    - points: 顶点坐标数组，形状 (n, 2)
+    - candidates: 三个顶点都在边界内的三角形索引数组，形状 (m, 3)
+    - boundary: 已预处理的 Shapely 多边形 (as_boundary_geometry 的结果)
+
+    返回:
+    - 保留的三角形索引数组，形状 (k, 3)
+    """
+    if len(candidates) == 0:
+        return candidates
+
+    # 只有与边界线相交的候选三角形才可能越出边界
+    triangle_polygons = shapely.polygons(points[candidates])
+    tree = shapely.STRtree(triangle_polygons)
+    _, touching = tree.query(boundary_segments(boundary), predicate="intersects")
+    touching = np.unique(touching)
+
+    keep = np.ones(len(candidates), dtype=bool)
+    if len(touching):
+        keep[touching] = shapely.covers(boundary, triangle_polygons[touching])
+    return candidates[keep]
+
+
+class HeightDiffInterpolator:
+    """
+    基于 cKDTree 的高程差插值器
+
+    采样点只建一次 KD 树，之后可对任意批量的查询点插值。
+
+    - nearest: 最近邻插值
+    - idw: 反距离加权插值，使用最近的 k 个采样点
+    - linear: 三角网线性插值，三角网外的点退化为最近邻
+
+    height_diffs 可以是形状 (n, k) 的矩阵 (每列一个方案)，此时插值结果形状为 (q, k)。
+    """
+
+    def __init__(self, points, height_diffs, method="nearest", idw_neighbors=8, idw_power=2.0):
+        if method not in GRID_INTERPOLATION_METHODS:
+            raise ValueError(f"不支持的插值方式: {method}")
+
+        self.points = np.asarray(points, dtype=np.float64)
+        self.height_diffs = np.asarray(height_diffs, dtype=np.float64)
+        self.method = method
+        self.idw_neighbors = max(1, min(int(idw_neighbors), len(self.points)))
+        self.idw_power = float(idw_power)
+        self.tree = cKDTree(self.points)
+        self.linear = None
+        if method == "linear":
+            self.linear = LinearNDInterpolator(Delaunay(self.points), self.height_diffs)
+
+    def nearest(self, query):
+        _, idx = self.tree.query(query, k=1, workers=-1)
+        return self.height_diffs[idx]
+
+    def idw(self, query):
+        if self.idw_neighbors == 1:
+            return self.nearest(query)
+
+        distances, idx = self.tree.query(query, k=self.idw_neighbors, workers=-1)
+        values = self.height_diffs[idx]
+
+        # 与采样点重合的查询点直接取采样值
+        exact = distances[:, 0] == 0
+        with np.errstate(divide="ignore"):
+            weights = 1.0 / distances ** self.idw_power
+        weights[exact] = 0.0
+        weights[exact, 0] = 1.0
+        if values.ndim == 3:
+            weights = weights[:, :, None]
+        return (weights * values).sum(axis=1) / weights.sum(axis=1)
+
+    def __call__(self, query):
+        query = np.asarray(query, dtype=np.float64).reshape(-1, 2)
+        if len(query) == 0:
+            return np.empty((0,) + self.height_diffs.shape[1:], dtype=np.float64)
+
+        if self.method == "nearest":
+            return self.nearest(query)
+        if self.method == "idw":
+            return self.idw(query)
+
+        values = self.linear(query)
+        outside = np.isnan(values)
+        if outside.ndim > 1:
+            outside = outside.any(axis=1)
+        if outside.any():
+            values[outside] = self.nearest(query[outside])
+        return values
+
+
+def iter_lattice_points(boundary_polygon, grid_size, cell_centers=True, block_cells=GRID_BLOCK_CELLS):
+    """
+    按行分批生成边界内的规则格网点
+
+    格网以边界外包矩形的左下角 (min_x, min_y) 为起点:
+    - cell_centers=True: 产出网格中心点 min_x + (i + 0.5) * grid_size，i < ceil(宽度 / grid_size)
+    - cell_centers=False: 产出格网节点 min_x + i * grid_size，i <= ceil(宽度 / grid_size)
+
+    每批点只做一次向量化的点在多边形内判断，内存占用与区域大小无关。
+
+    参数:
+    - boundary_polygon: 边界顶点坐标列表或 Shapely 多边形
+    - grid_size: 网格大小 (米)
+    - cell_centers: 生成网格中心点还是格网节点
+    - block_cells: 每批最多包含的点数
+
+    返回:
+    - 迭代器，每次产出边界内的点数组，形状 (k, 2)
+    """
+    boundary = as_boundary_geometry(boundary_polygon)
+    min_x, min_y, max_x, max_y = boundary.bounds
+
+    grid_count_x = math.ceil((max_x - min_x) / grid_size)
+    grid_count_y = math.ceil((max_y - min_y) / grid_size)
+    if cell_centers:
+        offset = 0.5
+    else:
+        offset = 0.0
+        grid_count_x += 1
+        grid_count_y += 1
+    if grid_count_x <= 0 or grid_count_y <= 0:
+        return
+
+    lattice_x = min_x + (np.arange(grid_count_x) + offset) * grid_size
+    rows_per_block = max(1, block_cells // grid_count_x)
+
+    for start in range(0, grid_count_y, rows_per_block):
+        rows = np.arange(start, min(start + rows_per_block, grid_count_y))
+        lattice_y = min_y + (rows + offset) * grid_size
+        xx, yy = np.meshgrid(lattice_x, lattice_y)
+        xx = xx.ravel()
+        yy = yy.ravel()
+        inside = shapely.contains_xy(boundary, xx, yy)
+        if inside.any():
+            yield np.column_stack((xx[inside], yy[inside]))
+
+
+def integrate_grid_volumes(points, original_heights, target_heights, boundary_polygon,
+                           grid_size=5.0, interpolation="nearest", idw_neighbors=8, idw_power=2.0,
+                           interpolator=None):
+    """
+    网格法计算填挖方量
+
+    将边界区域划分为 grid_size × grid_size 的网格，对边界内的网格中心插值高程差，
+    每个网格的体积 = 网格面积 × 高程差，正值计入填方，负值计入挖方。
+
+    参数:
+    - points: 采样点坐标数组，形状 (n, 2)
+    - original_heights / target_heights: 采样点原始高程与目标高程，形状 (n,)
+    - boundary_polygon: 边界顶点坐标列表或 Shapely 多边形
+    - grid_size: 网格大小 (米)
+    - interpolation: 插值方式 "nearest"、"idw" 或 "linear"
+    - idw_neighbors / idw_power: 反距离加权的邻近点数与幂次
+    - interpolator: 已建好的 HeightDiffInterpolator，提供时忽略采样点和插值参数 (多个边界共用同一组采样点时复用)
+
+    返回:
+    - GridVolumeResult
+    """
+    if interpolator is None:
+        height_diffs = np.asarray(target_heights, dtype=np.float64) - np.asarray(original_heights, dtype=np.float64)
+        interpolator = HeightDiffInterpolator(points, height_diffs, interpolation, idw_neighbors, idw_power)
+
+    cell_area = grid_size * grid_size
+    cell_count = 0
+    cut_volume = 0.0
+    fill_volume = 0.0
+
+    for centers in iter_lattice_points(boundary_polygon, grid_size):
+        volumes = interpolator(centers) * cell_area
+        cell_count += len(centers)
+        fill_volume += float(volumes[volumes > 0].sum())
+        cut_volume -= float(volumes[volumes < 0].sum())
+
+    return GridVolumeResult(
+        cell_count=cell_count,
+        cell_area=cell_area,
+        cut_volume=cut_volume,
+        fill_volume=fill_volume,
+        net_volume=fill_volume - cut_volume,
+    )
+
+
+def integrate_tin_scenarios(points, triangles, original_heights, target_heights):
+    """
+    在同一个三角网上一次性计算多个设计方案的填挖方量
+
+    每个方案的计算方式与 integrate_tin_volumes 相同；所有方案按 (三角形 × 方案) 矩阵分批计算，
+    每批的大小由 SCENARIO_BLOCK_VALUES 限制。
+
+    参数:
+    - points: 顶点坐标数组，形状 (n, 2)
+    - triangles: 三角形顶点索引数组，形状 (m, 3)
+    - original_heights: 原始高程数组，形状 (n,)
+    - target_heights: 目标高程矩阵，形状 (n, k)，每列一个方案
+
+    返回:
+    - ScenarioVolumeResult
+    """
+    triangles = np.asarray(triangles, dtype=np.intp).reshape(-1, 3)
+    target_heights = np.asarray(target_heights, dtype=np.float64)
+    height_diffs = target_heights - np.asarray(original_heights, dtype=np.float64)[:, None]
+    scenario_count = height_diffs.shape[1]
+
+    areas = triangle_areas(points, triangles)
+    cut_volumes = np.zeros(scenario_count, dtype=np.float64)
+    fill_volumes = np.zeros(scenario_count, dtype=np.float64)
+
+    block = max(1, SCENARIO_BLOCK_VALUES // max(scenario_count, 1))
+    for start in range(0, len(triangles), block):
+        block_triangles = triangles[start:start + block]
+        mean_height_diffs = (
+            height_diffs[block_triangles[:, 0]] + height_diffs[block_triangles[:, 1]] + height_diffs[block_triangles[:, 2]]
+        ) / 3
+        volumes = areas[start:start + block, None] * mean_height_diffs
+        fill_volumes += np.where(volumes > 0, volumes, 0.0).sum(axis=0)
+        cut_volumes -= np.where(volumes < 0, volumes, 0.0).sum(axis=0)
+
+    return ScenarioVolumeResult(
+        cut_volumes=cut_volumes,
+        fill_volumes=fill_volumes,
+        net_volumes=fill_volumes - cut_volumes,
+    )
+
+
+def integrate_grid_scenarios(points, original_heights, target_heights, boundary_polygon,
+                             grid_size=5.0, interpolation="nearest", idw_neighbors=8, idw_power=2.0):
+    """
+    使用网格法一次性计算多个设计方案的填挖方量
+
+    网格中心只生成和查找一次邻近采样点，所有方案的高程差作为矩阵一起插值。
+
+    参数:
+    - target_heights: 目标高程矩阵，形状 (n, k)，每列一个方案
+    - 其余参数同 integrate_grid_volumes
+
+    返回:
+    - ScenarioVolumeResult
+    """
+    target_heights = np.asarray(target_heights, dtype=np.float64)
+    height_diffs = target_heights - np.asarray(original_heights, dtype=np.float64)[:, None]
+    scenario_count = height_diffs.shape[1]
+    interpolator = HeightDiffInterpolator(points, height_diffs, interpolation, idw_neighbors, idw_power)
+
+    cell_area = grid_size * grid_size
+    cut_volumes = np.zeros(scenario_count, dtype=np.float64)
+    fill_volumes = np.zeros(scenario_count, dtype=np.float64)
+
+    block_cells = max(1, SCENARIO_BLOCK_VALUES // max(scenario_count, 1))
+    for centers in iter_lattice_points(boundary_polygon, grid_size, block_cells=block_cells):
+        volumes = interpolator(centers) * cell_area
+        fill_volumes += np.where(volumes > 0, volumes, 0.0).sum(axis=0)
+        cut_volumes -= np.where(volumes < 0, volumes, 0.0).sum(axis=0)
+
+    return ScenarioVolumeResult(
+        cut_volumes=cut_volumes,
+        fill_volumes=fill_volumes,
+        net_volumes=fill_volumes - cut_volumes,
+    )
@@ -0,0 +1,568 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import shutil
+import uuid
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.io import MemoryFile
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window, transform as window_transform
+from starlette.concurrency import run_in_threadpool
+from app.core.config import (
+    EROSION_C_FACTOR,
+    EROSION_C_RASTER,
+    EROSION_CACHE_DIR,
+    EROSION_CACHE_MAX_BYTES,
+    EROSION_DEM,
+    EROSION_K_FACTOR,
+    EROSION_MAX_SLOPE_LENGTH,
+    EROSION_P_FACTOR,
+    EROSION_P_RASTER,
+    EROSION_R_FACTOR,
+    EROSION_R_RASTER,
+    EROSION_TILE_SIZE,
+)
+from app.services.cache import LRUCache
+from app.services.dem import raster_fingerprint, read_masked, resolve_raster_path
+from app.services.jobs import run_in_process
+from app.services.projection import get_transformer, local_scales
+
+# Order of the cached per-tile factor rasters
+TILE_FACTORS = ("R", "LS", "C", "P")
+
+# D8 neighbour offsets (row, column)
+D8_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+# Moore & Burch (1986) LS factor: (As / 22.13)^m (sin θ / 0.0896)^n
+LS_AREA_EXPONENT = 0.4
+LS_SLOPE_EXPONENT = 1.3
+
+# Largest soil loss map served in one request (pixels)
+MAX_MAP_PIXELS = 64 * 1024 * 1024
+
+# (minimum annual soil loss in t/ha/a, risk level), ascending
+EROSION_RISK_LEVELS = ((0, "Very Low"), (2, "Low"), (5, "Medium"), (10, "High"), (20, "Very High"))
+
+# Soil loss (t/ha/a) at which the 0-100 risk score (logarithmic) saturates
+RISK_SCORE_SATURATION = 50
+
+# Factors above these values are reported as contributing, with their mitigation
+EROSION_FACTOR_THRESHOLDS = {
+    "LS": (1.0, "Slope length and steepness", "Build terraces or grassed waterways to shorten slopes"),
+    "R": (300.0, "Rainfall erosivity", "Keep the soil covered during the rainy season"),
+    "K": (0.03, "Soil erodibility", "Increase soil organic matter to stabilise soil aggregates"),
+    "C": (0.1, "Sparse vegetation cover", "Plant cover crops during the off-season and leave crop residues"),
+    "P": (0.8, "Lack of conservation practices", "Implement contour farming or strip cropping"),
+}
+
+
+@dataclass(frozen=True)
+class ErosionModel:
+    """
+    RUSLE model inputs: A = R · K · LS · C · P (t/ha/a).
+
+    - dem: DEM file name under RASTER_DIR; tiles are tile_size × tile_size DEM pixels
+    - r_raster / c_raster / p_raster: factor rasters under RASTER_DIR, resampled onto the DEM
+      grid; the constant factors are used where they are missing or nodata
+    - k_factor: K at 2 % organic matter, corrected per pixel for the interpolated organic matter
+    - max_slope_length: cap on the specific catchment area (m), also sets the tile halo
+    """
+    dem: str = EROSION_DEM
+    r_raster: Optional[str] = EROSION_R_RASTER
+    c_raster: Optional[str] = EROSION_C_RASTER
+    p_raster: Optional[str] = EROSION_P_RASTER
+    r_factor: float = EROSION_R_FACTOR
+    k_factor: float = EROSION_K_FACTOR
+    c_factor: float = EROSION_C_FACTOR
+    p_factor: float = EROSION_P_FACTOR
+    tile_size: int = EROSION_TILE_SIZE
+    max_slope_length: float = EROSION_MAX_SLOPE_LENGTH
+
+    def fingerprint(self):
+        """
+        Hash of the parameters and the input rasters' fingerprints; changes when any input file changes.
+        """
+        rasters = [self.dem, self.r_raster, self.c_raster, self.p_raster]
+        fingerprints = [raster_fingerprint(name) for name in rasters if name]
+        payload = json.dumps([asdict(self), fingerprints], sort_keys=True)
+        return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+@dataclass
+class DEMGrid:
+    """
+    Georeferencing of the model DEM.
+    """
+    crs: str
+    geographic: bool
+    transform: object
+    width: int
+    height: int
+
+    @classmethod
+    def from_dataset(cls, dem):
+        return cls(
+            crs=dem.crs.to_string() if dem.crs else "EPSG:4326",
+            geographic=dem.crs is None or dem.crs.is_geographic,
+            transform=dem.transform,
+            width=dem.width,
+            height=dem.height,
+        )
+
+    @classmethod
+    def open(cls, model):
+        with rasterio.open(resolve_raster_path(model.dem)) as dem:
+            return cls.from_dataset(dem)
+
+    def pixel_size(self, latitude):
+        """
+        Pixel width and height in metres (at the given latitude for geographic DEMs).
+        """
+        if self.geographic:
+            lon_scale, lat_scale = local_scales(latitude)
+            return abs(self.transform.a) * lon_scale, abs(self.transform.e) * lat_scale
+        return abs(self.transform.a), abs(self.transform.e)
+
+    def pixel(self, longitude, latitude):
+        """
+        Fractional (row, column) of a WGS84 location.
+        """
+        x, y = longitude, latitude
+        if not self.geographic:
+            x, y = get_transformer(self.crs).transform(longitude, latitude)
+        column, row = ~self.transform * (x, y)
+        return row, column
+
+    def pixel_lonlat(self, window):
+        """
+        WGS84 longitudes and latitudes of the pixel centres of a window, shape (rows, cols).
+        """
+        rows = np.arange(window.row_off, window.row_off + window.height)[:, None] + 0.5
+        columns = np.arange(window.col_off, window.col_off + window.width)[None, :] + 0.5
+        t = self.transform
+        x = t.a * columns + t.b * rows + t.c
+        y = t.d * columns + t.e * rows + t.f
+        if not self.geographic:
+            x, y = get_transformer(self.crs).transform(x, y, direction="INVERSE")
+        return np.broadcast_to(x, (window.height, window.width)), np.broadcast_to(y, (window.height, window.width))
+
+    def tile_keys(self, window, tile_size):
+        """
+        (tile row, tile column) of the tiles overlapping a pixel window.
+        """
+        rows = range(window.row_off // tile_size, (window.row_off + window.height - 1) // tile_size + 1)
+        columns = range(window.col_off // tile_size, (window.col_off + window.width - 1) // tile_size + 1)
+        return [(row, column) for row in rows for column in columns]
+
+    def tile_window(self, key, tile_size):
+        row, column = key
+        row_off, col_off = row * tile_size, column * tile_size
+        return Window(col_off, row_off, min(tile_size, self.width - col_off), min(tile_size, self.height - row_off))
+
+
+def d8_receivers(elevation, dx, dy):
+    """
+    Flat index of each cell's steepest downslope neighbour (D8), -1 for pits, flats and nodata.
+    """
+    rows, cols = elevation.shape
+    padded = np.pad(elevation, 1, constant_values=np.nan)
+    index = np.arange(rows * cols).reshape(rows, cols)
+    steepest = np.zeros(elevation.shape)
+    receivers = np.full(elevation.shape, -1, dtype=np.int64)
+    for dr, dc in D8_OFFSETS:
+        neighbour = padded[1 + dr:1 + dr + rows, 1 + dc:1 + dc + cols]
+        with np.errstate(invalid="ignore"):
+            drop = (elevation - neighbour) / math.hypot(dr * dy, dc * dx)
+            steeper = drop > steepest
+        steepest[steeper] = drop[steeper]
+        receivers[steeper] = (index + dr * cols + dc)[steeper]
+    return receivers.ravel()
+
+
+def flow_accumulation(receivers, cell_area, valid):
+    """
+    Upslope contributing area (m², including the cell itself) of every cell.
+
+    Cells are processed in topological order, all cells whose donors are done at once, so the
+    loop runs once per cell of the longest flow path rather than once per cell.
+    """
+    accumulated = np.where(valid, cell_area, 0.0)
+    has_receiver = receivers >= 0
+    pending = np.bincount(receivers[has_receiver], minlength=len(receivers))
+    ready = np.flatnonzero(has_receiver & (pending == 0))
+    while len(ready):
+        targets = receivers[ready]
+        np.add.at(accumulated, targets, accumulated[ready])
+        np.subtract.at(pending, targets, 1)
+        targets = np.unique(targets)
+        ready = targets[(pending[targets] == 0) & has_receiver[targets]]
+    return accumulated
+
+
+def ls_factor(elevation, dx, dy, max_slope_length):
+    """
+    RUSLE LS factor of a DEM window (Moore & Burch), NaN where the DEM is nodata.
+
+    The specific catchment area (contributing area per unit contour width, D8) stands in for
+    the slope length and is capped at max_slope_length.
+    """
+    valid = ~np.isnan(elevation)
+    gradient_y, gradient_x = np.gradient(elevation, dy, dx)
+    tangent = np.hypot(gradient_x, gradient_y)
+    sine = tangent / np.sqrt(1 + tangent ** 2)
+
+    accumulated = flow_accumulation(d8_receivers(elevation, dx, dy), dx * dy, valid.ravel())
+    specific_area = np.minimum(accumulated.reshape(elevation.shape) / math.sqrt(dx * dy), max_slope_length)
+    ls = (specific_area / 22.13) ** LS_AREA_EXPONENT * (sine / 0.0896) ** LS_SLOPE_EXPONENT
+    ls[~valid] = np.nan
+    return ls
+
+
+def read_factor(name, default, dem, window):
+    """
+    A factor raster resampled onto a DEM window, or the constant default when not configured.
+    """
+    shape = (int(window.height), int(window.width))
+    if not name:
+        return np.full(shape, default, dtype=np.float32)
+    with rasterio.open(resolve_raster_path(name)) as source, WarpedVRT(
+        source, crs=dem.crs, transform=dem.transform, width=dem.width, height=dem.height,
+        resampling=Resampling.bilinear,
+    ) as vrt:
+        data = read_masked(vrt, window)
+    return np.where(np.isnan(data), default, data).astype(np.float32)
+
+
+def compute_factor_tile(model, tile_row, tile_column):
+    """
+    R, LS, C and P of one DEM tile (runs in the process pool).
+
+    The DEM is read with a halo of max_slope_length around the tile so that flow
+    accumulation near the tile edges sees the upslope cells outside the tile.
+
+    Returns:
+    - float32 array (4, rows, cols) in TILE_FACTORS order
+    """
+    with rasterio.open(resolve_raster_path(model.dem)) as dem:
+        grid = DEMGrid.from_dataset(dem)
+        window = grid.tile_window((tile_row, tile_column), model.tile_size)
+        center_latitude = 0.0
+        if grid.geographic:
+            center_latitude = (dem.transform * (window.col_off + window.width / 2, window.row_off + window.height / 2))[1]
+        dx, dy = grid.pixel_size(center_latitude)
+
+        halo = math.ceil(model.max_slope_length / min(dx, dy)) + 1
+        row_start, col_start = max(window.row_off - halo, 0), max(window.col_off - halo, 0)
+        row_stop = min(window.row_off + window.height + halo, dem.height)
+        col_stop = min(window.col_off + window.width + halo, dem.width)
+        elevation = read_masked(dem, Window(col_start, row_start, col_stop - col_start, row_stop - row_start))
+
+        ls = ls_factor(elevation, dx, dy, model.max_slope_length)
+        inner = (
+            slice(window.row_off - row_start, window.row_off - row_start + window.height),
+            slice(window.col_off - col_start, window.col_off - col_start + window.width),
+        )
+        return np.stack((
+            read_factor(model.r_raster, model.r_factor, dem, window),
+            ls[inner].astype(np.float32),
+            read_factor(model.c_raster, model.c_factor, dem, window),
+            read_factor(model.p_raster, model.p_factor, dem, window),
+        ))
+
+
+class ErosionTileCache:
+    """
+    Memory + disk cache of per-tile factor rasters, keyed by the model fingerprint.
+
+    Missing tiles are computed in the process pool in parallel; concurrent requests for the
+    same tile share one computation. Files live in {directory}/{dem hash}-{fingerprint}/, and
+    a new fingerprint of the same DEM removes the directories of the previous ones.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.memory = LRUCache(max_bytes)
+        self.pending = {}
+
+    def folder(self, model, fingerprint):
+        return self.directory / f"{hashlib.sha1(model.dem.encode()).hexdigest()[:8]}-{fingerprint}"
+
+    def path(self, folder, key):
+        return folder / f"{key[0]}_{key[1]}.npy"
+
+    def load(self, folder, keys):
+        """
+        Factor rasters of the given tiles found in memory or on disk (reads files, call it in
+        the threadpool).
+
+        Returns:
+        - {key: factors} of the tiles found
+        """
+        found = {}
+        for key in keys:
+            path = self.path(folder, key)
+            factors = self.memory.get(path)
+            if factors is None and path.is_file():
+                try:
+                    factors = np.load(path, allow_pickle=False)
+                except (OSError, ValueError):
+                    continue
+                self.memory.put(path, factors, factors.nbytes)
+            if factors is not None:
+                found[key] = factors
+        return found
+
+    def store(self, folder, key, factors):
+        path = self.path(folder, key)
+        self.memory.put(path, factors, factors.nbytes)
+        try:
+            if not folder.is_dir():
+                folder.mkdir(parents=True, exist_ok=True)
+                prefix = folder.name.split("-")[0]
+                for previous in self.directory.glob(f"{prefix}-*"):
+                    if previous != folder:
+                        shutil.rmtree(previous, ignore_errors=True)
+            temporary = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+            with open(temporary, "wb") as file:
+                np.save(file, factors)
+            os.replace(temporary, path)
+        except OSError:
+            pass
+
+    async def compute(self, model, folder, key):
+        factors = await run_in_process(compute_factor_tile, model, *key)
+        await run_in_threadpool(self.store, folder, key, factors)
+        return factors
+
+    async def tiles(self, model, keys):
+        """
+        Factor rasters of the given tiles.
+
+        Returns:
+        - {key: float32 array (4, rows, cols)}
+        """
+        folder = self.folder(model, await run_in_threadpool(model.fingerprint))
+        result = {}
+        for key in keys:
+            factors = self.memory.get(self.path(folder, key))
+            if factors is not None:
+                result[key] = factors
+        # Tiles missing from memory are read from disk off the event loop (up to ~4 MB each)
+        missing = [key for key in keys if key not in result]
+        if missing:
+            result.update(await run_in_threadpool(self.load, folder, missing))
+
+        waiting = {}
+        for key in keys:
+            if key in result:
+                continue
+            pending_key = (folder, key)
+            future = self.pending.get(pending_key)
+            if future is None:
+                future = asyncio.ensure_future(self.compute(model, folder, key))
+                self.pending[pending_key] = future
+                future.add_done_callback(lambda _, pending_key=pending_key: self.pending.pop(pending_key, None))
+            waiting[key] = future
+
+        for key, factors in zip(waiting, await asyncio.gather(*waiting.values())):
+            result[key] = factors
+        return result
+
+
+erosion_tile_cache = ErosionTileCache(EROSION_CACHE_DIR, EROSION_CACHE_MAX_BYTES)
+
+
+def soil_erodibility(k_factor, organic_matter):
+    """
+    K corrected for organic matter with the (12 - OM) term of the Wischmeier nomograph.
+
+    OM (%) is capped at 4 as in the nomograph; k_factor is the value at 2 % and is used
+    unchanged where the organic matter is unknown.
+    """
+    organic_matter = np.clip(np.nan_to_num(organic_matter, nan=2.0), 0, 4)
+    return k_factor * (12 - organic_matter) / 10
+
+
+def soil_loss_window(model, grid, window, tiles, organic_matter_at):
+    """
+    Annual soil loss A = R · K · LS · C · P over a DEM pixel window.
+
+    Parameters:
+    - tiles: factor rasters of the tiles overlapping the window (ErosionTileCache.tiles)
+    - organic_matter_at: function (longitudes, latitudes) -> organic matter (%), NaN if unknown
+
+    Returns:
+    - (float32 soil loss (rows, cols) with NaN for nodata, {factor: mean over valid pixels})
+    """
+    soil_loss = np.full((window.height, window.width), np.nan, dtype=np.float32)
+    sums = dict.fromkeys((*TILE_FACTORS, "K"), 0.0)
+    count = 0
+    for key, factors in tiles.items():
+        tile = grid.tile_window(key, model.tile_size)
+        row_start = max(window.row_off, tile.row_off)
+        row_stop = min(window.row_off + window.height, tile.row_off + tile.height)
+        col_start = max(window.col_off, tile.col_off)
+        col_stop = min(window.col_off + window.width, tile.col_off + tile.width)
+        if row_start >= row_stop or col_start >= col_stop:
+            continue
+
+        part = factors[:, row_start - tile.row_off:row_stop - tile.row_off, col_start - tile.col_off:col_stop - tile.col_off]
+        longitudes, latitudes = grid.pixel_lonlat(Window(col_start, row_start, col_stop - col_start, row_stop - row_start))
+        k = soil_erodibility(model.k_factor, organic_matter_at(longitudes.ravel(), latitudes.ravel())).reshape(part.shape[1:])
+        loss = np.prod(part, axis=0) * k
+        soil_loss[row_start - window.row_off:row_stop - window.row_off, col_start - window.col_off:col_stop - window.col_off] = loss
+
+        valid = ~np.isnan(loss)
+        count += int(valid.sum())
+        for name, values in zip(TILE_FACTORS, part):
+            sums[name] += float(values[valid].sum())
+        sums["K"] += float(k[valid].sum())
+
+    means = {name: (total / count if count else float("nan")) for name, total in sums.items()}
+    return soil_loss, means
+
+
+def point_window(grid, longitude, latitude, area_size=None):
+    """
+    DEM pixel window of a location, or of a square of area_size hectares centred on it.
+
+    Returns:
+    - Window, or None when the location is outside the DEM
+    """
+    row, column = grid.pixel(longitude, latitude)
+    if not (0 <= row < grid.height and 0 <= column < grid.width):
+        return None
+    if not area_size:
+        return Window(int(column), int(row), 1, 1)
+
+    dx, dy = grid.pixel_size(latitude)
+    half_side = math.sqrt(area_size * 10000) / 2
+    row_start = max(math.floor(row - half_side / dy), 0)
+    row_stop = min(math.ceil(row + half_side / dy), grid.height)
+    col_start = max(math.floor(column - half_side / dx), 0)
+    col_stop = min(math.ceil(column + half_side / dx), grid.width)
+    return Window(col_start, row_start, max(col_stop - col_start, 1), max(row_stop - row_start, 1))
+
+
+def erosion_risk_level(soil_loss):
+    """
+    Risk level and 0-100 risk score of an annual soil loss (t/ha/a).
+    """
+    level = EROSION_RISK_LEVELS[0][1]
+    for minimum, name in EROSION_RISK_LEVELS:
+        if soil_loss >= minimum:
+            level = name
+    score = min(100.0, 100 * math.log1p(soil_loss) / math.log1p(RISK_SCORE_SATURATION))
+    return level, round(score, 1)
+
+
+def erosion_risk_summary(soil_loss, factors):
+    """
+    Risk level, score, contributing factors and mitigation strategies for a mean soil loss (t/ha/a).
+    """
+    level, score = erosion_risk_level(soil_loss)
+
+    exceeding = sorted(
+        (
+            (factors[name] / threshold, name, label, mitigation)
+            for name, (threshold, label, mitigation) in EROSION_FACTOR_THRESHOLDS.items()
+            if factors[name] > threshold
+        ),
+        reverse=True,
+    )
+    contributing = [f"{label} ({name} = {factors[name]:.3g})" for _, name, label, _ in exceeding]
+    mitigation = [strategy for *_, strategy in exceeding]
+    return {
+        "risk_level": level,
+        "risk_score": score,
+        "contributing_factors": contributing or ["No dominant erosion factor"],
+        "mitigation_strategies": mitigation or ["Maintain current conservation practices"],
+    }
+
+
+async def analyze_erosion(model, longitude, latitude, area_size, organic_matter_at, cache=erosion_tile_cache):
+    """
+    RUSLE annual soil loss at a location, or averaged over area_size hectares around it.
+
+    Returns:
+    - dict with annual_soil_loss (t/ha/a), the mean factors and the risk summary, or None
+      when the location is outside the DEM or on nodata
+    """
+    grid = await run_in_threadpool(DEMGrid.open, model)
+    window = point_window(grid, longitude, latitude, area_size)
+    if window is None:
+        return None
+
+    tiles = await cache.tiles(model, grid.tile_keys(window, model.tile_size))
+    soil_loss, factors = await run_in_threadpool(soil_loss_window, model, grid, window, tiles, organic_matter_at)
+    if np.isnan(soil_loss).all():
+        return None
+
+    annual_soil_loss = float(np.nanmean(soil_loss))
+    return {
+        "annual_soil_loss": round(annual_soil_loss, 3),
+        "factors": {name: round(value, 4) for name, value in factors.items()},
+        **erosion_risk_summary(annual_soil_loss, factors),
+    }
+
+
+async def soil_loss_map(model, bbox, organic_matter_at, cache=erosion_tile_cache):
+    """
+    Annual soil loss over the DEM pixels within a WGS84 bounding box (the whole DEM when None),
+    computed tile by tile across the process pool.
+
+    Returns:
+    - GeoTIFF bytes (float32, t/ha/a, NaN nodata, DEM CRS), or None when bbox misses the DEM
+    """
+    grid = await run_in_threadpool(DEMGrid.open, model)
+    if bbox is None:
+        window = Window(0, 0, grid.width, grid.height)
+    else:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        corners = [grid.pixel(lon, lat) for lon in (min_lon, max_lon) for lat in (min_lat, max_lat)]
+        rows, columns = zip(*corners)
+        row_start, row_stop = max(math.floor(min(rows)), 0), min(math.ceil(max(rows)), grid.height)
+        col_start, col_stop = max(math.floor(min(columns)), 0), min(math.ceil(max(columns)), grid.width)
+        if row_start >= row_stop or col_start >= col_stop:
+            return None
+        window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+    if window.width * window.height > MAX_MAP_PIXELS:
+        raise ValueError(f"The map would have {window.width * window.height} pixels, at most {MAX_MAP_PIXELS} are allowed; use a smaller bbox")
+
+    tiles = await cache.tiles(model, grid.tile_keys(window, model.tile_size))
+    soil_loss, _ = await run_in_threadpool(soil_loss_window, model, grid, window, tiles, organic_matter_at)
+    return await run_in_threadpool(soil_loss_geotiff, grid, window, soil_loss)
+
+
+def soil_loss_geotiff(grid, window, soil_loss):
+    """
+    Write a soil loss window as a DEFLATE compressed float32 GeoTIFF in the DEM's CRS.
+    """
+    rows, cols = soil_loss.shape
+    profile = {
+        "driver": "GTiff",
+        "width": cols,
+        "height": rows,
+        "count": 1,
+        "dtype": "float32",
+        "crs": grid.crs,
+        "transform": window_transform(window, grid.transform),
+        "nodata": float("nan"),
+        "compress": "deflate",
+        "predictor": 3,
+    }
+    if rows >= 256 and cols >= 256:
+        profile.update(tiled=True, blockxsize=256, blockysize=256)
+
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dataset:
+            dataset.write(soil_loss, 1)
+            dataset.update_tags(1, DESCRIPTION="RUSLE annual soil loss (t/ha/a)")
+        return memfile.read()
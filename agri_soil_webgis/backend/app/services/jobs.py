@@ -0,0 +1,147 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from app.core.config import COMPUTE_WORKERS, JOB_MAX_STORED, JOB_RESULT_TTL
+
+# 任务状态
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+process_pool = None
+process_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """
+    获取 (必要时创建) 计算密集型任务共用的进程池
+
+    使用 spawn 方式启动子进程，避免在多线程的 uvicorn 进程中 fork。
+    进程池损坏 (例如子进程被系统杀死) 后会自动重建。
+    """
+    global process_pool
+    with process_pool_lock:
+        if process_pool is None or getattr(process_pool, "_broken", False):
+            process_pool = ProcessPoolExecutor(
+                max_workers=COMPUTE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return process_pool
+
+
+def shutdown_process_pool():
+    """
+    关闭进程池，在应用关闭时调用
+    """
+    global process_pool
+    with process_pool_lock:
+        if process_pool is not None:
+            process_pool.shutdown(wait=False, cancel_futures=True)
+            process_pool = None
+
+
+async def run_in_process(func, *args, **kwargs):
+    """
+    在进程池中执行计算函数并等待结果，不阻塞事件循环
+
+    func 及其参数必须可以被 pickle (模块级函数、NumPy 数组、Pydantic 模型等)。
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), partial(func, *args, **kwargs))
+
+
+class Job:
+    """
+    后台计算任务
+    """
+
+    def __init__(self, operation, future):
+        self.id = uuid.uuid4().hex
+        self.operation = operation
+        self.future = future
+        self.created_at = time.time()
+        self.finished_at = None
+        future.add_done_callback(self.mark_finished)
+
+    def mark_finished(self, future):
+        self.finished_at = time.time()
+
+    @property
+    def status(self):
+        if not self.future.done():
+            return JOB_RUNNING if self.future.running() else JOB_PENDING
+        if self.future.cancelled() or self.future.exception() is not None:
+            return JOB_FAILED
+        return JOB_COMPLETED
+
+    @property
+    def error(self):
+        if self.status != JOB_FAILED:
+            return None
+        if self.future.cancelled():
+            return "任务已取消"
+        return str(self.future.exception())
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "operation": self.operation,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobStore:
+    """
+    内存中的后台任务表
+
+    - 已完成的任务保留 ttl 秒后清除
+    - 最多保留 max_jobs 个任务，超出时按提交顺序清除已完成的任务
+    """
+
+    def __init__(self, ttl=JOB_RESULT_TTL, max_jobs=JOB_MAX_STORED):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, operation, func, *args, **kwargs):
+        """
+        将计算函数提交到进程池，立即返回任务
+        """
+        future = get_process_pool().submit(func, *args, **kwargs)
+        job = Job(operation, future)
+        with self.lock:
+            self.prune()
+            self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            self.prune()
+            return self.jobs.get(job_id)
+
+    def prune(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.ttl
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+        if len(self.jobs) >= self.max_jobs:
+            finished = [job_id for job_id, job in self.jobs.items() if job.finished_at is not None]
+            for job_id in finished[:len(self.jobs) - self.max_jobs + 1]:
+                del self.jobs[job_id]
+
+
+job_store = JobStore()
@@ -0,0 +1,114 @@
+import struct
+
+# Mapbox Vector Tile 2.1 constants
+MVT_VERSION = 2
+MVT_EXTENT = 4096
+GEOM_POINT = 1
+COMMAND_MOVE_TO_ONE = (1 & 0x7) | (1 << 3)
+
+# Protobuf wire types
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH_DELIMITED = 2
+
+
+def varint(value):
+    """
+    Encode a non-negative integer as a protobuf varint.
+    """
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def field_key(field, wire_type):
+    return varint((field << 3) | wire_type)
+
+
+def length_delimited(field, payload):
+    return field_key(field, WIRE_LENGTH_DELIMITED) + varint(len(payload)) + payload
+
+
+def packed_varints(field, values):
+    return length_delimited(field, b"".join(varint(value) for value in values))
+
+
+def encode_value(value):
+    """
+    Encode a tile Value message: strings, booleans, non-negative integers or doubles.
+    """
+    if isinstance(value, str):
+        return length_delimited(1, value.encode("utf-8"))
+    if isinstance(value, bool):
+        return field_key(7, WIRE_VARINT) + varint(int(value))
+    if isinstance(value, int) and value >= 0:
+        return field_key(5, WIRE_VARINT) + varint(value)
+    return field_key(3, WIRE_FIXED64) + struct.pack("<d", float(value))
+
+
+def encode_point_layer(name, ids, xs, ys, properties, extent=MVT_EXTENT):
+    """
+    Encode one layer of point features.
+
+    Parameters:
+    - name: layer name
+    - ids: feature ids (non-negative integers)
+    - xs / ys: tile coordinates already quantized to [0, extent) (buffered points may fall outside)
+    - properties: mapping of property name to a sequence of values, one per feature;
+      None values are omitted from the feature
+    - extent: tile extent
+
+    Returns:
+    - Layer message bytes (without the enclosing Tile field)
+    """
+    keys = list(properties)
+    columns = [properties[key] for key in keys]
+    value_index = {}
+    values = []
+
+    features = []
+    for i, (feature_id, x, y) in enumerate(zip(ids, xs, ys)):
+        tags = []
+        for key_index, column in enumerate(columns):
+            value = column[i]
+            if value is None:
+                continue
+            value_key = (type(value), value)
+            index = value_index.get(value_key)
+            if index is None:
+                index = value_index[value_key] = len(values)
+                values.append(encode_value(value))
+            tags.append(key_index)
+            tags.append(index)
+
+        feature = (
+            field_key(1, WIRE_VARINT) + varint(int(feature_id))
+            + packed_varints(2, tags)
+            + field_key(3, WIRE_VARINT) + varint(GEOM_POINT)
+            + packed_varints(4, (COMMAND_MOVE_TO_ONE, zigzag(int(x)), zigzag(int(y))))
+        )
+        features.append(length_delimited(2, feature))
+
+    layer = (
+        field_key(15, WIRE_VARINT) + varint(MVT_VERSION)
+        + length_delimited(1, name.encode("utf-8"))
+        + b"".join(features)
+        + b"".join(length_delimited(3, key.encode("utf-8")) for key in keys)
+        + b"".join(length_delimited(4, value) for value in values)
+        + field_key(5, WIRE_VARINT) + varint(extent)
+    )
+    return layer
+
+
+def encode_tile(layers):
+    """
+    Wrap encoded layers into a Tile message. A tile without layers encodes to b"".
+    """
+    return b"".join(length_delimited(3, layer) for layer in layers)
@@ -0,0 +1,230 @@
+from dataclasses import dataclass
+import numpy as np
+import shapely
+from scipy.spatial import Delaunay
+from app.services.earthwork import (
+    HeightDiffInterpolator,
+    as_boundary_geometry,
+    drop_crossing_triangles,
+    integrate_grid_volumes,
+    integrate_tin_volumes,
+)
+from app.services.projection import local_scales
+
+
+@dataclass
+class ParcelVolumeResult:
+    """
+    多地块填挖方计算结果，数组按地块顺序排列
+
+    - counts: 每个地块参与计算的三角形数 (三角网法) 或网格数 (网格法)
+    - cut_volumes / fill_volumes: 每个地块的挖方量与填方量 (m³)
+    """
+    counts: np.ndarray
+    cut_volumes: np.ndarray
+    fill_volumes: np.ndarray
+
+
+def parcel_polygons(features):
+    """
+    将 GeoJSON 要素列表转换为 Shapely 多边形数组
+
+    参数:
+    - features: app.schemas.geojson.Feature 列表，几何类型必须为 Polygon (可带内环)
+
+    返回:
+    - Shapely 多边形数组，形状 (p,)
+    """
+    if not features:
+        raise ValueError("至少需要1个地块")
+
+    polygons = np.empty(len(features), dtype=object)
+    for i, feature in enumerate(features):
+        geometry = feature.geometry
+        if geometry.type != "Polygon":
+            raise ValueError(f"第 {i} 个地块的几何类型必须为 Polygon，实际为 {geometry.type}")
+        rings = [np.asarray(ring, dtype=np.float64)[:, :2] for ring in geometry.coordinates]
+        if not rings or len(rings[0]) < 3:
+            raise ValueError(f"第 {i} 个地块的多边形至少需要3个顶点")
+        polygons[i] = shapely.polygons(rings[0], holes=rings[1:] or None)
+
+    invalid = np.flatnonzero(~shapely.is_valid(polygons))
+    if len(invalid):
+        raise ValueError(f"地块多边形无效 (自相交等): {invalid[:10].tolist()}")
+    return polygons
+
+
+def geographic_areas(polygons):
+    """
+    批量计算经纬度多边形的面积 (m²)
+
+    与 calculate_geographic_area 的换算方式相同，每个多边形按自身外环的平均纬度缩放经度，
+    但所有多边形的坐标一次性换算，面积由 shapely.area 向量化计算。
+
+    参数:
+    - polygons: 经纬度 Shapely 多边形数组
+
+    返回:
+    - 面积数组，形状 (p,)
+    """
+    exterior, exterior_index = shapely.get_coordinates(shapely.get_exterior_ring(polygons), return_index=True)
+    avg_lats = np.bincount(exterior_index, weights=exterior[:, 1], minlength=len(polygons))
+    avg_lats /= np.maximum(np.bincount(exterior_index, minlength=len(polygons)), 1)
+
+    coords, index = shapely.get_coordinates(polygons, return_index=True)
+    lon_scales, lat_scale = local_scales(avg_lats)
+
+    # 相对每个多边形第一个顶点平移后再缩放，减小大坐标值带来的浮点误差
+    first = np.searchsorted(index, np.arange(len(polygons)))
+    first = np.minimum(first, len(coords) - 1)
+    scaled = np.empty_like(coords)
+    scaled[:, 0] = (coords[:, 0] - coords[first[index], 0]) * lon_scales[index]
+    scaled[:, 1] = (coords[:, 1] - coords[first[index], 1]) * lat_scale
+    return shapely.area(shapely.set_coordinates(polygons.copy(), scaled))
+
+
+def triangulate_points(points):
+    """
+    对全部采样点做一次 Delaunay 三角剖分，多个地块共用
+
+    返回:
+    - 三角形顶点索引数组，形状 (m, 3)
+    """
+    return Delaunay(np.asarray(points, dtype=np.float64)).simplices.astype(np.int32)
+
+
+def split_parcel_chunks(boundaries, chunk_count):
+    """
+    将地块按质心 x 坐标排序后分成若干组，使每组地块在空间上集中，便于裁剪采样点
+
+    返回:
+    - 地块序号数组的列表
+    """
+    order = np.argsort(shapely.get_x(shapely.centroid(boundaries)), kind="stable")
+    chunk_count = max(1, min(chunk_count, len(boundaries)))
+    return [chunk for chunk in np.array_split(order, chunk_count) if len(chunk)]
+
+
+def crop_triangulation(points, triangles, bounds):
+    """
+    只保留三个顶点都在外包矩形内的三角形及其顶点，并重新编号
+
+    地块内的三角形一定落在地块外包矩形内，因此裁剪后不影响各地块的计算结果，
+    同时减少传给子进程的数据量。
+
+    参数:
+    - points: 顶点坐标数组，形状 (n, 2)
+    - triangles: 三角形顶点索引数组，形状 (m, 3)
+    - bounds: (min_x, min_y, max_x, max_y)
+
+    返回:
+    - (保留的顶点序号, 重新编号后的三角形数组)
+    """
+    min_x, min_y, max_x, max_y = bounds
+    inside = (
+        (points[:, 0] >= min_x) & (points[:, 0] <= max_x)
+        & (points[:, 1] >= min_y) & (points[:, 1] <= max_y)
+    )
+    kept_triangles = triangles[inside[triangles].all(axis=1)]
+    vertex_ids = np.flatnonzero(inside)
+    new_ids = np.cumsum(inside) - 1
+    return vertex_ids, new_ids[kept_triangles].astype(np.int32)
+
+
+def integrate_parcel_tin_volumes(points, triangles, original_heights, target_heights, boundaries):
+    """
+    在共用的三角网上分别计算多个地块的填挖方量
+
+    所有采样点只做一次批量的点在地块内判断 (STRtree)；每个地块的候选三角形
+    (三个顶点都在该地块内) 通过按第一个顶点排序的索引直接取出，再剔除越出地块边界的三角形，
+    结果与对每个地块单独调用 clip_triangles 相同。
+
+    参数:
+    - points: 采样点本地坐标数组，形状 (n, 2)
+    - triangles: 全部采样点的三角形顶点索引数组，形状 (m, 3)
+    - original_heights / target_heights: 采样点原始高程与目标高程，形状 (n,)
+    - boundaries: 本地坐标的地块多边形数组，形状 (p,)
+
+    返回:
+    - ParcelVolumeResult
+    """
+    points = np.asarray(points, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=np.intp).reshape(-1, 3)
+    parcel_count = len(boundaries)
+
+    counts = np.zeros(parcel_count, dtype=np.int64)
+    cut_volumes = np.zeros(parcel_count, dtype=np.float64)
+    fill_volumes = np.zeros(parcel_count, dtype=np.float64)
+
+    # 采样点与地块的包含关系 (落在边界上的点也视为在内)
+    tree = shapely.STRtree(boundaries)
+    point_ids, parcel_ids = tree.query(shapely.points(points), predicate="intersects")
+    order = np.argsort(parcel_ids, kind="stable")
+    point_ids = point_ids[order]
+    parcel_starts = np.searchsorted(parcel_ids[order], np.arange(parcel_count + 1))
+
+    # 三角形按第一个顶点排序，便于取出以某组顶点为第一个顶点的全部三角形
+    by_first = np.argsort(triangles[:, 0], kind="stable")
+    first_sorted = triangles[by_first, 0]
+
+    inside = np.zeros(len(points), dtype=bool)
+    for parcel in range(parcel_count):
+        members = point_ids[parcel_starts[parcel]:parcel_starts[parcel + 1]]
+        if len(members) < 3:
+            continue
+
+        starts = np.searchsorted(first_sorted, members, side="left")
+        ends = np.searchsorted(first_sorted, members, side="right")
+        lengths = ends - starts
+        if lengths.sum() == 0:
+            continue
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        candidate_ids = by_first[offsets + np.arange(lengths.sum())]
+
+        inside[members] = True
+        candidates = triangles[candidate_ids]
+        candidates = candidates[inside[candidates].all(axis=1)]
+        inside[members] = False
+
+        boundary = as_boundary_geometry(boundaries[parcel])
+        kept = drop_crossing_triangles(points, candidates, boundary)
+        if len(kept) == 0:
+            continue
+
+        result = integrate_tin_volumes(points, kept, original_heights, target_heights)
+        counts[parcel] = len(kept)
+        cut_volumes[parcel] = result.cut_volume
+        fill_volumes[parcel] = result.fill_volume
+
+    return ParcelVolumeResult(counts=counts, cut_volumes=cut_volumes, fill_volumes=fill_volumes)
+
+
+def integrate_parcel_grid_volumes(points, original_heights, target_heights, boundaries,
+                                  grid_size=5.0, interpolation="nearest", idw_neighbors=8, idw_power=2.0):
+    """
+    使用网格法分别计算多个地块的填挖方量，所有地块共用同一个插值器 (只建一次KD树)
+
+    参数:
+    - points: 采样点本地坐标数组，形状 (n, 2)
+    - original_heights / target_heights: 采样点原始高程与目标高程，形状 (n,)
+    - boundaries: 本地坐标的地块多边形数组，形状 (p,)
+    - 其余参数同 integrate_grid_volumes
+
+    返回:
+    - ParcelVolumeResult
+    """
+    height_diffs = np.asarray(target_heights, dtype=np.float64) - np.asarray(original_heights, dtype=np.float64)
+    interpolator = HeightDiffInterpolator(points, height_diffs, interpolation, idw_neighbors, idw_power)
+
+    counts = np.zeros(len(boundaries), dtype=np.int64)
+    cut_volumes = np.zeros(len(boundaries), dtype=np.float64)
+    fill_volumes = np.zeros(len(boundaries), dtype=np.float64)
+    for parcel, boundary in enumerate(boundaries):
+        result = integrate_grid_volumes(
+            points, original_heights, target_heights, boundary, grid_size=grid_size, interpolator=interpolator
+        )
+        counts[parcel] = result.cell_count
+        cut_volumes[parcel] = result.cut_volume
+        fill_volumes[parcel] = result.fill_volume
+
+    return ParcelVolumeResult(counts=counts, cut_volumes=cut_volumes, fill_volumes=fill_volumes)
@@ -0,0 +1,179 @@
+from functools import lru_cache
+import math
+import numpy as np
+import shapely
+
+# 地球半径 (米)
+EARTH_RADIUS = 6371000
+
+# 本地坐标系的投影方式:
+# - local: 平均纬度下的等距近似 (与 convert_to_local_coordinates 一致)，适用于小范围场地
+# - tmerc: 以场地中心为中央经线的横轴墨卡托投影 (WGS84 椭球，比例因子1)，适用于大范围场地
+# - utm: 场地所在的标准UTM分带 (比例因子0.9996)，便于与UTM测量成果对照
+PROJECTION_MODES = ("local", "tmerc", "utm")
+
+
+def local_scales(avg_lat):
+    """
+    计算平均纬度下经纬度与米的换算系数
+
+    返回:
+    - (lon_scale, lat_scale): 1度经度、1度纬度对应的距离 (米)
+    """
+    lon_scale = np.cos(np.radians(avg_lat)) * EARTH_RADIUS * np.pi / 180
+    lat_scale = EARTH_RADIUS * np.pi / 180
+    return lon_scale, lat_scale
+
+
+def lonlat_to_local(longitudes, latitudes, avg_lat=None, origin=None):
+    """
+    将经纬度数组转换为本地平面坐标 (米)
+
+    与 convert_to_local_coordinates 的换算方式相同，默认以输入点的最小经纬度为原点，
+    但直接对数组运算，不经过逐点的 Python 对象。
+
+    参数:
+    - longitudes / latitudes: 经纬度数组，形状 (n,)
+    - avg_lat: 平均纬度，如果为None则计算
+    - origin: 原点经纬度 (lon, lat)，如果为None则取输入点的最小经纬度
+
+    返回:
+    - 本地坐标数组，形状 (n, 2)
+    """
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+
+    if avg_lat is None:
+        avg_lat = float(latitudes.mean())
+
+    lon_scale, lat_scale = local_scales(avg_lat)
+
+    if origin is None:
+        origin = (longitudes.min(), latitudes.min())
+
+    local = np.empty((len(longitudes), 2), dtype=np.float64)
+    np.multiply(longitudes - origin[0], lon_scale, out=local[:, 0])
+    np.multiply(latitudes - origin[1], lat_scale, out=local[:, 1])
+    return local
+
+
+def lonlat_arrays(points):
+    """
+    将经纬度字典列表一次性转换为连续的 float64 数组
+
+    参数:
+    - points: [{"longitude": x, "latitude": y, ...}, ...]
+
+    返回:
+    - (经度数组, 纬度数组)
+    """
+    coords = np.array([(p["longitude"], p["latitude"]) for p in points], dtype=np.float64).reshape(-1, 2)
+    return np.ascontiguousarray(coords[:, 0]), np.ascontiguousarray(coords[:, 1])
+
+
+def utm_crs(longitude, latitude):
+    """
+    返回经纬度所在的UTM分带坐标系 (EPSG代码字符串)
+    """
+    zone = min(int(math.floor((longitude + 180) / 6)) + 1, 60)
+    return f"EPSG:{32600 + zone if latitude >= 0 else 32700 + zone}"
+
+
+@lru_cache(maxsize=64)
+def get_transformer(crs):
+    """
+    获取 (并缓存) WGS84经纬度到投影坐标系的转换器，需要安装 pyproj
+    """
+    try:
+        from pyproj import Transformer
+    except ImportError:
+        raise ValueError("tmerc/utm 投影需要安装pyproj")
+    return Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+
+
+class LocalFrame:
+    """
+    本地平面坐标系 (米)
+
+    原点和换算系数 (或投影转换器) 只计算一次，同一请求或同一数据集的边界和采样点
+    都用同一个坐标系转换，保证坐标可以直接比较。所有转换都直接对 NumPy 数组运算。
+
+    - avg_lat: 平均纬度 (local 模式的经度缩放基准)
+    - origin: 原点经纬度 (lon, lat)，对应本地坐标 (0, 0)
+    - mode: 投影方式，见 PROJECTION_MODES
+    """
+
+    def __init__(self, avg_lat, origin, mode="local", center_lon=None):
+        if mode not in PROJECTION_MODES:
+            raise ValueError(f"不支持的投影方式: {mode}")
+
+        self.avg_lat = float(avg_lat)
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.mode = mode
+        self.lon_scale, self.lat_scale = local_scales(self.avg_lat)
+
+        self.crs = None
+        self.offset = (0.0, 0.0)
+        if mode == "tmerc":
+            if center_lon is None:
+                center_lon = self.origin[0]
+            self.crs = (
+                f"+proj=tmerc +lat_0={self.avg_lat!r} +lon_0={float(center_lon)!r} "
+                "+k=1 +x_0=0 +y_0=0 +ellps=WGS84 +units=m +no_defs"
+            )
+        elif mode == "utm":
+            self.crs = utm_crs(self.origin[0], self.avg_lat)
+        if self.crs is not None:
+            x, y = get_transformer(self.crs).transform(*self.origin)
+            self.offset = (float(x), float(y))
+
+    @classmethod
+    def from_lonlat(cls, longitudes, latitudes, mode="local"):
+        """
+        以输入点的平均纬度和最小经纬度建立坐标系 (与 convert_to_local_coordinates 相同)
+        """
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        if len(longitudes) == 0:
+            raise ValueError("无法为空坐标建立本地坐标系")
+        center_lon = (float(longitudes.min()) + float(longitudes.max())) / 2
+        return cls(
+            float(latitudes.mean()),
+            (float(longitudes.min()), float(latitudes.min())),
+            mode=mode,
+            center_lon=center_lon,
+        )
+
+    def to_local(self, longitudes, latitudes):
+        """
+        经纬度数组 → 本地坐标数组，形状 (n, 2)
+        """
+        if self.crs is None:
+            return lonlat_to_local(longitudes, latitudes, self.avg_lat, self.origin)
+
+        x, y = get_transformer(self.crs).transform(
+            np.asarray(longitudes, dtype=np.float64), np.asarray(latitudes, dtype=np.float64)
+        )
+        local = np.empty((np.size(x), 2), dtype=np.float64)
+        np.subtract(x, self.offset[0], out=local[:, 0])
+        np.subtract(y, self.offset[1], out=local[:, 1])
+        return local
+
+    def to_lonlat(self, local):
+        """
+        本地坐标数组 (n, 2) → (经度数组, 纬度数组)
+        """
+        local = np.asarray(local, dtype=np.float64).reshape(-1, 2)
+        if self.crs is None:
+            return self.origin[0] + local[:, 0] / self.lon_scale, self.origin[1] + local[:, 1] / self.lat_scale
+
+        longitudes, latitudes = get_transformer(self.crs).transform(
+            local[:, 0] + self.offset[0], local[:, 1] + self.offset[1], direction="INVERSE"
+        )
+        return np.asarray(longitudes, dtype=np.float64), np.asarray(latitudes, dtype=np.float64)
+
+    def transform_geometry(self, geometry):
+        """
+        将经纬度 Shapely 几何 (或几何数组) 转换为本地坐标
+        """
+        return shapely.transform(geometry, lambda coords: self.to_local(coords[:, 0], coords[:, 1]))
@@ -0,0 +1,490 @@
+import json
+import math
+import os
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+import numpy as np
+from scipy.spatial import cKDTree
+from sqlalchemy import func, select
+from app.core.config import (
+    SOIL_GRID_DIR,
+    SOIL_GRID_MAX_CELLS,
+    SOIL_GRID_NEIGHBORS,
+    SOIL_GRID_POWER,
+    SOIL_GRID_RESOLUTION,
+    SOIL_GRID_SEARCH_RADIUS,
+)
+from app.db.session import engine, is_sqlite
+from app.models.soil_sample import SOIL_PROPERTIES, SoilSample, soil_sample_rtree
+from app.services.projection import local_scales
+
+GRID_METADATA_FILE = "grid.json"
+CURRENT_GRID_FILE = "current.json"
+
+# Cells interpolated per KD-tree query, bounds the memory of one step (~100 bytes per cell)
+GRID_BLOCK_CELLS = 500_000
+
+# Incremental updates recompute square blocks of this many cells per side
+UPDATE_BLOCK_SIZE = 256
+
+# Above this share of dirty blocks a full rebuild is cheaper than updating block by block
+FULL_REBUILD_SHARE = 0.5
+
+# Decimals of the property values a point lookup returns; the grids are float32, so more
+# digits would only show float32 rounding noise (2.299999952316284 for 2.3)
+GRID_VALUE_DECIMALS = 4
+
+
+@dataclass
+class SoilGrid:
+    """
+    One generation of interpolated soil property grids.
+
+    - directory: folder holding one memory-mapped float32 .npy array per property and grid.json
+    - west / north: upper left corner of the grid, resolution: cell size (degrees)
+    - reference_latitude: latitude whose degree-to-metre scales measure distances on this grid
+    - padding: (longitude, latitude) extent of the search radius in degrees; the samples the
+      grid was built from lie at least this far inside its edges
+    - arrays: {property: memmap (height, width)}, NaN where no sample lies within the search radius
+    - fingerprint: (count, max id, last update) of the samples the grid reflects
+    """
+    directory: Path
+    west: float
+    north: float
+    resolution: float
+    width: int
+    height: int
+    reference_latitude: float
+    padding: tuple
+    arrays: dict
+    fingerprint: list
+    built_at: float
+
+    def metadata(self):
+        return {
+            "west": self.west,
+            "north": self.north,
+            "resolution": self.resolution,
+            "width": self.width,
+            "height": self.height,
+            "reference_latitude": self.reference_latitude,
+            "padding": list(self.padding),
+            "fingerprint": self.fingerprint,
+            "built_at": self.built_at,
+        }
+
+    def save_metadata(self):
+        path = self.directory / GRID_METADATA_FILE
+        temporary = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        temporary.write_text(json.dumps(self.metadata()))
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Open a grid generation written earlier, or return None when it is missing or incomplete.
+        """
+        try:
+            metadata = json.loads((directory / GRID_METADATA_FILE).read_text())
+            arrays = {name: np.load(directory / f"{name}.npy", mmap_mode="r+") for name in SOIL_PROPERTIES}
+        except (OSError, ValueError):
+            return None
+        metadata["padding"] = tuple(metadata["padding"])
+        return cls(directory=directory, arrays=arrays, **metadata)
+
+    def covers(self, longitudes, latitudes):
+        """
+        Whether the grid covers the whole search radius around every location.
+        """
+        west, south, east, north = self.bounds
+        pad_lon, pad_lat = self.padding
+        return bool(
+            np.all((longitudes >= west + pad_lon) & (longitudes <= east - pad_lon))
+            and np.all((latitudes >= south + pad_lat) & (latitudes <= north - pad_lat))
+        )
+
+    @property
+    def bounds(self):
+        return (
+            self.west,
+            self.north - self.height * self.resolution,
+            self.west + self.width * self.resolution,
+            self.north,
+        )
+
+    def cell(self, longitude, latitude):
+        """
+        (row, column) of the cell containing a location, or None outside the grid.
+        """
+        column = math.floor((longitude - self.west) / self.resolution)
+        row = math.floor((self.north - latitude) / self.resolution)
+        if 0 <= row < self.height and 0 <= column < self.width:
+            return row, column
+        return None
+
+    def values(self, longitude, latitude):
+        """
+        Interpolated property values at a location: an O(1) read of one cell per property,
+        rounded to GRID_VALUE_DECIMALS.
+
+        Returns:
+        - {property: value} or None outside the grid or farther than the search radius from any sample
+        """
+        cell = self.cell(longitude, latitude)
+        if cell is None:
+            return None
+        values = {name: round(float(array[cell]), GRID_VALUE_DECIMALS) for name, array in self.arrays.items()}
+        if any(math.isnan(value) for value in values.values()):
+            return None
+        return values
+
+    def values_at(self, longitudes, latitudes):
+        """
+        Interpolated property values at many locations with one gather per property.
+
+        Returns:
+        - array (n, len(SOIL_PROPERTIES)), NaN rows outside the grid or far from any sample
+        """
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        columns = np.floor((longitudes - self.west) / self.resolution)
+        rows = np.floor((self.north - latitudes) / self.resolution)
+        inside = (columns >= 0) & (columns < self.width) & (rows >= 0) & (rows < self.height)
+        rows = rows[inside].astype(np.intp)
+        columns = columns[inside].astype(np.intp)
+
+        values = np.full((len(longitudes), len(SOIL_PROPERTIES)), np.nan)
+        for i, name in enumerate(SOIL_PROPERTIES):
+            values[inside, i] = self.arrays[name][rows, columns]
+        return values
+
+
+def sample_fingerprint(connection):
+    """
+    Cheap summary of the sample store that changes with every insert, update and delete.
+    """
+    count, max_id, updated_at = connection.execute(
+        select(func.count(), func.max(SoilSample.id), func.max(SoilSample.updated_at))
+    ).one()
+    return [count, max_id, None if updated_at is None else str(updated_at)]
+
+
+def read_samples(connection, bbox=None):
+    """
+    Coordinates and property values of the samples, optionally within a bounding box.
+
+    Returns:
+    - (longitudes, latitudes, values of shape (n, len(SOIL_PROPERTIES)))
+    """
+    columns = [SoilSample.longitude, SoilSample.latitude] + [getattr(SoilSample, name) for name in SOIL_PROPERTIES]
+    statement = select(*columns)
+    if bbox is not None:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        if is_sqlite:
+            rtree = soil_sample_rtree.c
+            statement = statement.join(soil_sample_rtree, rtree.id == SoilSample.id).where(
+                rtree.max_lon >= min_lon, rtree.min_lon <= max_lon,
+                rtree.max_lat >= min_lat, rtree.min_lat <= max_lat,
+            )
+        statement = statement.where(
+            SoilSample.longitude.between(min_lon, max_lon),
+            SoilSample.latitude.between(min_lat, max_lat),
+        )
+
+    rows = connection.execute(statement).all()
+    data = np.array([tuple(row) for row in rows], dtype=np.float64).reshape(-1, len(columns))
+    return data[:, 0], data[:, 1], data[:, 2:]
+
+
+class SoilGridBuilder:
+    """
+    Builds and maintains IDW-interpolated grids of the soil properties in a background thread.
+
+    - Each property is a float32 grid in degrees (memory-mapped .npy files), so a point query
+      reads one cell per property however many samples there are
+    - Every cell is the inverse distance weighted mean of the nearest samples within the search
+      radius; a sample therefore only changes cells within that radius of it, and writes to the
+      soil data trigger an update of just those cells (mark_dirty)
+    - A full rebuild writes a new generation next to the current one and swaps it in when done,
+      so queries keep being answered meanwhile; it also runs when the samples changed while the
+      application was down (detected with sample_fingerprint) or grew past the grid's extent
+    - Run the builder in one process only (e.g. a single uvicorn worker); it owns the grid files
+    """
+
+    def __init__(self, directory, resolution, max_cells, search_radius, neighbors, power):
+        self.directory = Path(directory)
+        self.resolution = resolution
+        self.max_cells = max_cells
+        self.search_radius = search_radius
+        self.neighbors = neighbors
+        self.power = power
+        self.grid = None
+        self.condition = threading.Condition()
+        self.pending_rebuild = False
+        self.pending_locations = []
+        self.stopping = False
+        self.thread = None
+        self.last_error = None
+
+    def start(self):
+        """
+        Open the current grids and start the background thread (call at application startup).
+        """
+        if self.thread is not None:
+            return
+        self.grid = self.load_current()
+        with engine.connect() as connection:
+            fingerprint = sample_fingerprint(connection)
+        self.stopping = False
+        self.pending_rebuild = self.grid is None or self.grid.fingerprint != fingerprint
+        self.thread = threading.Thread(target=self.run, name="soil-grid-builder", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=30)
+            self.thread = None
+
+    def load_current(self):
+        try:
+            name = json.loads((self.directory / CURRENT_GRID_FILE).read_text())["directory"]
+        except (OSError, ValueError, KeyError):
+            return None
+        return SoilGrid.load(self.directory / name)
+
+    def request_rebuild(self):
+        with self.condition:
+            self.pending_rebuild = True
+            self.condition.notify()
+
+    def mark_dirty(self, longitudes, latitudes):
+        """
+        Queue an update of the cells around samples written at the given locations (call after commit).
+        """
+        if self.thread is None:
+            # Not running: the next start() sees the changed fingerprint and rebuilds
+            return
+        with self.condition:
+            self.pending_locations.append((np.atleast_1d(longitudes), np.atleast_1d(latitudes)))
+            self.condition.notify()
+
+    def current(self):
+        """
+        The grid generation queries should read.
+
+        Raises LookupError while no grid has been built yet.
+        """
+        grid = self.grid
+        if grid is None:
+            raise LookupError("Soil property grids are not available yet")
+        return grid
+
+    def values(self, longitude, latitude):
+        """
+        Interpolated soil properties at a location, see SoilGrid.values.
+        """
+        return self.current().values(longitude, latitude)
+
+    def values_at(self, longitudes, latitudes):
+        """
+        Interpolated soil properties at many locations, see SoilGrid.values_at.
+        """
+        return self.current().values_at(longitudes, latitudes)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not (self.stopping or self.pending_rebuild or self.pending_locations):
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                rebuild, self.pending_rebuild = self.pending_rebuild, False
+                locations, self.pending_locations = self.pending_locations, []
+
+            try:
+                if rebuild or not self.update(locations):
+                    self.rebuild()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+
+    def grid_layout(self, longitudes, latitudes):
+        """
+        Extent, resolution and distance scales of a grid covering the samples plus the search radius.
+        """
+        reference_latitude = float((latitudes.min() + latitudes.max()) / 2)
+        lon_scale, lat_scale = local_scales(reference_latitude)
+        padding = (self.search_radius / lon_scale, self.search_radius / lat_scale)
+
+        resolution = self.resolution
+        while True:
+            west = math.floor((longitudes.min() - padding[0]) / resolution) * resolution
+            south = math.floor((latitudes.min() - padding[1]) / resolution) * resolution
+            width = math.ceil((longitudes.max() + padding[0] - west) / resolution) + 1
+            height = math.ceil((latitudes.max() + padding[1] - south) / resolution) + 1
+            if width * height <= self.max_cells:
+                break
+            resolution *= math.sqrt(width * height / self.max_cells) * 1.01
+        return west, south + height * resolution, resolution, width, height, reference_latitude, padding
+
+    def rebuild(self):
+        """
+        Interpolate all grids from scratch into a new generation and swap it in.
+        """
+        with engine.connect() as connection:
+            fingerprint = sample_fingerprint(connection)
+            longitudes, latitudes, values = read_samples(connection)
+        if len(longitudes) == 0:
+            return
+
+        west, north, resolution, width, height, reference_latitude, padding = self.grid_layout(longitudes, latitudes)
+        directory = self.directory / f"grid-{uuid.uuid4().hex}"
+        directory.mkdir(parents=True)
+        try:
+            arrays = {
+                name: np.lib.format.open_memmap(directory / f"{name}.npy", mode="w+", dtype=np.float32, shape=(height, width))
+                for name in SOIL_PROPERTIES
+            }
+            grid = SoilGrid(
+                directory=directory, west=west, north=north, resolution=resolution, width=width, height=height,
+                reference_latitude=reference_latitude, padding=padding, arrays=arrays,
+                fingerprint=fingerprint, built_at=time.time(),
+            )
+            self.interpolate(grid, longitudes, latitudes, values, 0, height, 0, width)
+            for array in arrays.values():
+                array.flush()
+            grid.save_metadata()
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+
+        current = self.directory / CURRENT_GRID_FILE
+        temporary = current.with_name(f".{current.name}.{uuid.uuid4().hex}")
+        temporary.write_text(json.dumps({"directory": directory.name}))
+        os.replace(temporary, current)
+
+        self.grid = grid
+        # Readers still holding the previous generation keep their mappings after the unlink
+        for path in self.directory.glob("grid-*"):
+            if path != directory:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def update(self, locations):
+        """
+        Re-interpolate the blocks of cells within the search radius of the given locations.
+
+        Returns:
+        - False when a full rebuild is needed instead (no grid yet, locations outside its
+          extent, or most of the grid affected)
+        """
+        grid = self.grid
+        if grid is None:
+            return False
+        longitudes = np.concatenate([location[0] for location in locations]).astype(np.float64)
+        latitudes = np.concatenate([location[1] for location in locations]).astype(np.float64)
+        if not grid.covers(longitudes, latitudes):
+            return False
+
+        pad_lon, pad_lat = grid.padding
+        block_rows = math.ceil(grid.height / UPDATE_BLOCK_SIZE)
+        block_columns = math.ceil(grid.width / UPDATE_BLOCK_SIZE)
+        block_span = UPDATE_BLOCK_SIZE * grid.resolution
+
+        def block_range(low, high, origin, sign, count):
+            first = np.floor(sign * (low - origin) / block_span).astype(np.int64)
+            last = np.floor(sign * (high - origin) / block_span).astype(np.int64)
+            first, last = np.minimum(first, last), np.maximum(first, last)
+            return np.clip(first, 0, count - 1), np.clip(last, 0, count - 1)
+
+        column_first, column_last = block_range(longitudes - pad_lon, longitudes + pad_lon, grid.west, 1, block_columns)
+        row_first, row_last = block_range(latitudes + pad_lat, latitudes - pad_lat, grid.north, -1, block_rows)
+        dirty = np.zeros((block_rows, block_columns), dtype=bool)
+        for r0, r1, c0, c1 in zip(row_first.tolist(), row_last.tolist(), column_first.tolist(), column_last.tolist()):
+            dirty[r0:r1 + 1, c0:c1 + 1] = True
+        if dirty.sum() > FULL_REBUILD_SHARE * dirty.size:
+            return False
+
+        with engine.connect() as connection:
+            fingerprint = sample_fingerprint(connection)
+            for block_row, block_column in np.argwhere(dirty).tolist():
+                r0 = block_row * UPDATE_BLOCK_SIZE
+                r1 = min(r0 + UPDATE_BLOCK_SIZE, grid.height)
+                c0 = block_column * UPDATE_BLOCK_SIZE
+                c1 = min(c0 + UPDATE_BLOCK_SIZE, grid.width)
+                west = grid.west + c0 * grid.resolution
+                north = grid.north - r0 * grid.resolution
+                bbox = (
+                    west - pad_lon,
+                    north - (r1 - r0) * grid.resolution - pad_lat,
+                    west + (c1 - c0) * grid.resolution + pad_lon,
+                    north + pad_lat,
+                )
+                self.interpolate(grid, *read_samples(connection, bbox), r0, r1, c0, c1)
+
+        for array in grid.arrays.values():
+            array.flush()
+        grid.fingerprint = fingerprint
+        grid.save_metadata()
+        return True
+
+    def interpolate(self, grid, longitudes, latitudes, values, r0, r1, c0, c1):
+        """
+        Fill grid rows r0:r1, columns c0:c1 by IDW from the given samples.
+
+        Distances are measured in metres with the grid's reference latitude scales; cells without
+        a sample within the search radius become NaN.
+        """
+        lon_scale, lat_scale = local_scales(grid.reference_latitude)
+        xs = (grid.west + (np.arange(c0, c1) + 0.5) * grid.resolution) * lon_scale
+        width = c1 - c0
+        if len(longitudes) == 0:
+            for array in grid.arrays.values():
+                array[r0:r1, c0:c1] = np.nan
+            return
+
+        tree = cKDTree(np.column_stack((longitudes * lon_scale, latitudes * lat_scale)))
+        neighbors = min(self.neighbors, len(longitudes))
+        # Missing neighbours come back with index len(values): pad with a row of zeros
+        padded = np.vstack((values, np.zeros((1, values.shape[1]))))
+
+        rows_per_block = max(1, GRID_BLOCK_CELLS // width)
+        for start in range(r0, r1, rows_per_block):
+            stop = min(start + rows_per_block, r1)
+            ys = (grid.north - (np.arange(start, stop) + 0.5) * grid.resolution) * lat_scale
+            query = np.column_stack((np.tile(xs, stop - start), np.repeat(ys, width)))
+
+            distances, idx = tree.query(
+                query, k=neighbors, distance_upper_bound=self.search_radius, workers=-1
+            )
+            distances = distances.reshape(len(query), neighbors)
+            idx = idx.reshape(len(query), neighbors)
+
+            # Cells on top of a sample take its value
+            exact = distances[:, 0] == 0
+            with np.errstate(divide="ignore"):
+                weights = np.where(idx < len(values), 1.0 / distances ** self.power, 0.0)
+            weights[exact] = 0.0
+            weights[exact, 0] = 1.0
+            total = weights.sum(axis=1)
+
+            with np.errstate(invalid="ignore", divide="ignore"):
+                for i, name in enumerate(SOIL_PROPERTIES):
+                    block = (weights * padded[idx, i]).sum(axis=1) / total
+                    grid.arrays[name][start:stop, c0:c1] = block.reshape(stop - start, width)
+
+
+soil_grid_builder = SoilGridBuilder(
+    SOIL_GRID_DIR,
+    SOIL_GRID_RESOLUTION,
+    SOIL_GRID_MAX_CELLS,
+    SOIL_GRID_SEARCH_RADIUS,
+    SOIL_GRID_NEIGHBORS,
+    SOIL_GRID_POWER,
+)
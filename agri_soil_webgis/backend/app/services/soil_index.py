@@ -0,0 +1,192 @@
+import threading
+import time
+from dataclasses import dataclass
+import numpy as np
+from scipy.spatial import cKDTree
+from sqlalchemy import select
+from app.db.session import engine
+from app.models.soil_sample import SoilSample
+from app.services.soil_grids import sample_fingerprint
+
+# Mean earth radius (m) of the spherical distances
+EARTH_RADIUS = 6371008.8
+
+# Rows read from the sample store per step while building, bounds the transient memory
+INDEX_READ_BATCH = 100_000
+
+# Most samples one nearest query returns
+MAX_NEAREST = 10000
+
+
+def unit_vectors(longitudes, latitudes):
+    """
+    Points on the unit sphere, shape (n, 3). Chord lengths between them grow monotonically with
+    the great-circle distance, so a 3-D KD-tree over them answers nearest queries anywhere on
+    earth without a map projection.
+    """
+    longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+    cos_latitudes = np.cos(latitudes)
+    return np.column_stack((cos_latitudes * np.cos(longitudes), cos_latitudes * np.sin(longitudes), np.sin(latitudes)))
+
+
+def chord_length(distance):
+    """
+    Chord length on the unit sphere of a great-circle distance in metres.
+    """
+    return 2 * np.sin(np.minimum(np.asarray(distance, dtype=np.float64) / (2 * EARTH_RADIUS), np.pi / 2))
+
+
+def great_circle_distance(chord):
+    """
+    Great-circle distance in metres of a chord length on the unit sphere (inf stays inf).
+    """
+    chord = np.asarray(chord, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        return np.where(np.isinf(chord), np.inf, 2 * EARTH_RADIUS * np.arcsin(np.clip(chord / 2, 0, 1)))
+
+
+@dataclass(frozen=True)
+class SampleIndexSnapshot:
+    """
+    One immutable generation of the nearest-sample index.
+
+    - ids: sample ids in tree order
+    - tree: cKDTree over the samples' unit_vectors
+    - fingerprint: (count, max id, last update) of the samples the index reflects
+    """
+    ids: np.ndarray
+    tree: object
+    fingerprint: list
+    built_at: float
+
+    def nearest(self, longitudes, latitudes, k=1, radius=None):
+        """
+        The k nearest samples of many locations, optionally only those within radius metres.
+
+        Returns:
+        - (ids (n, k), distances in metres (n, k)), nearest first; id -1 and distance inf
+          where fewer than k samples qualify
+        """
+        k = min(k, len(self.ids))
+        query = unit_vectors(longitudes, latitudes)
+        if k == 0:
+            return np.full((len(query), 0), -1, dtype=np.int64), np.full((len(query), 0), np.inf)
+        upper_bound = np.inf if radius is None else float(chord_length(radius)) * (1 + 1e-9)
+        chords, index = self.tree.query(query, k=k, distance_upper_bound=upper_bound)
+        chords = np.asarray(chords).reshape(len(query), k)
+        index = np.asarray(index).reshape(len(query), k)
+        found = index < len(self.ids)
+        ids = np.where(found, self.ids[np.minimum(index, len(self.ids) - 1)], -1)
+        return ids, great_circle_distance(np.where(found, chords, np.inf))
+
+
+def read_sample_locations(connection):
+    """
+    Ids and unit vectors of all samples, read in INDEX_READ_BATCH row steps.
+    """
+    result = connection.execution_options(yield_per=INDEX_READ_BATCH).execute(
+        select(SoilSample.id, SoilSample.longitude, SoilSample.latitude)
+    )
+    ids, vectors = [np.empty(0, dtype=np.int64)], [np.empty((0, 3))]
+    for rows in result.partitions():
+        # Plain tuples: numpy converts Row objects element by element, ~40x slower
+        data = np.array([tuple(row) for row in rows], dtype=np.float64).reshape(-1, 3)
+        ids.append(data[:, 0].astype(np.int64))
+        vectors.append(unit_vectors(data[:, 1], data[:, 2]))
+    return np.concatenate(ids), np.concatenate(vectors)
+
+
+class SoilSampleIndex:
+    """
+    In-memory nearest-sample index over the soil sample store, shared by all requests.
+
+    - Queries read the current snapshot without locks; a rebuild reads the samples into a new
+      snapshot in a background thread and swaps it in with one assignment, so queries never
+      see a half-built index
+    - Writes to the soil data call mark_dirty; writes arriving during a rebuild are folded
+      into one more rebuild, so bulk imports cost one rebuild rather than one per row.
+      Until it finishes, queries answer from the previous snapshot
+    - Rebuilds are skipped when the samples' fingerprint has not changed
+    """
+
+    def __init__(self):
+        self.snapshot = None
+        self.condition = threading.Condition()
+        self.pending = False
+        self.stopping = False
+        self.thread = None
+        self.last_error = None
+
+    def start(self):
+        """
+        Start the background thread and build the first snapshot (call at application startup).
+        """
+        if self.thread is not None:
+            return
+        self.stopping = False
+        self.pending = True
+        self.thread = threading.Thread(target=self.run, name="soil-sample-index", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=30)
+            self.thread = None
+
+    def mark_dirty(self):
+        """
+        Queue a rebuild after samples were written (call after commit).
+        """
+        if self.thread is None:
+            return
+        with self.condition:
+            self.pending = True
+            self.condition.notify()
+
+    def current(self):
+        """
+        The snapshot queries should read.
+
+        Raises LookupError while the index has not been built yet.
+        """
+        snapshot = self.snapshot
+        if snapshot is None:
+            raise LookupError("The soil sample index is not available yet")
+        return snapshot
+
+    def nearest(self, longitudes, latitudes, k=1, radius=None):
+        """
+        The k nearest samples of many locations, see SampleIndexSnapshot.nearest.
+        """
+        return self.current().nearest(longitudes, latitudes, k, radius)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not (self.stopping or self.pending):
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                self.pending = False
+
+            try:
+                self.rebuild()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+
+    def rebuild(self):
+        with engine.connect() as connection:
+            fingerprint = sample_fingerprint(connection)
+            if self.snapshot is not None and self.snapshot.fingerprint == fingerprint:
+                return
+            ids, vectors = read_sample_locations(connection)
+        tree = cKDTree(vectors, balanced_tree=False, compact_nodes=False)
+        self.snapshot = SampleIndexSnapshot(ids=ids, tree=tree, fingerprint=fingerprint, built_at=time.time())
+
+
+soil_sample_index = SoilSampleIndex()
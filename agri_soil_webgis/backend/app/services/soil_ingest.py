@@ -0,0 +1,461 @@
+import codecs
+import json
+import shutil
+import sqlite3
+import struct
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, insert, select
+from app.models.soil_sample import SOIL_PROPERTIES, SoilSample, utc_now
+from app.schemas.soil_data import SoilDataBase
+from app.services.projection import get_transformer
+from app.services.soil_grids import soil_grid_builder
+from app.services.soil_index import soil_sample_index
+from app.services.soil_tiles import assign_thinning_levels, invalidate_soil_tiles
+
+INGEST_FORMATS = ("csv", "geojson", "gpkg")
+INGEST_COLUMNS = ("longitude", "latitude", "soil_type", *SOIL_PROPERTIES)
+NUMERIC_COLUMNS = ("longitude", "latitude", *SOIL_PROPERTIES)
+
+# Parsers put a per-row reason in this column for rows they could not read (e.g. non-Point geometry)
+ERROR_COLUMN = "_error"
+
+# At most this many rejected rows are listed in the report (all are counted)
+MAX_REPORTED_REJECTS = 1000
+
+SOIL_TYPE_MAX_LENGTH = SoilSample.__table__.c.soil_type.type.length
+STREAM_READ_SIZE = 1024 * 1024
+SQLITE_MAGIC = b"SQLite format 3\x00"
+
+# GeoPackage geometry header envelope sizes (bytes) by envelope indicator
+GEOPACKAGE_ENVELOPE_SIZES = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+
+def field_bounds(model, name):
+    """
+    Read the numeric bounds (ge/gt/le/lt) declared on a Pydantic model field.
+
+    Returns:
+    - list of (bound, operator name) pairs, e.g. [(0, "ge"), (14, "le")]
+    """
+    bounds = []
+    for constraint in model.model_fields[name].metadata:
+        for operator in ("ge", "gt", "le", "lt"):
+            value = getattr(constraint, operator, None)
+            if value is not None:
+                bounds.append((value, operator))
+    return bounds
+
+
+# Row constraints: the SoilDataBase field constraints plus valid WGS84 coordinates
+COLUMN_BOUNDS = {
+    "longitude": [(-180, "ge"), (180, "le")],
+    "latitude": [(-90, "ge"), (90, "le")],
+    **{name: field_bounds(SoilDataBase, name) for name in SOIL_PROPERTIES},
+}
+
+BOUND_CHECKS = {
+    "ge": (np.less, ">="),
+    "gt": (np.less_equal, ">"),
+    "le": (np.greater, "<="),
+    "lt": (np.greater_equal, "<"),
+}
+
+
+def detect_format(filename, head):
+    """
+    Pick the ingest format from the file extension, falling back to the first bytes.
+    """
+    extension = (filename or "").rsplit(".", 1)[-1].lower() if "." in (filename or "") else ""
+    if extension in ("csv", "txt"):
+        return "csv"
+    if extension in ("geojson", "json"):
+        return "geojson"
+    if extension == "gpkg":
+        return "gpkg"
+    if head.startswith(SQLITE_MAGIC):
+        return "gpkg"
+    if head.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"{"):
+        return "geojson"
+    return "csv"
+
+
+def validate_batch(frame):
+    """
+    Check one batch of rows against the column constraints with vectorized operations.
+
+    Returns:
+    - (columns of the valid rows, row positions of rejected rows, their reasons)
+    """
+    count = len(frame)
+    rejected = np.zeros(count, dtype=bool)
+    reasons = np.empty(count, dtype=object)
+
+    def reject(mask, reason):
+        new = mask & ~rejected
+        reasons[new] = reason
+        rejected[new] = True
+
+    if ERROR_COLUMN in frame:
+        errors = frame[ERROR_COLUMN].to_numpy(dtype=object)
+        has_error = pd.notna(errors)
+        reasons[has_error] = errors[has_error]
+        rejected |= has_error
+
+    columns = {}
+    for name in NUMERIC_COLUMNS:
+        if name in frame:
+            values = pd.to_numeric(frame[name], errors="coerce").to_numpy(dtype=np.float64)
+        else:
+            values = np.full(count, np.nan)
+        reject(~np.isfinite(values), f"{name} is missing or not a number")
+        for bound, operator in COLUMN_BOUNDS[name]:
+            violates, symbol = BOUND_CHECKS[operator]
+            with np.errstate(invalid="ignore"):
+                reject(violates(values, bound), f"{name} must be {symbol} {bound}")
+        columns[name] = values
+
+    soil_types = frame["soil_type"] if "soil_type" in frame else pd.Series([None] * count, dtype=object)
+    soil_types = soil_types.astype("string").str.strip()
+    reject(soil_types.isna().to_numpy() | (soil_types == "").fillna(False).to_numpy(), "soil_type is required")
+    reject(soil_types.str.len().fillna(0).to_numpy() > SOIL_TYPE_MAX_LENGTH,
+           f"soil_type must be at most {SOIL_TYPE_MAX_LENGTH} characters")
+    columns["soil_type"] = soil_types.to_numpy(dtype=object)
+
+    valid = ~rejected
+    positions = np.flatnonzero(rejected)
+    return {name: values[valid] for name, values in columns.items()}, positions, reasons[positions]
+
+
+def iter_csv_batches(stream, batch_size):
+    """
+    Read a CSV file (header row with the INGEST_COLUMNS names) in batches of batch_size rows.
+    """
+    reader = pd.read_csv(
+        stream,
+        chunksize=batch_size,
+        encoding="utf-8-sig",
+        dtype={"soil_type": "string"},
+        skipinitialspace=True,
+    )
+    try:
+        for frame in reader:
+            frame.columns = [str(column).strip().lower() for column in frame.columns]
+            yield frame
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid CSV: {e}")
+
+
+def iter_geojson_features(stream, read_size=STREAM_READ_SIZE):
+    """
+    Yield the features of a GeoJSON FeatureCollection one at a time.
+
+    The file is decoded in read_size chunks and only the feature being parsed is kept in
+    memory, so the size of the upload does not matter.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    position = 0
+    eof = False
+
+    def read_more():
+        nonlocal buffer, position, eof
+        chunk = stream.read(read_size)
+        eof = not chunk
+        buffer = buffer[position:] + text_decoder.decode(chunk, final=eof)
+        position = 0
+
+    def next_char():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if eof:
+                raise ValueError("Invalid GeoJSON: unexpected end of file")
+            read_more()
+
+    marker = '"features"'
+    while True:
+        index = buffer.find(marker, position)
+        if index >= 0:
+            position = index + len(marker)
+            break
+        if eof:
+            raise ValueError("GeoJSON must be a FeatureCollection with a features array")
+        position = max(len(buffer) - len(marker), position)
+        read_more()
+
+    for expected in ":[":
+        if next_char() != expected:
+            raise ValueError("GeoJSON features must be an array")
+        position += 1
+
+    if next_char() == "]":
+        return
+    while True:
+        next_char()
+        while True:
+            try:
+                feature, position = decoder.raw_decode(buffer, position)
+                break
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ValueError(f"Invalid GeoJSON feature: {e.msg}")
+                read_more()
+        yield feature
+
+        separator = next_char()
+        position += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError("Invalid GeoJSON: expected ',' or ']' after a feature")
+
+
+def point_location(geometry):
+    """
+    (longitude, latitude, error) of a GeoJSON geometry that must be a Point.
+    """
+    if not isinstance(geometry, dict) or geometry.get("type") != "Point":
+        return None, None, "geometry must be a Point"
+    coordinates = geometry.get("coordinates")
+    if not isinstance(coordinates, list) or len(coordinates) < 2:
+        return None, None, "Point geometry needs [longitude, latitude] coordinates"
+    return coordinates[0], coordinates[1], None
+
+
+def iter_geojson_batches(stream, batch_size):
+    """
+    Read a GeoJSON FeatureCollection of Point features in batches of batch_size features.
+    """
+    columns = None
+    for feature in iter_geojson_features(stream):
+        if columns is None:
+            columns = {name: [] for name in (*INGEST_COLUMNS, ERROR_COLUMN)}
+
+        properties = feature.get("properties") if isinstance(feature, dict) else None
+        if not isinstance(feature, dict):
+            longitude, latitude, error = None, None, "feature must be an object"
+        else:
+            longitude, latitude, error = point_location(feature.get("geometry"))
+        if not isinstance(properties, dict):
+            properties = {}
+
+        columns["longitude"].append(longitude)
+        columns["latitude"].append(latitude)
+        for name in INGEST_COLUMNS[2:]:
+            columns[name].append(properties.get(name))
+        columns[ERROR_COLUMN].append(error)
+
+        if len(columns[ERROR_COLUMN]) == batch_size:
+            yield pd.DataFrame(columns)
+            columns = None
+
+    if columns is not None:
+        yield pd.DataFrame(columns)
+
+
+def geopackage_layer(connection, layer=None):
+    """
+    Find the feature table, geometry column and spatial reference of a GeoPackage layer.
+    """
+    rows = connection.execute(
+        """
+        SELECT c.table_name, g.column_name, g.srs_id
+        FROM gpkg_contents c JOIN gpkg_geometry_columns g ON g.table_name = c.table_name
+        WHERE c.data_type = 'features'
+        ORDER BY c.table_name
+        """
+    ).fetchall()
+    if layer is not None:
+        rows = [row for row in rows if row[0] == layer]
+    if not rows:
+        raise ValueError("GeoPackage has no feature layer" + (f" named {layer}" if layer else ""))
+    if len(rows) > 1:
+        raise ValueError(f"GeoPackage has several feature layers, choose one with layer: {[row[0] for row in rows]}")
+    return rows[0]
+
+
+def geopackage_transformer(connection, srs_id):
+    """
+    Transformer from a GeoPackage spatial reference to WGS84, or None when it already is WGS84.
+    """
+    # 0 and -1 are the GeoPackage "undefined" geographic and Cartesian systems
+    if srs_id in (0, -1, 4326):
+        return None
+    row = connection.execute(
+        "SELECT organization, organization_coordsys_id FROM gpkg_spatial_ref_sys WHERE srs_id = ?", (srs_id,)
+    ).fetchone()
+    if row is None or str(row[0]).upper() != "EPSG":
+        raise ValueError(f"Unsupported GeoPackage spatial reference system: {srs_id}")
+    if int(row[1]) == 4326:
+        return None
+    return get_transformer(f"EPSG:{int(row[1])}")
+
+
+def geopackage_point(blob):
+    """
+    (x, y, error) of a GeoPackage geometry blob that must hold a Point.
+    """
+    if blob is None:
+        return None, None, "geometry is missing"
+    blob = bytes(blob)
+    if blob[:2] != b"GP" or len(blob) < 8:
+        return None, None, "invalid GeoPackage geometry"
+    flags = blob[3]
+    if flags & 0x10:
+        return None, None, "geometry is empty"
+    offset = 8 + GEOPACKAGE_ENVELOPE_SIZES.get((flags >> 1) & 0x07, 0)
+
+    wkb = blob[offset:]
+    if len(wkb) < 21:
+        return None, None, "invalid GeoPackage geometry"
+    byte_order = "<" if wkb[0] == 1 else ">"
+    geometry_type = struct.unpack(byte_order + "I", wkb[1:5])[0]
+    # ISO WKB adds 1000/2000/3000 for Z/M/ZM, extended WKB sets high flag bits
+    if (geometry_type & 0xFFFF) % 1000 != 1:
+        return None, None, "geometry must be a Point"
+    x, y = struct.unpack(byte_order + "dd", wkb[5:21])
+    return x, y, None
+
+
+def iter_geopackage_batches(stream, batch_size, layer=None):
+    """
+    Read the Point features of a GeoPackage layer in batches of batch_size features.
+
+    SQLite needs a file on disk, so the upload is copied to a temporary file in chunks first;
+    features are then read with a cursor, never all at once.
+    """
+    with tempfile.NamedTemporaryFile(suffix=".gpkg") as temporary:
+        shutil.copyfileobj(stream, temporary, STREAM_READ_SIZE)
+        temporary.flush()
+
+        try:
+            connection = sqlite3.connect(f"file:{temporary.name}?mode=ro", uri=True)
+        except sqlite3.Error as e:
+            raise ValueError(f"Invalid GeoPackage: {e}")
+        try:
+            try:
+                table, geometry_column, srs_id = geopackage_layer(connection, layer)
+                transformer = geopackage_transformer(connection, srs_id)
+                table_columns = {row[1].lower(): row[1] for row in connection.execute(f'PRAGMA table_info("{table}")')}
+                properties = [name for name in INGEST_COLUMNS[2:] if name in table_columns]
+                selected = ", ".join(f'"{name}"' for name in (geometry_column, *(table_columns[p] for p in properties)))
+                cursor = connection.execute(f'SELECT {selected} FROM "{table}"')
+            except sqlite3.Error as e:
+                raise ValueError(f"Invalid GeoPackage: {e}")
+
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                xs, ys, errors = zip(*(geopackage_point(row[0]) for row in rows))
+                longitudes = np.array([np.nan if x is None else x for x in xs], dtype=np.float64)
+                latitudes = np.array([np.nan if y is None else y for y in ys], dtype=np.float64)
+                if transformer is not None:
+                    longitudes, latitudes = transformer.transform(longitudes, latitudes, direction="INVERSE")
+
+                frame = pd.DataFrame({"longitude": longitudes, "latitude": latitudes, ERROR_COLUMN: errors})
+                for i, name in enumerate(properties, start=1):
+                    frame[name] = [row[i] for row in rows]
+                yield frame
+        finally:
+            connection.close()
+
+
+def ingest_soil_samples(db, stream, filename=None, file_format=None, batch_size=10000, layer=None):
+    """
+    Stream soil samples from a CSV, GeoJSON or GeoPackage file into the database.
+
+    Rows are parsed and validated batch by batch (vectorized, against the SoilDataBase
+    constraints); each batch's valid rows are inserted and committed in one transaction,
+    rejected rows are reported with their row number and reason. Afterwards the vector tile
+    thinning levels of the new samples are assigned in one pass and their tiles invalidated.
+
+    Parameters:
+    - db: SQLAlchemy session
+    - stream: binary file object positioned at the start of the upload
+    - filename: original file name, used to detect the format
+    - file_format: "csv", "geojson" or "gpkg"; detected from filename / content when None
+    - batch_size: rows per validation batch and transaction
+    - layer: GeoPackage layer name (needed when the file has several feature layers)
+
+    Returns:
+    - dict matching SoilDataIngestResult
+    """
+    started = time.perf_counter()
+    if file_format is None:
+        file_format = detect_format(filename, stream.read(64))
+        stream.seek(0)
+    if file_format not in INGEST_FORMATS:
+        raise ValueError(f"Unsupported format: {file_format}, expected one of {INGEST_FORMATS}")
+
+    if file_format == "csv":
+        batches = iter_csv_batches(stream, batch_size)
+    elif file_format == "geojson":
+        batches = iter_geojson_batches(stream, batch_size)
+    else:
+        batches = iter_geopackage_batches(stream, batch_size, layer)
+
+    first_id = (db.scalar(select(func.max(SoilSample.id))) or 0) + 1
+    total_rows = inserted = batch_count = rejected_count = 0
+    rejects = []
+    try:
+        for frame in batches:
+            if batch_count == 0 and file_format == "csv":
+                missing = [name for name in INGEST_COLUMNS if name not in frame.columns]
+                if missing:
+                    raise ValueError(f"CSV is missing columns: {missing}")
+
+            columns, positions, reasons = validate_batch(frame)
+            for position, reason in zip(positions.tolist(), reasons.tolist()):
+                if len(rejects) >= MAX_REPORTED_REJECTS:
+                    break
+                rejects.append({"row": total_rows + position + 1, "reason": reason})
+
+            valid_count = len(columns["longitude"])
+            if valid_count:
+                now = utc_now()
+                names = list(columns)
+                db.execute(
+                    insert(SoilSample.__table__),
+                    [
+                        dict(zip(names, values), created_at=now, updated_at=now)
+                        for values in zip(*(columns[name].tolist() for name in names))
+                    ],
+                )
+                db.commit()
+
+            total_rows += len(frame)
+            inserted += valid_count
+            rejected_count += len(positions)
+            batch_count += 1
+    except ValueError as e:
+        if inserted:
+            raise ValueError(f"{e} ({inserted} valid rows before the error were imported)") from e
+        raise
+    finally:
+        if inserted:
+            longitudes, latitudes = assign_thinning_levels(db.connection(), first_id)
+            db.commit()
+            invalidate_soil_tiles(longitudes, latitudes)
+            soil_grid_builder.mark_dirty(longitudes, latitudes)
+            soil_sample_index.mark_dirty()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "format": file_format,
+        "total_rows": total_rows,
+        "inserted": inserted,
+        "rejected": rejected_count,
+        "rejects": rejects,
+        "rejects_truncated": rejected_count > len(rejects),
+        "batches": batch_count,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(total_rows / elapsed, 1) if elapsed > 0 else 0.0,
+    }
@@ -0,0 +1,90 @@
+import numpy as np
+
+# Scoring of each soil property, in the units it is stored in (pH, %, moisture as a volume fraction):
+# (weight, zero below, optimal from, optimal to, zero above). The score is 100 inside the optimal
+# range and falls linearly to 0 at the zero bounds; an infinite bound means "the more the better".
+SOIL_QUALITY_CRITERIA = {
+    "ph_value": (0.25, 4.5, 6.0, 7.5, 8.5),
+    "organic_matter": (0.25, 0.5, 3.0, np.inf, np.inf),
+    "nitrogen": (0.15, 0.03, 0.15, np.inf, np.inf),
+    "phosphorus": (0.10, 0.01, 0.06, np.inf, np.inf),
+    "potassium": (0.10, 0.03, 0.15, np.inf, np.inf),
+    "moisture": (0.15, 0.05, 0.20, 0.40, 0.60),
+}
+
+# Properties scoring below this get a recommendation
+RECOMMENDATION_SCORE = 60
+
+# Recommendations for a property below / above its optimal range
+SOIL_QUALITY_RECOMMENDATIONS = {
+    "ph_value": ("Apply lime to raise soil pH", "Apply sulfur or acidifying fertilizers to lower soil pH"),
+    "organic_matter": ("Add organic matter (compost, manure, cover crops) to improve soil structure", None),
+    "nitrogen": ("Apply nitrogen fertilizer or rotate with legumes", None),
+    "phosphorus": ("Apply phosphate fertilizer", None),
+    "potassium": ("Apply potash fertilizer", None),
+    "moisture": ("Improve irrigation or mulch to retain soil moisture", "Improve drainage to avoid waterlogging"),
+}
+
+# (minimum quality index, fertility level), best first
+FERTILITY_LEVELS = ((80, "Very Good"), (65, "Good"), (50, "Moderate"), (35, "Poor"), (0, "Very Poor"))
+
+
+def range_score(values, zero_below, optimal_from, optimal_to, zero_above):
+    """
+    Trapezoidal 0-100 score of values against an optimal range.
+
+    All arguments broadcast against each other, so one call can score many locations
+    against many ranges; an infinite zero bound leaves that side unlimited.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rising = np.where(np.isinf(zero_below), 1.0, (values - zero_below) / (optimal_from - zero_below))
+        falling = np.where(np.isinf(zero_above), 1.0, (zero_above - values) / (zero_above - optimal_to))
+    return np.clip(np.minimum(rising, falling), 0, 1) * 100
+
+
+def property_scores(values):
+    """
+    Score each soil property.
+
+    Parameters:
+    - values: {property: value or array}
+
+    Returns:
+    - {property: score array (0-100)}
+    """
+    return {
+        name: range_score(values[name], *criteria[1:])
+        for name, criteria in SOIL_QUALITY_CRITERIA.items()
+    }
+
+
+def soil_quality_index(values):
+    """
+    Weighted soil quality index (0-100) of property values or arrays of them.
+    """
+    scores = property_scores(values)
+    return sum(SOIL_QUALITY_CRITERIA[name][0] * score for name, score in scores.items())
+
+
+def fertility_level(quality_index):
+    for minimum, level in FERTILITY_LEVELS:
+        if quality_index >= minimum:
+            return level
+    return FERTILITY_LEVELS[-1][1]
+
+
+def soil_quality_recommendations(values):
+    """
+    Management recommendations for the properties of one location, weakest first.
+    """
+    scores = property_scores(values)
+    recommendations = []
+    for name, score in sorted(scores.items(), key=lambda item: float(item[1])):
+        if score >= RECOMMENDATION_SCORE:
+            continue
+        too_low, too_high = SOIL_QUALITY_RECOMMENDATIONS[name]
+        recommendation = too_low if values[name] < SOIL_QUALITY_CRITERIA[name][2] else too_high
+        if recommendation:
+            recommendations.append(recommendation)
+    return recommendations or ["Maintain current soil management practices"]
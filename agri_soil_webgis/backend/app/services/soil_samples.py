@@ -0,0 +1,298 @@
+import numpy as np
+from sqlalchemy import select
+from app.core.responses import json_bytes
+from app.db.session import engine, is_sqlite
+from app.models.soil_sample import (
+    SOIL_PROPERTIES,
+    SOIL_SAMPLE_COLUMNS,
+    SoilSample,
+    soil_sample_rtree,
+    soil_sample_tile_rtree,
+)
+from app.services.soil_grids import soil_grid_builder
+from app.services.soil_index import great_circle_distance, soil_sample_index, unit_vectors
+from app.services.soil_tiles import (
+    CELLS_PER_TILE,
+    THINNING_MAX_ZOOM,
+    invalidate_soil_tiles,
+    mercator,
+    refresh_thinning_levels,
+    thinning_cells,
+)
+
+# Rows read from the database cursor per chunk of a streamed GeoJSON response
+GEOJSON_STREAM_BATCH = 2000
+
+
+def parse_bbox(bbox):
+    """
+    Parse a "min_lon,min_lat,max_lon,max_lat" query string.
+
+    Returns:
+    - (min_lon, min_lat, max_lon, max_lat) or None when bbox is empty
+    """
+    if not bbox:
+        return None
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise ValueError("bbox must be 'min_lon,min_lat,max_lon,max_lat'")
+    if min_lon > max_lon or min_lat > max_lat:
+        raise ValueError("bbox minimums must not exceed maximums")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def point_coordinates(location):
+    """
+    Extract (longitude, latitude) from a GeoJSON Point.
+    """
+    if location.type != "Point" or len(location.coordinates) < 2:
+        raise ValueError("location must be a GeoJSON Point with [longitude, latitude] coordinates")
+    longitude, latitude = float(location.coordinates[0]), float(location.coordinates[1])
+    if not (-180 <= longitude <= 180 and -90 <= latitude <= 90):
+        raise ValueError("location coordinates are out of range")
+    return longitude, latitude
+
+
+def soil_sample_filters(soil_type=None, min_ph=None, max_ph=None, bbox=None, zoom=None):
+    """
+    Build the SQL conditions for the soil data filters.
+
+    The bounding box is answered by the R-tree on SQLite (the exact column test removes
+    points the float32 R-tree boxes let through) and by the longitude/latitude index elsewhere.
+    With a zoom below THINNING_MAX_ZOOM, SQLite only returns the samples the vector tiles draw
+    at that zoom, read from the tile R-tree's stored thinning levels; other databases thin
+    while streaming (see stream_soil_geojson).
+    """
+    conditions = []
+    if soil_type is not None:
+        conditions.append(SoilSample.soil_type == soil_type)
+    if min_ph is not None:
+        conditions.append(SoilSample.ph_value >= min_ph)
+    if max_ph is not None:
+        conditions.append(SoilSample.ph_value <= max_ph)
+    if is_sqlite and zoom is not None and zoom < THINNING_MAX_ZOOM:
+        rtree = soil_sample_tile_rtree.c
+        tile_conditions = [rtree.min_zoom <= zoom]
+        if bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            tile_conditions += [
+                rtree.max_lon >= min_lon, rtree.min_lon <= max_lon,
+                rtree.max_lat >= min_lat, rtree.min_lat <= max_lat,
+            ]
+        conditions.append(SoilSample.id.in_(select(rtree.id).where(*tile_conditions)))
+        if bbox is not None:
+            conditions.append(SoilSample.longitude.between(min_lon, max_lon))
+            conditions.append(SoilSample.latitude.between(min_lat, max_lat))
+    elif bbox is not None:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        if is_sqlite:
+            rtree = soil_sample_rtree.c
+            conditions.append(SoilSample.id.in_(
+                select(rtree.id).where(
+                    rtree.max_lon >= min_lon,
+                    rtree.min_lon <= max_lon,
+                    rtree.max_lat >= min_lat,
+                    rtree.min_lat <= max_lat,
+                )
+            ))
+        conditions.append(SoilSample.longitude.between(min_lon, max_lon))
+        conditions.append(SoilSample.latitude.between(min_lat, max_lat))
+    return conditions
+
+
+def query_soil_samples(db, after_id=None, limit=100, soil_type=None, min_ph=None, max_ph=None, bbox=None):
+    """
+    Fetch one keyset page of soil samples ordered by id.
+
+    Pages are addressed by the last id of the previous page instead of an OFFSET, so the
+    database seeks straight to the page start and deep pages cost the same as the first one.
+
+    Returns:
+    - (rows, next_after_id); next_after_id is None on the last page
+    """
+    statement = select(*SOIL_SAMPLE_COLUMNS).where(*soil_sample_filters(soil_type, min_ph, max_ph, bbox))
+    if after_id is not None:
+        statement = statement.where(SoilSample.id > after_id)
+    rows = db.execute(statement.order_by(SoilSample.id).limit(limit + 1)).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1].id
+    return rows, None
+
+
+def soil_sample_features(rows):
+    """
+    GeoJSON Point features of (id, longitude, latitude, soil_type, *SOIL_PROPERTIES) rows,
+    unpacked by position (several times faster than attribute access for large batches).
+    """
+    return [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [longitude, latitude]},
+            "properties": {"id": sample_id, "soil_type": soil_type, **dict(zip(SOIL_PROPERTIES, values))},
+        }
+        for sample_id, longitude, latitude, soil_type, *values in rows
+    ]
+
+
+def stream_soil_geojson(conditions, after_id=None, limit=None, zoom=None):
+    """
+    Write the matching samples as a GeoJSON FeatureCollection, one chunk per cursor batch.
+
+    Rows are encoded as they come off a streaming cursor (GEOJSON_STREAM_BATCH at a time) on a
+    connection of its own, so memory stays bounded however many samples match and the first
+    bytes go out as soon as the first batch is read. Where the thinning levels are not stored
+    (other databases than SQLite), a zoom below THINNING_MAX_ZOOM keeps the first, i.e. lowest
+    id, sample of every thinning cell in the page, the same rule the vector tiles use.
+
+    The keyset cursor of the next page is taken from the streamed rows themselves (one row past
+    limit is read to tell whether there is more) and written after the features as
+    "next_after_id", null on the last page.
+
+    Yields:
+    - bytes
+    """
+    statement = select(*SOIL_SAMPLE_COLUMNS[:4 + len(SOIL_PROPERTIES)]).where(*conditions)
+    if after_id is not None:
+        statement = statement.where(SoilSample.id > after_id)
+    statement = statement.order_by(SoilSample.id)
+    if limit is not None:
+        statement = statement.limit(limit + 1)
+    thin = not is_sqlite and zoom is not None and zoom < THINNING_MAX_ZOOM
+    occupied = set()
+    read, last_id, truncated = 0, None, False
+
+    yield b'{"type":"FeatureCollection","features":['
+    separator = b""
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=GEOJSON_STREAM_BATCH).execute(statement)
+        for rows in result.partitions():
+            if limit is not None and read + len(rows) > limit:
+                rows = rows[:limit - read]
+                truncated = True
+            read += len(rows)
+            if not rows:
+                continue
+            last_id = rows[-1].id
+            if thin:
+                cells = CELLS_PER_TILE << zoom
+                cx, cy = thinning_cells(*mercator([row.longitude for row in rows], [row.latitude for row in rows]), zoom)
+                kept = []
+                for row, key in zip(rows, (cx * cells + cy).tolist()):
+                    if key not in occupied:
+                        occupied.add(key)
+                        kept.append(row)
+                rows = kept
+            if not rows:
+                continue
+            # One encoder call per batch; strip the list brackets to splice it into the stream
+            yield separator + json_bytes(soil_sample_features(rows))[1:-1]
+            separator = b","
+    yield b'],"next_after_id":' + json_bytes(last_id if truncated else None) + b"}"
+
+
+def nearest_soil_samples(db, longitude, latitude, k=10, radius=None):
+    """
+    The k nearest samples of a location from the in-memory index, optionally within radius metres.
+
+    The rows are read by id, so samples deleted since the last index rebuild are dropped and
+    distances are measured to the stored coordinates.
+
+    Returns:
+    - [(row, distance in metres)], nearest first
+    """
+    ids, _ = soil_sample_index.nearest([longitude], [latitude], k, radius)
+    ids = ids[0][ids[0] >= 0].tolist()
+    if not ids:
+        return []
+    rows = db.execute(select(*SOIL_SAMPLE_COLUMNS).where(SoilSample.id.in_(ids))).all()
+    if not rows:
+        return []
+
+    vectors = unit_vectors([row.longitude for row in rows], [row.latitude for row in rows])
+    distances = great_circle_distance(np.linalg.norm(vectors - unit_vectors([longitude], [latitude]), axis=1))
+    order = np.argsort(distances, kind="stable")
+    return [
+        (rows[i], float(distances[i]))
+        for i in order
+        if radius is None or distances[i] <= radius
+    ]
+
+
+def soil_sample_record(row):
+    """
+    Convert a soil sample row (or ORM object) into a SoilData dictionary.
+    """
+    record = {
+        "id": row.id,
+        "location": {"type": "Point", "coordinates": [row.longitude, row.latitude]},
+        "soil_type": row.soil_type,
+    }
+    for name in SOIL_PROPERTIES:
+        record[name] = getattr(row, name)
+    record["created_at"] = row.created_at
+    record["updated_at"] = row.updated_at
+    return record
+
+
+def create_soil_sample(db, soil_data):
+    """
+    Insert a sample from a SoilDataCreate model and return the stored object.
+    """
+    longitude, latitude = point_coordinates(soil_data.location)
+    sample = SoilSample(
+        longitude=longitude,
+        latitude=latitude,
+        **soil_data.model_dump(exclude={"location"}),
+    )
+    db.add(sample)
+    db.flush()
+    refresh_thinning_levels(db, longitude, latitude)
+    db.commit()
+    invalidate_soil_tiles(longitude, latitude)
+    soil_grid_builder.mark_dirty(longitude, latitude)
+    soil_sample_index.mark_dirty()
+    return sample
+
+
+def update_soil_sample(db, sample, soil_data):
+    """
+    Apply the fields set in a SoilDataUpdate model to a stored sample.
+    """
+    changes = soil_data.model_dump(exclude_unset=True, exclude={"location"})
+    if soil_data.location is not None:
+        changes["longitude"], changes["latitude"] = point_coordinates(soil_data.location)
+    for name, value in changes.items():
+        if value is None:
+            raise ValueError(f"{name} cannot be null")
+
+    locations = {(sample.longitude, sample.latitude)}
+    for name, value in changes.items():
+        setattr(sample, name, value)
+    locations.add((sample.longitude, sample.latitude))
+
+    db.flush()
+    if len(locations) > 1:
+        for longitude, latitude in locations:
+            refresh_thinning_levels(db, longitude, latitude)
+    db.commit()
+    invalidate_soil_tiles(*zip(*locations))
+    soil_grid_builder.mark_dirty(*zip(*locations))
+    soil_sample_index.mark_dirty()
+    return sample
+
+
+def delete_soil_sample(db, sample):
+    """
+    Delete a stored sample.
+    """
+    location = (sample.longitude, sample.latitude)
+    db.delete(sample)
+    db.flush()
+    refresh_thinning_levels(db, *location)
+    db.commit()
+    invalidate_soil_tiles(*location)
+    soil_grid_builder.mark_dirty(*location)
+    soil_sample_index.mark_dirty()
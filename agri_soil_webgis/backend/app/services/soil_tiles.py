@@ -0,0 +1,332 @@
+import math
+import numpy as np
+from sqlalchemy import select, update
+from app.core.config import SOIL_TILE_CACHE_DIR, SOIL_TILE_DISK_CACHE_MAX_BYTES, SOIL_TILE_MEMORY_CACHE_MAX_BYTES
+from app.db.session import is_sqlite
+from app.models.soil_sample import SOIL_PROPERTIES, SOIL_SAMPLE_COLUMNS, SoilSample, soil_sample_tile_rtree
+from app.services.mvt import MVT_EXTENT, encode_point_layer, encode_tile
+from app.services.tile_cache import TileCache
+
+MAX_TILE_ZOOM = 22
+
+# Below this zoom samples are thinned to one per THINNING_CELL_PIXELS × THINNING_CELL_PIXELS screen
+# cell (the lowest id in the cell wins); from this zoom on every sample is drawn.
+THINNING_MAX_ZOOM = 16
+THINNING_CELL_PIXELS = 4
+CELLS_PER_TILE = 256 // THINNING_CELL_PIXELS
+
+# Points this far outside a tile (in tile extent units) are still encoded, so symbols
+# drawn across tile edges are not cut off
+TILE_BUFFER = 64
+
+SOIL_TILE_LAYER = "soil_samples"
+
+# SQLite R-tree of the vector tiles (see app.models.soil_sample.soil_sample_tile_rtree)
+SQLITE_TILE_RTREE_DDL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS soil_samples_tile_rtree
+    USING rtree(id, min_lon, max_lon, min_lat, max_lat, min_zoom, max_zoom)
+"""
+
+MAX_MERCATOR_LATITUDE = 85.0511287798066
+
+soil_tile_cache = TileCache(SOIL_TILE_CACHE_DIR, SOIL_TILE_MEMORY_CACHE_MAX_BYTES, SOIL_TILE_DISK_CACHE_MAX_BYTES)
+
+
+def mercator(longitudes, latitudes):
+    """
+    Normalized Web Mercator coordinates: x grows east and y grows south, both in [0, 1].
+    """
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    latitudes = np.clip(np.asarray(latitudes, dtype=np.float64), -MAX_MERCATOR_LATITUDE, MAX_MERCATOR_LATITUDE)
+    x = (longitudes + 180.0) / 360.0
+    y = 0.5 - np.log(np.tan(np.pi / 4 + np.radians(latitudes) / 2)) / (2 * np.pi)
+    return np.clip(x, 0.0, 1.0), np.clip(y, 0.0, 1.0)
+
+
+def mercator_latitude(y):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+
+def mercator_bounds(x0, y0, x1, y1):
+    """
+    Convert a normalized Mercator rectangle (x0 <= x1, y0 <= y1) to (min_lon, min_lat, max_lon, max_lat).
+    """
+    return x0 * 360.0 - 180.0, mercator_latitude(y1), x1 * 360.0 - 180.0, mercator_latitude(y0)
+
+
+def thinning_cells(mx, my, z):
+    """
+    Thinning cell indices of normalized Mercator coordinates at zoom z.
+
+    Cells at zoom z + 1 split each cell at zoom z in four, so a sample drawn at one zoom
+    is drawn at every higher zoom.
+    """
+    cells = CELLS_PER_TILE << z
+    return (
+        np.minimum((np.asarray(mx) * cells).astype(np.int64), cells - 1),
+        np.minimum((np.asarray(my) * cells).astype(np.int64), cells - 1),
+    )
+
+
+def thinning_levels(ids, longitudes, latitudes, stored=None):
+    """
+    Lowest zoom at which each sample is drawn: the first zoom where it has the lowest id in
+    its thinning cell, or THINNING_MAX_ZOOM if it never does.
+
+    Parameters:
+    - ids / longitudes / latitudes: the samples to level
+    - stored: optional (longitudes, latitudes, levels) of already leveled samples that all have
+      lower ids; a sample is then only drawn in cells none of them occupies
+
+    Returns:
+    - int8 array, shape (n,)
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    mx, my = mercator(longitudes, latitudes)
+    if stored is not None:
+        stored_mx, stored_my = mercator(stored[0], stored[1])
+        stored_levels = np.asarray(stored[2])
+
+    levels = np.full(len(ids), THINNING_MAX_ZOOM, dtype=np.int8)
+    for z in range(THINNING_MAX_ZOOM - 1, -1, -1):
+        cells = CELLS_PER_TILE << z
+        cx, cy = thinning_cells(mx, my, z)
+        keys = cx * cells + cy
+        candidates = np.arange(len(ids))
+        if stored is not None:
+            # A stored sample occupies its cell at z exactly when it is drawn at z
+            drawn = stored_levels <= z
+            stored_cx, stored_cy = thinning_cells(stored_mx[drawn], stored_my[drawn], z)
+            candidates = np.flatnonzero(~np.isin(keys, stored_cx * cells + stored_cy))
+        if len(candidates) == 0:
+            continue
+        order = candidates[np.lexsort((ids[candidates], keys[candidates]))]
+        sorted_keys = keys[order]
+        levels[order[np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]]] = z
+    return levels
+
+
+def refresh_thinning_levels(db, longitude, latitude):
+    """
+    Recompute the thinning levels in the cells containing one location after a sample was
+    inserted at, moved from/to or deleted at it (call inside the write transaction).
+
+    Walks from the finest zoom down; at each zoom the candidates for the cell are the samples
+    drawn at the next finer zoom (at most one per sub-cell), so every step reads a handful of
+    rows from the tile R-tree regardless of how many samples the cell holds.
+    """
+    if not is_sqlite:
+        return
+
+    rtree = soil_sample_tile_rtree.c
+    mx, my = mercator(longitude, latitude)
+    for z in range(THINNING_MAX_ZOOM - 1, -1, -1):
+        cells = CELLS_PER_TILE << z
+        cx, cy = thinning_cells(mx, my, z)
+        min_lon, min_lat, max_lon, max_lat = mercator_bounds(cx / cells, cy / cells, (cx + 1) / cells, (cy + 1) / cells)
+        rows = db.execute(
+            select(rtree.id, rtree.min_zoom, SoilSample.longitude, SoilSample.latitude)
+            .join(SoilSample, SoilSample.id == rtree.id)
+            .where(
+                rtree.max_lon >= min_lon, rtree.min_lon <= max_lon,
+                rtree.max_lat >= min_lat, rtree.min_lat <= max_lat,
+                rtree.min_zoom <= z + 1,
+            )
+        ).all()
+        if not rows:
+            continue
+
+        # The R-tree boxes are float32, so confirm cell membership on the exact coordinates
+        ids = np.array([row.id for row in rows], dtype=np.int64)
+        current = np.array([row.min_zoom for row in rows], dtype=np.int64)
+        row_cx, row_cy = thinning_cells(*mercator([row.longitude for row in rows], [row.latitude for row in rows]), z)
+        in_cell = (row_cx == cx) & (row_cy == cy)
+        if not in_cell.any():
+            continue
+
+        ids, current = ids[in_cell], current[in_cell]
+        winner = int(np.argmin(ids))
+        levels = np.where(current <= z, z + 1, current)
+        levels[winner] = min(current[winner], z)
+        for sample_id, old, new in zip(ids.tolist(), current.tolist(), levels.tolist()):
+            if old != new:
+                db.execute(update(soil_sample_tile_rtree).where(rtree.id == sample_id).values(min_zoom=new, max_zoom=new))
+
+
+def rebuild_thinning_levels(connection):
+    """
+    Reload the tile R-tree with the thinning levels of every sample computed in one
+    vectorized pass (after bulk loads). Recreating the R-tree is much faster than deleting
+    or updating most of its entries in place.
+    """
+    if not is_sqlite:
+        return
+
+    rows = connection.execute(select(SoilSample.id, SoilSample.longitude, SoilSample.latitude)).all()
+    connection.exec_driver_sql("DROP TABLE IF EXISTS soil_samples_tile_rtree")
+    connection.exec_driver_sql(SQLITE_TILE_RTREE_DDL)
+    if not rows:
+        return
+
+    ids, longitudes, latitudes = (np.array(column) for column in zip(*rows))
+    levels = thinning_levels(ids, longitudes, latitudes).tolist()
+    connection.exec_driver_sql(
+        "INSERT INTO soil_samples_tile_rtree VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (sample_id, longitude, longitude, latitude, latitude, level, level)
+            for (sample_id, longitude, latitude), level in zip(rows, levels)
+        ],
+    )
+
+
+def assign_thinning_levels(connection, first_id):
+    """
+    Level the samples bulk-inserted with ids >= first_id, which must be greater than the ids
+    of all samples stored before them (call in the transaction after the inserts).
+
+    Older samples keep their levels, since a new sample never has the lowest id in a cell
+    they occupy. Only the older samples drawn at a thinned zoom inside the zoom-0 cells of
+    the new samples are read.
+
+    Returns:
+    - (longitudes, latitudes) of the new samples, for invalidate_soil_tiles
+    """
+    rows = connection.execute(
+        select(SoilSample.id, SoilSample.longitude, SoilSample.latitude).where(SoilSample.id >= first_id)
+    ).all()
+    if not rows:
+        return np.empty(0), np.empty(0)
+    ids, longitudes, latitudes = (np.array(column) for column in zip(*rows))
+    if not is_sqlite:
+        return longitudes, latitudes
+
+    mx, my = mercator(longitudes, latitudes)
+    cx, cy = thinning_cells(mx, my, 0)
+    min_lon, min_lat, max_lon, max_lat = mercator_bounds(
+        cx.min() / CELLS_PER_TILE, cy.min() / CELLS_PER_TILE, (cx.max() + 1) / CELLS_PER_TILE, (cy.max() + 1) / CELLS_PER_TILE
+    )
+    rtree = soil_sample_tile_rtree.c
+    stored = connection.execute(
+        select(SoilSample.longitude, SoilSample.latitude, rtree.min_zoom)
+        .join(SoilSample, SoilSample.id == rtree.id)
+        .where(
+            rtree.max_lon >= min_lon, rtree.min_lon <= max_lon,
+            rtree.max_lat >= min_lat, rtree.min_lat <= max_lat,
+            rtree.min_zoom < THINNING_MAX_ZOOM,
+            rtree.id < first_id,
+        )
+    ).all()
+    stored = tuple(np.array(column) for column in zip(*stored)) if stored else (np.empty(0), np.empty(0), np.empty(0))
+
+    levels = thinning_levels(ids, longitudes, latitudes, stored)
+    shown = np.flatnonzero(levels < THINNING_MAX_ZOOM)
+    if len(shown):
+        connection.exec_driver_sql(
+            "UPDATE soil_samples_tile_rtree SET min_zoom = ?, max_zoom = ? WHERE id = ?",
+            [(int(levels[i]), int(levels[i]), int(ids[i])) for i in shown],
+        )
+    return longitudes, latitudes
+
+
+def tile_window(z, x, y, buffer=TILE_BUFFER):
+    """
+    Normalized Mercator rectangle of a tile grown by buffer extent units on each side.
+    """
+    n = 1 << z
+    margin = buffer / MVT_EXTENT
+    return (x - margin) / n, (y - margin) / n, (x + 1 + margin) / n, (y + 1 + margin) / n
+
+
+def render_soil_tile(db, z, x, y):
+    """
+    Encode the soil samples of one XYZ tile as a Mapbox Vector Tile.
+
+    Samples are clipped to the buffered tile, thinned by zoom (see THINNING_MAX_ZOOM) and
+    quantized to the tile extent.
+
+    Returns:
+    - MVT bytes (b"" for an empty tile)
+    """
+    x0, y0, x1, y1 = tile_window(z, x, y)
+    min_lon, min_lat, max_lon, max_lat = mercator_bounds(max(x0, 0.0), max(y0, 0.0), min(x1, 1.0), min(y1, 1.0))
+
+    statement = select(*SOIL_SAMPLE_COLUMNS).where(
+        SoilSample.longitude.between(min_lon, max_lon),
+        SoilSample.latitude.between(min_lat, max_lat),
+    )
+    if is_sqlite:
+        rtree = soil_sample_tile_rtree.c
+        statement = statement.where(SoilSample.id.in_(
+            select(rtree.id).where(
+                rtree.max_lon >= min_lon, rtree.min_lon <= max_lon,
+                rtree.max_lat >= min_lat, rtree.min_lat <= max_lat,
+                rtree.min_zoom <= z,
+            )
+        ))
+    rows = db.execute(statement.order_by(SoilSample.id)).all()
+    if not rows:
+        return b""
+
+    ids = np.array([row.id for row in rows], dtype=np.int64)
+    mx, my = mercator([row.longitude for row in rows], [row.latitude for row in rows])
+    if not is_sqlite and z < THINNING_MAX_ZOOM:
+        keep = thinning_levels(ids, [row.longitude for row in rows], [row.latitude for row in rows]) <= z
+        rows = [row for row, kept in zip(rows, keep) if kept]
+        ids, mx, my = ids[keep], mx[keep], my[keep]
+
+    n = 1 << z
+    tile_x = np.rint((mx * n - x) * MVT_EXTENT).astype(np.int64)
+    tile_y = np.rint((my * n - y) * MVT_EXTENT).astype(np.int64)
+
+    properties = {"soil_type": [row.soil_type for row in rows]}
+    for name in SOIL_PROPERTIES:
+        properties[name] = [getattr(row, name) for row in rows]
+
+    layer = encode_point_layer(SOIL_TILE_LAYER, ids.tolist(), tile_x.tolist(), tile_y.tolist(), properties)
+    return encode_tile([layer])
+
+
+def affected_tiles(longitudes, latitudes):
+    """
+    Tiles whose content can change when samples are written at the given locations.
+
+    Below THINNING_MAX_ZOOM a write can change which sample represents its thinning cell,
+    so every tile whose buffered window overlaps that cell is affected; from THINNING_MAX_ZOOM
+    on only the tiles whose buffered window contains the location. A cell plus the buffer is
+    narrower than a tile, so at most 2 × 2 tiles per location and zoom are affected.
+
+    Returns:
+    - set of (z, x, y)
+    """
+    mx, my = mercator(np.atleast_1d(longitudes), np.atleast_1d(latitudes))
+    margin = TILE_BUFFER / MVT_EXTENT
+    keys = set()
+    for z in range(MAX_TILE_ZOOM + 1):
+        n = 1 << z
+        if z < THINNING_MAX_ZOOM:
+            cells = CELLS_PER_TILE << z
+            cx, cy = thinning_cells(mx, my, z)
+            x0, y0, x1, y1 = cx / cells, cy / cells, (cx + 1) / cells, (cy + 1) / cells
+        else:
+            x0 = x1 = mx
+            y0 = y1 = my
+
+        def tile_range(start, end):
+            return (
+                np.clip(np.floor(start * n - margin), 0, n - 1).astype(np.int64),
+                np.clip(np.floor(end * n + margin), 0, n - 1).astype(np.int64),
+            )
+
+        tile_x = tile_range(x0, x1)
+        tile_y = tile_range(y0, y1)
+        # One int64 per tile (x * n + y) keeps the de-duplication a plain 1-D sort
+        tiles = np.unique(np.concatenate([xs * n + ys for xs in tile_x for ys in tile_y]))
+        keys.update((z, x, y) for x, y in zip((tiles // n).tolist(), (tiles % n).tolist()))
+    return keys
+
+
+def invalidate_soil_tiles(longitudes, latitudes):
+    """
+    Drop the cached tiles affected by writes at the given locations (call after commit).
+    """
+    soil_tile_cache.invalidate(affected_tiles(longitudes, latitudes))
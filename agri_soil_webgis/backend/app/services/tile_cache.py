@@ -0,0 +1,157 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from app.services.cache import LRUCache
+
+
+def cached_matches(keys, entries):
+    if len(keys) <= len(entries):
+        return [key for key in keys if key in entries]
+    return [key for key in entries if key in keys]
+
+
+class TileCache:
+    """
+    Two-level (memory + disk) LRU cache for encoded XYZ tiles.
+
+    - Tiles are stored as {directory}/{z}/{x}/{y}{suffix}; the disk index is rebuilt from
+      the files (oldest modification first) the first time the cache is used
+    - Both levels evict least recently used tiles once their byte budget is exceeded
+    - invalidate() drops individual tiles; a tile rendered while an invalidation was in
+      progress is not stored (see put), so stale tiles never reach the cache
+    - The memory level is per process; run a single worker or share only the disk level
+    """
+
+    def __init__(self, directory, memory_max_bytes, disk_max_bytes, suffix=".mvt"):
+        self.directory = Path(directory)
+        self.suffix = suffix
+        self.memory = LRUCache(memory_max_bytes)
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_entries = OrderedDict()
+        self.disk_bytes = 0
+        self.disk_loaded = False
+        self.epoch = 0
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        z, x, y = key
+        return self.directory / str(z) / str(x) / f"{y}{self.suffix}"
+
+    def load_disk_index(self):
+        """
+        Index the tiles already on disk (called with the lock held).
+        """
+        if self.disk_loaded:
+            return
+        self.disk_loaded = True
+        if not self.directory.is_dir():
+            return
+
+        files = []
+        for path in self.directory.glob(f"*/*/*{self.suffix}"):
+            try:
+                key = (int(path.parent.parent.name), int(path.parent.name), int(path.name[:-len(self.suffix)]))
+                stat = path.stat()
+            except (ValueError, OSError):
+                continue
+            files.append((stat.st_mtime, key, stat.st_size))
+
+        for _, key, size in sorted(files):
+            self.disk_entries[key] = size
+            self.disk_bytes += size
+        self.evict_disk()
+
+    def evict_disk(self):
+        while self.disk_bytes > self.disk_max_bytes and self.disk_entries:
+            key, size = self.disk_entries.popitem(last=False)
+            self.disk_bytes -= size
+            self.path(key).unlink(missing_ok=True)
+
+    def current_epoch(self):
+        """
+        Token to pass to put(); take it before reading the data a tile is rendered from.
+        """
+        with self.lock:
+            return self.epoch
+
+    def get(self, key):
+        content = self.memory.get(key)
+        if content is not None:
+            return content
+
+        with self.lock:
+            self.load_disk_index()
+            if key not in self.disk_entries:
+                return None
+            self.disk_entries.move_to_end(key)
+            try:
+                content = self.path(key).read_bytes()
+            except OSError:
+                self.disk_bytes -= self.disk_entries.pop(key)
+                return None
+            self.memory.put(key, content, len(content))
+        return content
+
+    def put(self, key, content, epoch):
+        """
+        Store a rendered tile unless the cache was invalidated after epoch was taken.
+        """
+        with self.lock:
+            if epoch != self.epoch:
+                return
+            self.load_disk_index()
+            self.memory.put(key, content, len(content))
+
+            path = self.path(key)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                temporary = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+                temporary.write_bytes(content)
+                os.replace(temporary, path)
+            except OSError:
+                return
+
+            previous = self.disk_entries.pop(key, None)
+            if previous is not None:
+                self.disk_bytes -= previous
+            self.disk_entries[key] = len(content)
+            self.disk_bytes += len(content)
+            self.evict_disk()
+
+    def invalidate(self, keys):
+        """
+        Remove the given tiles from both levels.
+
+        Walks whichever is smaller, the keys or the cached entries, so bulk writes that touch
+        many tiles cost no more than the cache size.
+        """
+        keys = set(keys)
+        with self.lock:
+            self.epoch += 1
+            self.load_disk_index()
+            for key in cached_matches(keys, set(self.memory.keys())):
+                self.memory.pop(key)
+            for key in cached_matches(keys, self.disk_entries):
+                self.disk_bytes -= self.disk_entries.pop(key)
+                self.path(key).unlink(missing_ok=True)
+
+    def clear(self):
+        with self.lock:
+            self.epoch += 1
+            self.memory.clear()
+            self.load_disk_index()
+            for key in self.disk_entries:
+                self.path(key).unlink(missing_ok=True)
+            self.disk_entries.clear()
+            self.disk_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "memory": self.memory.stats(),
+                "disk_entries": len(self.disk_entries),
+                "disk_bytes": self.disk_bytes,
+                "disk_max_bytes": self.disk_max_bytes,
+            }
@@ -0,0 +1,349 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import numpy as np
+from scipy.spatial import Delaunay, QhullError
+from app.core.config import TIN_SESSION_MAX, TIN_SESSION_TTL
+from app.services.earthwork import as_boundary_geometry, clip_triangles, integrate_tin_volumes
+from app.services.projection import LocalFrame
+
+# 三角形键编码: 三个顶点槽位各占21位，单个会话最多分配 2^21 个槽位
+SLOT_BITS = 21
+MAX_SLOTS = 1 << SLOT_BITS
+
+
+def encode_triangles(triangles):
+    """
+    将三角形顶点槽位编码为 int64 键 (顶点先排序，与顶点顺序无关)
+    """
+    ordered = np.sort(np.asarray(triangles, dtype=np.int64).reshape(-1, 3), axis=1)
+    return (ordered[:, 0] << (2 * SLOT_BITS)) | (ordered[:, 1] << SLOT_BITS) | ordered[:, 2]
+
+
+class TINSession:
+    """
+    服务端保存的三角网编辑会话
+
+    采样点保存在只增不减的"槽位"数组中，槽位的平面位置一旦写入就不再改变:
+    - 插入点: 分配新槽位，通过 Delaunay(incremental=True).add_points 增量加入三角网
+    - 修改平面位置: 旧槽位失效，分配新槽位 (对外的点ID不变)
+    - 删除点: 槽位失效
+
+    Qhull 不支持删除顶点，存在失效槽位时用剩余的有效槽位重建三角剖分。
+    无论哪种情况，都只对新出现的三角形做边界裁剪和体积积分，消失的三角形
+    从汇总值中扣除，未变化的三角形沿用已有结果。只修改高程时三角网不变，
+    只重新积分与被修改点相邻的三角形。
+    """
+
+    def __init__(self, boundary_coordinates, longitudes, latitudes, original_heights, target_heights,
+                 projection="local"):
+        boundary = np.asarray(boundary_coordinates, dtype=np.float64)
+        if len(boundary) < 3:
+            raise ValueError("多边形至少需要3个顶点")
+        if len(longitudes) < 3:
+            raise ValueError("至少需要3个采样点才能形成三角网")
+
+        self.id = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.last_access = time.time()
+
+        # 本地坐标系: 边界平均纬度 + 边界最小经纬度为原点，边界与采样点共用
+        self.frame = LocalFrame.from_lonlat(boundary[:, 0], boundary[:, 1], mode=projection)
+        boundary_local = self.frame.to_local(boundary[:, 0], boundary[:, 1])
+        self.boundary = as_boundary_geometry(boundary_local)
+        self.area = float(self.boundary.area)
+
+        count = len(longitudes)
+        self.xy = self.frame.to_local(longitudes, latitudes)
+        self.lonlat = np.column_stack((longitudes, latitudes)).astype(np.float64)
+        self.original_heights = np.asarray(original_heights, dtype=np.float64).copy()
+        self.target_heights = np.asarray(target_heights, dtype=np.float64).copy()
+        self.active = np.ones(count, dtype=bool)
+
+        # 对外的点ID与槽位的对应关系
+        self.id_of_slot = np.arange(count, dtype=np.int64)
+        self.slot_of_id = {i: i for i in range(count)}
+        self.next_id = count
+
+        # 当前三角剖分中的全部三角形 (槽位)，以及裁剪结果和体积
+        self.keys = np.empty(0, dtype=np.int64)
+        self.triangles = np.empty((0, 3), dtype=np.int64)
+        self.kept = np.empty(0, dtype=bool)
+        self.volumes = np.empty(0, dtype=np.float64)
+        self.cut_volume = 0.0
+        self.fill_volume = 0.0
+
+        self.rebuild()
+        self.refresh_triangles()
+
+    @property
+    def point_count(self):
+        return int(self.active.sum())
+
+    @property
+    def triangle_count(self):
+        return int(self.kept.sum())
+
+    def rebuild(self):
+        """
+        用全部有效槽位重建 Delaunay 三角剖分
+        """
+        self.vertex_slots, self.delaunay = self.triangulate(self.xy, self.active)
+
+    @staticmethod
+    def triangulate(xy, active):
+        """
+        对有效槽位做 Delaunay 三角剖分，不修改会话
+
+        返回:
+        - (参与剖分的槽位数组, Delaunay 对象)
+        """
+        vertex_slots = np.flatnonzero(active)
+        try:
+            return vertex_slots, Delaunay(xy[vertex_slots], incremental=True)
+        except QhullError:
+            raise ValueError("采样点无法形成三角网，请确认至少有3个不共线的点")
+
+    def apply_volume_change(self, removed, added):
+        """
+        从汇总值中扣除 removed 的体积并加上 added 的体积
+        """
+        self.fill_volume += float(added[added > 0].sum()) - float(removed[removed > 0].sum())
+        self.cut_volume += float(-added[added < 0].sum()) - float(-removed[removed < 0].sum())
+
+    def refresh_triangles(self):
+        """
+        将当前三角剖分与上一次的结果比较，只处理发生变化的三角形
+
+        返回:
+        - (新增的保留三角形, 移除的保留三角形)，均为槽位索引数组
+        """
+        current = self.vertex_slots[self.delaunay.simplices]
+        keys = encode_triangles(current)
+
+        is_new = ~np.isin(keys, self.keys)
+        is_removed = ~np.isin(self.keys, keys)
+
+        # 新出现的三角形: 边界裁剪 + 体积积分
+        new_triangles = current[is_new]
+        new_keys = keys[is_new]
+        new_kept = np.zeros(len(new_triangles), dtype=bool)
+        new_volumes = np.zeros(len(new_triangles), dtype=np.float64)
+        if len(new_triangles):
+            clipped = clip_triangles(self.xy, new_triangles, self.boundary)
+            new_kept = np.isin(new_keys, encode_triangles(clipped))
+            result = integrate_tin_volumes(
+                self.xy, new_triangles[new_kept], self.original_heights, self.target_heights
+            )
+            new_volumes[new_kept] = result.volumes
+
+        removed_kept = self.kept[is_removed]
+        removed_triangles = self.triangles[is_removed][removed_kept]
+        self.apply_volume_change(self.volumes[is_removed][removed_kept], new_volumes[new_kept])
+
+        unchanged = ~is_removed
+        self.keys = np.concatenate((self.keys[unchanged], new_keys))
+        self.triangles = np.concatenate((self.triangles[unchanged], new_triangles))
+        self.kept = np.concatenate((self.kept[unchanged], new_kept))
+        self.volumes = np.concatenate((self.volumes[unchanged], new_volumes))
+
+        return new_triangles[new_kept], removed_triangles
+
+    def reintegrate_slots(self, slots):
+        """
+        只修改了高程时，重新积分与这些槽位相邻的保留三角形
+        """
+        affected = self.kept & np.isin(self.triangles, slots).any(axis=1)
+        if not affected.any():
+            return
+        result = integrate_tin_volumes(
+            self.xy, self.triangles[affected], self.original_heights, self.target_heights
+        )
+        self.apply_volume_change(self.volumes[affected], result.volumes)
+        self.volumes[affected] = result.volumes
+
+    def apply_edits(self, inserts=(), updates=(), deletes=()):
+        """
+        批量应用点位编辑
+
+        参数:
+        - inserts: 新增点列表 [{"longitude", "latitude", "original_height", "target_height"}, ...]
+        - updates: 修改列表 [{"id", 可选 "longitude"/"latitude"/"original_height"/"target_height"}, ...]
+        - deletes: 删除的点ID列表
+
+        返回:
+        - 字典: inserted_ids、added_triangles、removed_triangles (三角形以点ID表示)
+        """
+        # 先校验全部编辑，避免部分应用
+        edited_ids = list(deletes) + [update["id"] for update in updates]
+        for point_id in edited_ids:
+            if point_id not in self.slot_of_id:
+                raise ValueError(f"点不存在: {point_id}")
+        if len(set(edited_ids)) != len(edited_ids):
+            raise ValueError("同一个点在一次编辑中只能修改或删除一次")
+        if len(self.slot_of_id) - len(deletes) + len(inserts) < 3:
+            raise ValueError("至少需要3个采样点才能形成三角网")
+
+        deactivated = []
+        height_updates = []
+        new_points = []
+        new_ids = []
+
+        for point_id in deletes:
+            deactivated.append(self.slot_of_id[point_id])
+
+        for update in updates:
+            point_id = update["id"]
+            slot = self.slot_of_id[point_id]
+
+            lon = update.get("longitude")
+            lat = update.get("latitude")
+            moved = (lon is not None and lon != self.lonlat[slot, 0]) or (lat is not None and lat != self.lonlat[slot, 1])
+            original_height = update.get("original_height", self.original_heights[slot])
+            target_height = update.get("target_height", self.target_heights[slot])
+
+            if moved:
+                # 平面位置变化: 旧槽位失效，以同一ID插入新槽位
+                deactivated.append(slot)
+                new_points.append((
+                    self.lonlat[slot, 0] if lon is None else lon,
+                    self.lonlat[slot, 1] if lat is None else lat,
+                    original_height,
+                    target_height,
+                ))
+                new_ids.append(point_id)
+            else:
+                height_updates.append((slot, original_height, target_height))
+
+        inserted_ids = list(range(self.next_id, self.next_id + len(inserts)))
+        for point in inserts:
+            new_points.append((
+                point["longitude"],
+                point["latitude"],
+                point.get("original_height", 0),
+                point.get("target_height", 0),
+            ))
+        new_ids += inserted_ids
+
+        # 新点位的槽位 (槽位数组只增不减)
+        values = np.asarray(new_points, dtype=np.float64).reshape(-1, 4)
+        start = len(self.xy)
+        if start + len(values) > MAX_SLOTS:
+            raise ValueError("会话中的点位编辑次数过多，请重新创建会话")
+        slots = np.arange(start, start + len(values))
+        xy = np.concatenate((self.xy, self.frame.to_local(values[:, 0], values[:, 1]))) if len(slots) else self.xy
+        active = np.concatenate((self.active, np.ones(len(slots), dtype=bool)))
+        active[deactivated] = False
+
+        # 先完成三角剖分再修改会话，剖分失败时会话保持不变
+        if deactivated:
+            vertex_slots, delaunay = self.triangulate(xy, active)
+        elif len(slots):
+            try:
+                self.delaunay.add_points(xy[slots])
+                vertex_slots, delaunay = np.concatenate((self.vertex_slots, slots)), self.delaunay
+            except QhullError:
+                try:
+                    vertex_slots, delaunay = self.triangulate(xy, active)
+                except ValueError:
+                    # 增量加入失败后原剖分不再可靠，按编辑前的有效槽位重建
+                    self.rebuild()
+                    raise
+        else:
+            vertex_slots, delaunay = self.vertex_slots, self.delaunay
+
+        # 提交编辑
+        for point_id in deletes:
+            del self.slot_of_id[point_id]
+        for slot, original_height, target_height in height_updates:
+            self.original_heights[slot] = original_height
+            self.target_heights[slot] = target_height
+        if len(slots):
+            self.xy = xy
+            self.lonlat = np.concatenate((self.lonlat, values[:, :2]))
+            self.original_heights = np.concatenate((self.original_heights, values[:, 2]))
+            self.target_heights = np.concatenate((self.target_heights, values[:, 3]))
+            self.id_of_slot = np.concatenate((self.id_of_slot, np.asarray(new_ids, dtype=np.int64)))
+            for point_id, slot in zip(new_ids, slots.tolist()):
+                self.slot_of_id[point_id] = slot
+        self.next_id += len(inserts)
+        self.active = active
+        self.vertex_slots, self.delaunay = vertex_slots, delaunay
+        height_slots = [slot for slot, _, _ in height_updates]
+
+        added, removed = self.refresh_triangles()
+        if height_slots:
+            self.reintegrate_slots(np.asarray(height_slots))
+
+        return {
+            "inserted_ids": inserted_ids,
+            "added_triangles": self.id_of_slot[added].tolist(),
+            "removed_triangles": self.id_of_slot[removed].tolist(),
+        }
+
+    def kept_triangle_ids(self):
+        """
+        当前保留的全部三角形，以点ID表示，形状 (m, 3)
+        """
+        return self.id_of_slot[self.triangles[self.kept]]
+
+    def summary(self):
+        return {
+            "session_id": self.id,
+            "area": round(self.area, 2),
+            "cut_volume": round(self.cut_volume, 2),
+            "fill_volume": round(self.fill_volume, 2),
+            "net_volume": round(self.fill_volume - self.cut_volume, 2),
+            "point_count": self.point_count,
+            "triangle_count": self.triangle_count,
+            "unit": "m³",
+        }
+
+
+class TINSessionStore:
+    """
+    内存中的三角网编辑会话表
+
+    - 会话在最后一次访问 ttl 秒后过期
+    - 最多保留 max_sessions 个会话，超出时清除最久未访问的会话
+    """
+
+    def __init__(self, ttl=TIN_SESSION_TTL, max_sessions=TIN_SESSION_MAX):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, session):
+        with self.lock:
+            self.prune()
+            while len(self.sessions) >= self.max_sessions:
+                self.sessions.popitem(last=False)
+            self.sessions[session.id] = session
+        return session
+
+    def get(self, session_id):
+        with self.lock:
+            self.prune()
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.last_access = time.time()
+                self.sessions.move_to_end(session_id)
+            return session
+
+    def remove(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def prune(self):
+        now = time.time()
+        expired = [
+            session_id for session_id, session in self.sessions.items()
+            if now - session.last_access > self.ttl
+        ]
+        for session_id in expired:
+            del self.sessions[session_id]
+
+
+tin_session_store = TINSessionStore()
@@ -0,0 +1,398 @@
+import math
+import numpy as np
+import shapely
+import shapely.geometry
+from rasterio.features import rasterize
+from rasterio.transform import from_origin
+from rasterio.windows import Window, transform as window_transform
+from starlette.concurrency import run_in_threadpool
+from app.models.soil_sample import SOIL_PROPERTIES
+from app.services.erosion import (
+    MAX_MAP_PIXELS,
+    DEMGrid,
+    erosion_risk_level,
+    erosion_tile_cache,
+    soil_loss_window,
+)
+from app.services.projection import get_transformer
+
+# Layers zonal statistics can be computed for: the interpolated soil properties and the RUSLE soil loss
+SOIL_LOSS_LAYER = "soil_loss"
+ZONAL_LAYERS = (*SOIL_PROPERTIES, SOIL_LOSS_LAYER)
+
+DEFAULT_PERCENTILES = (10, 25, 50, 75, 90)
+
+# Most field polygons per request
+MAX_ZONAL_FIELDS = 10000
+
+# Soil grid cells labelled and reduced per step (square blocks), bounds the memory of one step
+ZONAL_BLOCK_SIZE = 1024
+
+# Erosion factor tiles fetched (and computed in the process pool) per step
+ZONAL_TILE_BATCH = 16
+
+# Histogram bins per zone and layer that percentiles are interpolated from; a percentile is
+# accurate to (zone max - zone min) / PERCENTILE_BINS
+PERCENTILE_BINS = 256
+
+
+def zonal_layers(names):
+    """
+    Validate requested layer names, all layers when None.
+    """
+    if not names:
+        return list(ZONAL_LAYERS)
+    unknown = sorted(set(names) - set(ZONAL_LAYERS))
+    if unknown:
+        raise ValueError(f"Unknown layers: {', '.join(unknown)}; available: {', '.join(ZONAL_LAYERS)}")
+    return list(dict.fromkeys(names))
+
+
+def validate_percentiles(percentiles):
+    percentiles = list(DEFAULT_PERCENTILES if percentiles is None else percentiles)
+    if not all(0 <= percentile <= 100 for percentile in percentiles):
+        raise ValueError("Percentiles must be between 0 and 100")
+    return percentiles
+
+
+def field_polygons(features):
+    """
+    Shapely geometries of GeoJSON field features.
+
+    Parameters:
+    - features: app.schemas.geojson.Feature list, Polygon or MultiPolygon in WGS84
+
+    Returns:
+    - Shapely geometry array, shape (n,)
+    """
+    if not features:
+        raise ValueError("At least one field polygon is required")
+    if len(features) > MAX_ZONAL_FIELDS:
+        raise ValueError(f"At most {MAX_ZONAL_FIELDS} fields are allowed per request, got {len(features)}")
+
+    polygons = np.empty(len(features), dtype=object)
+    for i, feature in enumerate(features):
+        geometry = feature.geometry
+        if geometry.type not in ("Polygon", "MultiPolygon"):
+            raise ValueError(f"Feature {i} must be a Polygon or MultiPolygon, got {geometry.type}")
+        try:
+            polygons[i] = shapely.geometry.shape(geometry.model_dump())
+        except (ValueError, TypeError, IndexError, shapely.errors.GEOSException):
+            raise ValueError(f"Feature {i} has malformed {geometry.type} coordinates")
+
+    invalid = np.flatnonzero(~shapely.is_valid(polygons))
+    if len(invalid):
+        raise ValueError(f"Invalid field polygons (self-intersections etc.): {invalid[:10].tolist()}")
+    return polygons
+
+
+class ZonalAccumulator:
+    """
+    Grouped statistics of one raster layer over labelled zones, reduced block by block.
+
+    Zones are labelled 1..zones (0 is outside every zone). Memory depends on the number of
+    zones, not on the number of pixels: the first pass collects count, sum, sum of squares,
+    minimum and maximum with np.bincount / ufunc.at, the second a fixed-size histogram per
+    zone between its minimum and maximum, from which percentiles are interpolated.
+    """
+
+    def __init__(self, zones, histogram_bins):
+        self.histogram_bins = histogram_bins
+        self.bins = histogram_bins * math.ceil(PERCENTILE_BINS / histogram_bins)
+        self.count = np.zeros(zones + 1, dtype=np.int64)
+        self.sum = np.zeros(zones + 1)
+        self.sum_squares = np.zeros(zones + 1)
+        self.minimum = np.full(zones + 1, np.inf)
+        self.maximum = np.full(zones + 1, -np.inf)
+        self.histogram = np.zeros((zones + 1, self.bins), dtype=np.int32)
+
+    @staticmethod
+    def valid(labels, values):
+        keep = labels > 0
+        keep &= ~np.isnan(values)
+        return labels[keep], values[keep].astype(np.float64)
+
+    def add_moments(self, labels, values):
+        labels, values = self.valid(labels, values)
+        if not len(labels):
+            return
+        size = len(self.count)
+        self.count += np.bincount(labels, minlength=size)
+        self.sum += np.bincount(labels, weights=values, minlength=size)
+        self.sum_squares += np.bincount(labels, weights=values * values, minlength=size)
+        np.minimum.at(self.minimum, labels, values)
+        np.maximum.at(self.maximum, labels, values)
+
+    def add_histogram(self, labels, values):
+        """
+        Second pass: bin the values between the minimum and maximum of their zone.
+        """
+        labels, values = self.valid(labels, values)
+        if not len(labels):
+            return
+        low = self.minimum[labels]
+        span = self.maximum[labels] - low
+        with np.errstate(divide="ignore", invalid="ignore"):
+            position = np.where(span > 0, (values - low) / span * self.bins, 0)
+        keys = labels * self.bins + np.clip(position.astype(np.int64), 0, self.bins - 1)
+        # Count only the key range present in this block instead of zones × bins
+        first = int(keys.min())
+        counts = np.bincount(keys - first)
+        self.histogram.reshape(-1)[first:first + len(counts)] += counts
+
+    def add_pixels(self, labels, values):
+        """
+        Add single pixels of zones that have no other pixels (both passes at once).
+        """
+        self.add_moments(labels, values)
+        self.add_histogram(labels, values)
+
+    def percentiles(self, percentiles):
+        """
+        Percentiles of every zone interpolated linearly within histogram bins, shape (zones + 1, len(percentiles)).
+        """
+        cumulative = np.cumsum(self.histogram, axis=1)
+        with np.errstate(invalid="ignore"):
+            width = np.nan_to_num((self.maximum - self.minimum) / self.bins)
+        rows = np.arange(len(self.count))
+        result = np.empty((len(self.count), len(percentiles)))
+        for i, percentile in enumerate(percentiles):
+            target = self.count * (percentile / 100)
+            index = np.minimum((cumulative < target[:, None]).sum(axis=1), self.bins - 1)
+            before = np.where(index > 0, cumulative[rows, np.maximum(index - 1, 0)], 0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                fraction = np.clip((target - before) / self.histogram[rows, index], 0, 1)
+            result[:, i] = np.clip(self.minimum + (index + np.nan_to_num(fraction)) * width, self.minimum, self.maximum)
+        return result
+
+    def statistics(self, percentiles):
+        """
+        Per-zone statistics in label order (zone 1 first), None for zones without valid pixels.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = self.sum / self.count
+            std = np.sqrt(np.maximum(self.sum_squares / self.count - mean * mean, 0))
+        quantiles = self.percentiles(percentiles)
+        histogram = self.histogram.reshape(len(self.count), self.histogram_bins, -1).sum(axis=2)
+        names = [f"p{percentile:g}" for percentile in percentiles]
+
+        results = []
+        for zone in range(1, len(self.count)):
+            count = int(self.count[zone])
+            if not count:
+                results.append(None)
+                continue
+            low, high = float(self.minimum[zone]), float(self.maximum[zone])
+            results.append({
+                "count": count,
+                "mean": float(mean[zone]),
+                "std": float(std[zone]),
+                "min": low,
+                "max": high,
+                "percentiles": dict(zip(names, quantiles[zone].tolist())),
+                "histogram": {
+                    "edges": np.linspace(low, high, self.histogram_bins + 1).tolist(),
+                    "counts": histogram[zone].tolist(),
+                },
+            })
+        return results
+
+
+def window_zones(tree, transform, windows):
+    """
+    The zone polygons overlapping each pixel window, found with one STRtree query.
+
+    Parameters:
+    - tree: STRtree of the zone polygons, in the raster's CRS
+    - transform: affine transform of the whole raster
+    - windows: pixel windows
+
+    Returns:
+    - [(window, indices of the polygons overlapping it)] for windows touched by any polygon
+    """
+    if not windows:
+        return []
+    boxes = np.empty(len(windows), dtype=object)
+    for i, window in enumerate(windows):
+        west, north = transform * (window.col_off, window.row_off)
+        east, south = transform * (window.col_off + window.width, window.row_off + window.height)
+        boxes[i] = shapely.box(min(west, east), min(north, south), max(west, east), max(north, south))
+    window_ids, zone_ids = tree.query(boxes, predicate="intersects")
+
+    order = np.argsort(window_ids, kind="stable")
+    window_ids, zone_ids = window_ids[order], zone_ids[order]
+    splits = np.flatnonzero(np.diff(window_ids)) + 1
+    return [
+        (windows[ids[0]], zones)
+        for ids, zones in zip(np.split(window_ids, splits), np.split(zone_ids, splits))
+        if len(ids)
+    ]
+
+
+def zone_labels(tree, transform, window, zones):
+    """
+    Label mask of a window: all polygons overlapping it rasterized in one pass, each burnt with
+    its 1-based index in the tree (0 elsewhere) into the pixels whose centre it contains; where
+    polygons overlap, the later one wins.
+
+    Returns:
+    - int32 array (rows, cols)
+    """
+    return rasterize(
+        zip(tree.geometries[zones], (zones + 1).tolist()),
+        out_shape=(window.height, window.width),
+        transform=window_transform(window, transform),
+        fill=0,
+        dtype="int32",
+    )
+
+
+def pixel_window(transform, bounds, width, height):
+    """
+    Pixel window of a bounding box in the raster's CRS, clipped to the raster, or None outside it.
+    """
+    min_x, min_y, max_x, max_y = bounds
+    columns, rows = zip(*(~transform * (x, y) for x in (min_x, max_x) for y in (min_y, max_y)))
+    row_start, row_stop = max(math.floor(min(rows)), 0), min(math.ceil(max(rows)), height)
+    col_start, col_stop = max(math.floor(min(columns)), 0), min(math.ceil(max(columns)), width)
+    if row_start >= row_stop or col_start >= col_stop:
+        return None
+    return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+
+def representative_pixels(transform, polygons, labelled):
+    """
+    Fallback pixels of the fields too small or thin to contain a pixel centre: the pixel under
+    a point on each such polygon's surface, so every field inside the raster gets a value.
+
+    Parameters:
+    - labelled: labelled pixel count per zone (index 0 = background) from the first pass
+
+    Returns:
+    - (labels, rows, columns) int64 arrays
+    """
+    zones = np.flatnonzero(labelled[1:] == 0)
+    points = shapely.point_on_surface(polygons[zones])
+    columns, rows = ~transform * (shapely.get_x(points), shapely.get_y(points))
+    return zones + 1, np.floor(rows).astype(np.int64), np.floor(columns).astype(np.int64)
+
+
+def window_pixels(pixels, window):
+    """
+    The fallback pixels within a window, with rows and columns relative to it.
+    """
+    labels, rows, columns = pixels
+    rows = rows - window.row_off
+    columns = columns - window.col_off
+    inside = (rows >= 0) & (rows < window.height) & (columns >= 0) & (columns < window.width)
+    return labels[inside], rows[inside], columns[inside]
+
+
+def soil_grid_statistics(grid, polygons, layers, percentiles, histogram_bins):
+    """
+    Zonal statistics of soil property grids over field polygons.
+
+    The grids are read in ZONAL_BLOCK_SIZE blocks of the memory-mapped arrays covering the
+    polygons, so memory stays bounded whatever the size and number of fields.
+
+    Returns:
+    - {layer: per-field statistics list (see ZonalAccumulator.statistics)}
+    """
+    accumulators = {name: ZonalAccumulator(len(polygons), histogram_bins) for name in layers}
+    transform = from_origin(grid.west, grid.north, grid.resolution, grid.resolution)
+    window = pixel_window(transform, shapely.total_bounds(polygons), grid.width, grid.height)
+    blocks = []
+    if window is not None:
+        blocks = [
+            Window(col, row, min(ZONAL_BLOCK_SIZE, window.col_off + window.width - col), min(ZONAL_BLOCK_SIZE, window.row_off + window.height - row))
+            for row in range(window.row_off, window.row_off + window.height, ZONAL_BLOCK_SIZE)
+            for col in range(window.col_off, window.col_off + window.width, ZONAL_BLOCK_SIZE)
+        ]
+    tree = shapely.STRtree(polygons)
+    blocks = window_zones(tree, transform, blocks)
+
+    labelled = np.zeros(len(polygons) + 1, dtype=np.int64)
+    for block, zones in blocks:
+        labels = zone_labels(tree, transform, block, zones)
+        labelled += np.bincount(labels.ravel(), minlength=len(labelled))
+        for name, accumulator in accumulators.items():
+            accumulator.add_moments(labels, grid.arrays[name][block.toslices()])
+
+    pixels = representative_pixels(transform, polygons, labelled)
+    for block, zones in blocks:
+        labels = zone_labels(tree, transform, block, zones)
+        extra, rows, columns = window_pixels(pixels, block)
+        for name, accumulator in accumulators.items():
+            values = grid.arrays[name][block.toslices()]
+            accumulator.add_histogram(labels, values)
+            accumulator.add_pixels(extra, values[rows, columns])
+    return {name: accumulator.statistics(percentiles) for name, accumulator in accumulators.items()}
+
+
+async def soil_loss_statistics(model, polygons, organic_matter_at, percentiles, histogram_bins, cache=erosion_tile_cache):
+    """
+    Zonal statistics of the RUSLE annual soil loss (t/ha/a) over field polygons.
+
+    Only the DEM tiles touched by a polygon are processed, ZONAL_TILE_BATCH at a time: their
+    factor rasters come from the tile cache (computed in the process pool when missing) and
+    each tile is labelled and reduced on its own.
+
+    Returns:
+    - per-field statistics list (see ZonalAccumulator.statistics)
+    """
+    grid = await run_in_threadpool(DEMGrid.open, model)
+    if not grid.geographic:
+        transformer = get_transformer(grid.crs)
+        polygons = shapely.transform(polygons, lambda coords: np.column_stack(transformer.transform(coords[:, 0], coords[:, 1])))
+
+    accumulator = ZonalAccumulator(len(polygons), histogram_bins)
+    window = pixel_window(grid.transform, shapely.total_bounds(polygons), grid.width, grid.height)
+    keys = [] if window is None else grid.tile_keys(window, model.tile_size)
+    # Only the tiles some polygon touches are computed and read
+    tree = shapely.STRtree(polygons)
+    tiles = window_zones(tree, grid.transform, [grid.tile_window(key, model.tile_size) for key in keys])
+    if len(tiles) * model.tile_size ** 2 > MAX_MAP_PIXELS:
+        raise ValueError(f"The fields span {len(tiles)} DEM tiles, at most {MAX_MAP_PIXELS // model.tile_size ** 2} are allowed; send fewer fields per request")
+
+    labelled = np.zeros(len(polygons) + 1, dtype=np.int64)
+
+    def reduce_tiles(batch, factors, pixels):
+        for (tile, zones), (key, tile_factors) in zip(batch, factors.items()):
+            labels = zone_labels(tree, grid.transform, tile, zones)
+            soil_loss, _ = soil_loss_window(model, grid, tile, {key: tile_factors}, organic_matter_at)
+            if pixels is None:
+                labelled[:] += np.bincount(labels.ravel(), minlength=len(labelled))
+                accumulator.add_moments(labels, soil_loss)
+            else:
+                extra, rows, columns = window_pixels(pixels, tile)
+                accumulator.add_histogram(labels, soil_loss)
+                accumulator.add_pixels(extra, soil_loss[rows, columns])
+
+    pixels = None
+    for _ in range(2):
+        for start in range(0, len(tiles), ZONAL_TILE_BATCH):
+            batch = tiles[start:start + ZONAL_TILE_BATCH]
+            keys = [(tile.row_off // model.tile_size, tile.col_off // model.tile_size) for tile, _ in batch]
+            factors = await cache.tiles(model, keys)
+            await run_in_threadpool(reduce_tiles, batch, {key: factors[key] for key in keys}, pixels)
+        pixels = representative_pixels(grid.transform, polygons, labelled)
+    return accumulator.statistics(percentiles)
+
+
+def zonal_statistics_results(features, statistics):
+    """
+    One result per field in feature order: its statistics per layer and, when the soil loss
+    was computed, the erosion risk of its mean soil loss.
+    """
+    results = []
+    for i, feature in enumerate(features):
+        layers = {name: values[i] for name, values in statistics.items()}
+        result = {"id": feature.id, "statistics": layers}
+        if SOIL_LOSS_LAYER in layers:
+            soil_loss = layers[SOIL_LOSS_LAYER]
+            result["erosion_risk"] = None
+            if soil_loss is not None:
+                level, score = erosion_risk_level(soil_loss["mean"])
+                result["erosion_risk"] = {"risk_level": level, "risk_score": score}
+        results.append(result)
+    return results
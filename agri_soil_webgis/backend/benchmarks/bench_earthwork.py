@@ -0,0 +1,334 @@
+"""
+填挖方模块的规模基准测试
+
+在 backend 目录下运行:
+
+    python -m benchmarks.bench_earthwork --sizes 1000 10000 100000 --output bench.json
+    python -m benchmarks.bench_earthwork --compare old.json new.json
+
+对凸多边形、凹多边形和带洞多边形，分别生成 1e3 ~ 1e6 个采样点的合成测量数据，
+记录每个函数和接口的耗时 (wall time)、峰值内存 (tracemalloc) 和每秒处理的三角形数，
+结果写入 JSON 文件 (包含当前 git 提交)，便于在不同提交之间比较。
+"""
+import argparse
+import asyncio
+import json
+import math
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+from shapely.geometry import Polygon
+from scipy.spatial import Delaunay
+from app.api.endpoints import earthwork
+from app.services.earthwork import clip_triangles, integrate_grid_volumes, integrate_tin_volumes
+from app.services.jobs import get_process_pool
+from app.services.projection import lonlat_to_local
+
+# 合成场地: 以 (116.0, 39.0) 为左下角、边长约 1 km 的区域
+ORIGIN_LON = 116.0
+ORIGIN_LAT = 39.0
+SITE_DEGREES = 0.01
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+
+def convex_polygon():
+    """
+    近似圆形的凸多边形 (32 边形)
+    """
+    angles = np.linspace(0, 2 * np.pi, 32, endpoint=False)
+    radius = SITE_DEGREES / 2
+    return Polygon(np.column_stack((
+        ORIGIN_LON + radius + radius * np.cos(angles),
+        ORIGIN_LAT + radius + radius * np.sin(angles),
+    )))
+
+
+def concave_polygon():
+    """
+    U 形凹多边形
+    """
+    d = SITE_DEGREES
+    return Polygon([
+        (ORIGIN_LON, ORIGIN_LAT),
+        (ORIGIN_LON + d, ORIGIN_LAT),
+        (ORIGIN_LON + d, ORIGIN_LAT + d),
+        (ORIGIN_LON + 0.7 * d, ORIGIN_LAT + d),
+        (ORIGIN_LON + 0.7 * d, ORIGIN_LAT + 0.3 * d),
+        (ORIGIN_LON + 0.3 * d, ORIGIN_LAT + 0.3 * d),
+        (ORIGIN_LON + 0.3 * d, ORIGIN_LAT + d),
+        (ORIGIN_LON, ORIGIN_LAT + d),
+    ])
+
+
+def holes_polygon():
+    """
+    带两个洞的正方形 (接口只接受外环，带洞多边形只用于函数级基准)
+    """
+    d = SITE_DEGREES
+
+    def square(x0, y0, size):
+        return [
+            (ORIGIN_LON + x0 * d, ORIGIN_LAT + y0 * d),
+            (ORIGIN_LON + (x0 + size) * d, ORIGIN_LAT + y0 * d),
+            (ORIGIN_LON + (x0 + size) * d, ORIGIN_LAT + (y0 + size) * d),
+            (ORIGIN_LON + x0 * d, ORIGIN_LAT + (y0 + size) * d),
+        ]
+
+    return Polygon(square(0, 0, 1), [square(0.15, 0.15, 0.3), square(0.55, 0.55, 0.3)])
+
+
+POLYGONS = {
+    "convex": convex_polygon,
+    "concave": concave_polygon,
+    "holes": holes_polygon,
+}
+
+
+def synthetic_survey(size, seed=0):
+    """
+    在场地范围内随机生成采样点，原始高程为平滑起伏的地形，目标高程为倾斜设计面
+
+    返回:
+    - (longitudes, latitudes, original_heights, target_heights)
+    """
+    rng = np.random.default_rng(seed)
+    longitudes = ORIGIN_LON + rng.random(size) * SITE_DEGREES
+    latitudes = ORIGIN_LAT + rng.random(size) * SITE_DEGREES
+    u = (longitudes - ORIGIN_LON) / SITE_DEGREES
+    v = (latitudes - ORIGIN_LAT) / SITE_DEGREES
+    original_heights = 100 + 5 * np.sin(2 * np.pi * u) * np.cos(3 * np.pi * v) + 2 * u
+    target_heights = 100 + 1.5 * v
+    return longitudes, latitudes, original_heights, target_heights
+
+
+def polygon_coordinates(polygon):
+    """
+    多边形外环转换为接口使用的坐标字典列表 (去掉闭合点)
+    """
+    return [{"longitude": x, "latitude": y} for x, y in list(polygon.exterior.coords)[:-1]]
+
+
+def sample_point_dicts(survey):
+    longitudes, latitudes, original_heights, target_heights = survey
+    return [
+        {"longitude": x, "latitude": y, "original_height": h0, "target_height": h1}
+        for x, y, h0, h1 in zip(longitudes.tolist(), latitudes.tolist(), original_heights.tolist(), target_heights.tolist())
+    ]
+
+
+def local_polygon(polygon, avg_lat, origin):
+    """
+    将经纬度多边形 (含内环) 转换为本地坐标多边形
+    """
+    def ring(coords):
+        coords = np.asarray(coords)
+        return lonlat_to_local(coords[:, 0], coords[:, 1], avg_lat, origin)
+
+    return Polygon(ring(polygon.exterior.coords), [ring(interior.coords) for interior in polygon.interiors])
+
+
+def clear_earthwork_caches():
+    earthwork.geometry_cache.clear()
+    earthwork.result_cache.clear()
+
+
+def measure(func, repeat, trace_memory):
+    """
+    运行 func 并测量耗时和峰值内存
+
+    - 耗时取 repeat 次运行的最小值
+    - 峰值内存在单独的一次运行中用 tracemalloc 测量 (tracemalloc 会拖慢运行，不计入耗时)
+
+    返回:
+    - (最后一次运行的返回值, 耗时秒数, 峰值内存 MB 或 None)
+    """
+    best = math.inf
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        best = min(best, time.perf_counter() - start)
+
+    peak_mb = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        finally:
+            tracemalloc.stop()
+
+    return value, best, peak_mb
+
+
+def benchmark_cases(polygon_name, polygon, survey, include_endpoints):
+    """
+    生成一个多边形和一组测量数据上的全部基准用例
+
+    返回:
+    - [(名称, 可调用对象, 三角形数量提取函数或 None), ...]
+    """
+    longitudes, latitudes, original_heights, target_heights = survey
+    boundary = polygon_coordinates(polygon)
+    boundary_coords = [(p["longitude"], p["latitude"]) for p in boundary]
+    point_dicts = sample_point_dicts(survey)
+
+    avg_lat = float(np.mean([lat for _, lat in boundary_coords]))
+    origin = (min(lon for lon, _ in boundary_coords), min(lat for _, lat in boundary_coords))
+    sample_local = lonlat_to_local(longitudes, latitudes, avg_lat, origin)
+    boundary_local = local_polygon(polygon, avg_lat, origin)
+    simplices = Delaunay(sample_local).simplices
+    clipped = clip_triangles(sample_local, simplices, boundary_local)
+
+    cases = [
+        ("calculate_geographic_area", lambda: earthwork.calculate_geographic_area(boundary_coords), None),
+        ("convert_to_local_coordinates", lambda: earthwork.convert_to_local_coordinates(point_dicts, avg_lat), None),
+        ("lonlat_to_local", lambda: lonlat_to_local(longitudes, latitudes, avg_lat, origin), None),
+        ("generate_tin", lambda: earthwork.generate_tin(sample_local, boundary_local), len),
+        ("clip_triangles", lambda: clip_triangles(sample_local, simplices, boundary_local), len),
+        (
+            "integrate_tin_volumes",
+            lambda: integrate_tin_volumes(sample_local, clipped, original_heights, target_heights),
+            lambda result: len(result.volumes),
+        ),
+        (
+            "integrate_grid_volumes",
+            lambda: integrate_grid_volumes(sample_local, original_heights, target_heights, boundary_local, grid_size=5.0),
+            None,
+        ),
+    ]
+
+    if include_endpoints and polygon_name != "holes":
+        def calculate_tin(method):
+            def run():
+                clear_earthwork_caches()
+                request = earthwork.TINEarthworkCalculationRequest(
+                    polygon_coordinates=boundary,
+                    sample_points=point_dicts,
+                    calculation_method=method,
+                )
+                return asyncio.run(earthwork.calculate_tin_earthwork(request))
+            return run
+
+        def generate_sample_points():
+            return asyncio.run(earthwork.generate_sample_points({
+                "polygon_coordinates": boundary,
+                "grid_size": max(1.0, math.sqrt(polygon.area * 111_000 ** 2 / len(longitudes))),
+            }))
+
+        cases += [
+            ("endpoint:calculate-tin", calculate_tin("tin"), lambda result: len(result["triangles"])),
+            ("endpoint:calculate-tin[grid]", calculate_tin("grid"), None),
+            ("endpoint:generate-sample-points", generate_sample_points, None),
+        ]
+
+    return cases
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes, polygons, repeat, trace_memory, endpoint_max_points, only=None):
+    results = []
+    for size in sizes:
+        survey = synthetic_survey(size)
+        for polygon_name in polygons:
+            polygon = POLYGONS[polygon_name]()
+            cases = benchmark_cases(polygon_name, polygon, survey, size <= endpoint_max_points)
+            for name, func, count_triangles in cases:
+                if only and not any(pattern in name for pattern in only):
+                    continue
+                value, seconds, peak_mb = measure(func, repeat, trace_memory)
+                triangles = count_triangles(value) if count_triangles else None
+                record = {
+                    "benchmark": name,
+                    "polygon": polygon_name,
+                    "points": size,
+                    "wall_time_s": round(seconds, 6),
+                    "peak_memory_mb": None if peak_mb is None else round(peak_mb, 3),
+                    "triangles": triangles,
+                    "triangles_per_s": round(triangles / seconds, 1) if triangles and seconds > 0 else None,
+                }
+                results.append(record)
+                print(
+                    f"{name:34s} {polygon_name:8s} {size:>9d} pts "
+                    f"{seconds * 1000:10.1f} ms"
+                    + (f" {peak_mb:9.1f} MB" if peak_mb is not None else "")
+                    + (f" {record['triangles_per_s']:>12.0f} tri/s" if record["triangles_per_s"] else ""),
+                    flush=True,
+                )
+    return results
+
+
+def compare(old_path, new_path):
+    """
+    比较两次基准结果的耗时和峰值内存 (新 / 旧)
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def key(record):
+        return record["benchmark"], record["polygon"], record["points"]
+
+    previous = {key(record): record for record in old["results"]}
+    print(f"旧: {old.get('commit')}  新: {new.get('commit')}")
+    for record in new["results"]:
+        before = previous.get(key(record))
+        if before is None:
+            continue
+        time_ratio = record["wall_time_s"] / before["wall_time_s"] if before["wall_time_s"] else math.nan
+        line = f"{record['benchmark']:34s} {record['polygon']:8s} {record['points']:>9d} pts  time x{time_ratio:6.2f}"
+        if record.get("peak_memory_mb") and before.get("peak_memory_mb"):
+            line += f"  memory x{record['peak_memory_mb'] / before['peak_memory_mb']:6.2f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="填挖方模块规模基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="采样点数量")
+    parser.add_argument("--polygons", nargs="+", choices=sorted(POLYGONS), default=sorted(POLYGONS))
+    parser.add_argument("--repeat", type=int, default=1, help="每个用例的计时次数 (取最小值)")
+    parser.add_argument("--no-memory", action="store_true", help="不测量峰值内存")
+    parser.add_argument("--endpoint-max-points", type=int, default=200_000, help="接口级基准的最大采样点数")
+    parser.add_argument("--only", nargs="+", help="只运行名称包含这些字符串的用例")
+    parser.add_argument("--output", default="bench_earthwork.json", help="结果 JSON 文件")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="比较两个结果文件后退出")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # 预先启动计算进程池，避免把子进程启动时间计入第一个接口用例
+    get_process_pool().submit(int).result()
+
+    results = run_benchmarks(
+        args.sizes, args.polygons, args.repeat, not args.no_memory, args.endpoint_max_points, args.only
+    )
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()